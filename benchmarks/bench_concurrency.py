@@ -0,0 +1,105 @@
+# benchmarks/bench_concurrency.py
+#
+# Read throughput on index()/media_page() while an admin keeps saving a
+# large show through edit_media, under the default SQLite profile (WAL)
+# and under the old rollback-journal settings.
+#
+#   python -m benchmarks.bench_concurrency [seconds] [reader threads]
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from project import create_app, db
+from project.database import DEFAULT_SQLITE_PRAGMAS
+from project.schema import upgrade_database
+
+PROFILES = {
+    'rollback journal (old)': {'foreign_keys': 'ON', 'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'WAL profile (default)': DEFAULT_SQLITE_PRAGMAS,
+}
+
+def build_app(directory, pragmas):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'RENDER_CACHE_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+        'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+        'SQLITE_PRAGMAS': pragmas,
+    })
+    with app.app_context():
+        upgrade_database()
+        from project.models import Media
+        db.session.add_all(Media(title=f'Movie {i}', media_type='movie', years=str(1950 + i % 70),
+                                 official_rating=(i % 100) / 10, overall_score=(i % 100) / 10)
+                           for i in range(2000))
+        db.session.add(Media(title='Long Show', media_type='tv_show'))
+        db.session.commit()
+        show_id = Media.query.filter_by(title='Long Show').one().id
+    return app, show_id
+
+def show_payload(revision):
+    form = {'media_type': 'tv_show', 'title': 'Long Show'}
+    for s in range(1, 21):
+        form[f'season_number_{s}'] = str(s)
+        for e in range(1, 41):
+            form[f'ep_number_{s}_{e}'] = str(e)
+            form[f'ep_title_{s}_{e}'] = f'Episode {e}'
+            form[f'ep_rating_{s}_{e}'] = str((e + revision) % 10)
+    return form
+
+def run(app, show_id, seconds, readers):
+    stop = threading.Event()
+    reads, errors, writes = [0] * readers, [0] * readers, [0]
+
+    def reader(slot):
+        client = app.test_client()
+        urls = ['/?sort=score_desc', f'/media/{show_id}', '/?sort=year_asc&filter=movie']
+        n = 0
+        while not stop.is_set():
+            try:
+                response = client.get(urls[n % len(urls)])
+                if response.status_code == 200:
+                    reads[slot] += 1
+                else:
+                    errors[slot] += 1
+            except Exception:
+                errors[slot] += 1
+            n += 1
+
+    def writer():
+        client = app.test_client()
+        client.post('/login', data={'username': 'Ryan', 'password': '06242005'})
+        revision = 0
+        while not stop.is_set():
+            revision += 1
+            client.post(f'/edit_media/{show_id}', data=show_payload(revision))
+            writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(reads) / seconds, sum(errors), writes[0] / seconds
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(f'{readers} reader threads + 1 writer, {seconds:.0f}s per profile')
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            app, show_id = build_app(directory, pragmas)
+            read_rate, failed, write_rate = run(app, show_id, seconds, readers)
+            with app.app_context():
+                db.engine.dispose()
+        print(f'  {name:<24} reads/s {read_rate:8.1f}   failed reads {failed:5d}   saves/s {write_rate:5.1f}')
+
+if __name__ == '__main__':
+    main()
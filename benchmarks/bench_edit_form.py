@@ -0,0 +1,44 @@
+# benchmarks/bench_edit_form.py
+#
+# Times parse_media_children() on edit_media payloads of growing size.
+# Parsing should scale linearly with the number of form fields.
+#
+#   python -m benchmarks.bench_edit_form
+
+import time
+
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+
+from project.forms import parse_media_children
+
+def build_payload(seasons, episodes_per_season):
+    form = MultiDict({'media_type': 'tv_show', 'title': 'Benchmark Show'})
+    for s in range(1, seasons + 1):
+        form[f'season_number_{s}'] = str(s)
+        form[f'season_year_{s}'] = str(1990 + s)
+        form[f'season_rating_{s}'] = '8.5'
+        for e in range(1, episodes_per_season + 1):
+            e_idx = 1000 + s * episodes_per_season + e
+            form[f'ep_number_{s}_{e_idx}'] = str(e)
+            form[f'ep_title_{s}_{e_idx}'] = f'Episode {e}'
+            form[f'ep_rating_{s}_{e_idx}'] = str((e % 10) + 0.5)
+    return form
+
+def main(repeat=5):
+    app = Flask(__name__)
+    print(f"{'seasons':>8} {'episodes':>9} {'fields':>7} {'best ms':>9} {'us/field':>9}")
+    with app.test_request_context():
+        for seasons, per_season in [(5, 20), (10, 50), (30, 40), (30, 100)]:
+            payload = build_payload(seasons, per_season)
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parsed, _, errors = parse_media_children(payload)
+                best = min(best, time.perf_counter() - start)
+            assert not errors and sum(len(s['episodes']) for s in parsed) == seasons * per_season
+            fields = len(payload)
+            print(f'{seasons:>8} {seasons * per_season:>9} {fields:>7} {best * 1000:>9.1f} {best * 1e6 / fields:>9.2f}')
+
+if __name__ == '__main__':
+    main()
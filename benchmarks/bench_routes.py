@@ -0,0 +1,318 @@
+# benchmarks/bench_routes.py
+#
+# Drives every route through the Flask test client against seeded
+# synthetic libraries (benchmarks/datagen.py) and reports, per scenario,
+# latency percentiles, SQL statements per request and peak Python memory.
+# Results can be written as JSON and compared with an earlier run:
+#
+#   python -m benchmarks.bench_routes --sizes 1k,10k --output before.json
+#   ... change something ...
+#   python -m benchmarks.bench_routes --sizes 1k,10k --output after.json --compare before.json
+#
+# The render cache is disabled so every request does the real work.
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import quote
+
+from sqlalchemy import event, func, select
+
+from project import create_app, db
+from project.bulk import import_records
+from project.cache import invalidate
+from project.listing import paginate_media
+from project.schema import ADMIN_PASSWORD, ADMIN_USERNAME, upgrade_database
+
+from benchmarks.datagen import SIZES, generate_library
+
+# -------------------
+# SETUP
+# -------------------
+
+def build_app(directory, size, seed):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'RENDER_CACHE_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+        'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+    })
+    with app.app_context():
+        upgrade_database()
+        started = time.perf_counter()
+        stats = import_records(generate_library(size, seed))
+        print(f'  loaded {stats.media} media ({stats.rows} rows) in {time.perf_counter() - started:.1f}s')
+    return app
+
+def pick_targets(app):
+    """
+    The largest album and show, plus a movie and a tag, for the detail/edit
+    scenarios. index_page_2 is None when the library fits on one page.
+    """
+    from project.models import Media, Track, Season, Episode, Tag  # lazy import
+    with app.app_context():
+        album_id = db.session.execute(
+            select(Track.media_id).group_by(Track.media_id).order_by(func.count().desc()).limit(1)).scalar()
+        show_id = db.session.execute(
+            select(Season.media_id).join(Episode, Episode.season_id == Season.id)
+            .group_by(Season.media_id).order_by(func.count().desc()).limit(1)).scalar()
+        movie_id = db.session.execute(
+            select(Media.id).where(Media.media_type == 'movie').order_by(Media.id).limit(1)).scalar()
+        tag_ids = db.session.scalars(
+            select(Tag.id).where(Tag.category == 'cinematic').order_by(Tag.name).limit(2)).all()
+        search_word = db.session.execute(
+            select(Media.title).where(Media.id == movie_id)).scalar().split()[0]
+        _, second_page = paginate_media(Media.query, 'score_desc', after=None)
+        album = db.session.get(Media, album_id)
+        show = db.session.get(Media, show_id)
+        movie = db.session.get(Media, movie_id)
+        return {
+            'album_id': album_id, 'show_id': show_id, 'movie_id': movie_id,
+            'tag_ids': tag_ids, 'search_word': search_word,
+            'index_page_2': f'/?sort=score_desc&after={quote(second_page)}' if second_page else None,
+            'album_form': edit_payload(album), 'show_form': edit_payload(show),
+            'movie_form': edit_payload(movie),
+        }
+
+def edit_payload(media):
+    """The form edit_media.html posts back for an unchanged media."""
+    form = {'media_type': media.media_type, 'title': media.title, 'creator': media.creator or '',
+            'years': media.years or '', 'official_rating': '' if media.official_rating is None else str(media.official_rating),
+            'tags': [str(tag.id) for tag in media.tags]}
+    for t_idx, track in enumerate(media.tracks, start=1):
+        form[f'track_number_{t_idx}'] = str(track.track_number)
+        form[f'track_title_{t_idx}'] = track.title or ''
+        form[f'track_rating_{t_idx}'] = '' if track.rating is None else str(track.rating)
+    for s_idx, season in enumerate(media.seasons, start=1):
+        form[f'season_number_{s_idx}'] = str(season.season_number)
+        form[f'season_year_{s_idx}'] = season.year or ''
+        form[f'season_rating_{s_idx}'] = '' if season.rating is None else str(season.rating)
+        for e_idx, episode in enumerate(season.episodes, start=1):
+            form[f'ep_number_{s_idx}_{e_idx}'] = str(episode.episode_number)
+            form[f'ep_title_{s_idx}_{e_idx}'] = episode.title or ''
+            form[f'ep_rating_{s_idx}_{e_idx}'] = '' if episode.rating is None else str(episode.rating)
+    return form
+
+def _with_one_change(form, key, counter):
+    """A copy of an edit form with one rating changed, so each save writes a row."""
+    changed = dict(form)
+    changed[key] = str(counter % 10)
+    return changed
+
+def _with_tags(form, tag_ids, counter):
+    """A copy of an edit form with a different subset of tag_ids on each call."""
+    changed = dict(form)
+    changed['tags'] = [str(tag_id) for tag_id in tag_ids[:counter % (len(tag_ids) + 1)]]
+    return changed
+
+def _fresh_stats(client):
+    """/stats.json with the 'library' scope bumped first, so the statistics are recomputed."""
+    with client.application.app_context():
+        invalidate('library')
+        db.session.commit()
+    return client.get('/stats.json')
+
+# -------------------
+# SCENARIOS
+# -------------------
+# name -> function(client, targets, counter) returning a response. The
+# edit/add scenarios need the admin session; `counter` makes every call
+# of a write scenario change something.
+
+SCENARIOS = {
+    'index': lambda c, t, n: c.get('/'),
+    'index sort=score_desc': lambda c, t, n: c.get('/?sort=score_desc'),
+    'index sort=year_asc filter=movie': lambda c, t, n: c.get('/?sort=year_asc&filter=movie'),
+    'index sort=community_desc': lambda c, t, n: c.get('/?sort=community_desc'),
+    'index page 2': lambda c, t, n: c.get(t['index_page_2']),
+    'index filter=songs': lambda c, t, n: c.get('/?filter=songs&sort=score_desc'),
+    'index tag any': lambda c, t, n: c.get('/?' + '&'.join(f'tag={i}' for i in t['tag_ids'])),
+    'index tag all': lambda c, t, n: c.get('/?mode=all&' + '&'.join(f'tag={i}' for i in t['tag_ids'])),
+    'media_page movie': lambda c, t, n: c.get(f"/media/{t['movie_id']}"),
+    'media_page album': lambda c, t, n: c.get(f"/media/{t['album_id']}"),
+    'media_page show': lambda c, t, n: c.get(f"/media/{t['show_id']}"),
+    'search': lambda c, t, n: c.get(f"/search?q={t['search_word']}"),
+    'search suggest': lambda c, t, n: c.get(f"/search/suggest?q={t['search_word'][:3]}"),
+    'leaderboard': lambda c, t, n: c.get('/leaderboard'),
+    'leaderboard songs': lambda c, t, n: c.get('/leaderboard?board=songs'),
+    'leaderboard.json tag': lambda c, t, n: c.get(f"/leaderboard.json?board=tag:{t['tag_ids'][0]}"),
+    'stats': lambda c, t, n: c.get('/stats'),
+    'api media': lambda c, t, n: c.get('/api/v1/media?sort=score_desc'),
+    'api media limit=200 fields': lambda c, t, n: c.get('/api/v1/media?limit=200&fields=title,overall_score'),
+    'api media detail show': lambda c, t, n: c.get(f"/api/v1/media/{t['show_id']}"),
+    'api tags': lambda c, t, n: c.get('/api/v1/tags'),
+    'login page': lambda c, t, n: c.get('/login'),
+    'edit_media GET show': lambda c, t, n: c.get(f"/edit_media/{t['show_id']}"),
+    'edit_media POST album': lambda c, t, n: c.post(
+        f"/edit_media/{t['album_id']}", data=_with_one_change(t['album_form'], 'track_rating_1', n)),
+    'edit_media POST show': lambda c, t, n: c.post(
+        f"/edit_media/{t['show_id']}", data=_with_one_change(t['show_form'], 'ep_rating_1_1', n)),
+    'edit_media POST movie tags': lambda c, t, n: c.post(
+        f"/edit_media/{t['movie_id']}", data=_with_tags(t['movie_form'], t['tag_ids'], n)),
+    'rate_media POST': lambda c, t, n: c.post(
+        f"/media/{t['movie_id']}/rate", data={'rating': str(n % 11)}),
+    'add_media POST': lambda c, t, n: c.post(
+        '/add_media', data={'media_type': 'movie', 'title': f'Bench {n}', 'official_rating': '7'}),
+    'bulk page': lambda c, t, n: c.get('/bulk'),
+}
+
+# Scenario -> the target it is skipped without
+OPTIONAL_TARGETS = {
+    'index page 2': 'index_page_2',
+}
+
+# Scenarios too heavy to repeat as often as the others
+SLOW_SCENARIOS = {
+    'bulk export jsonl': lambda c, t, n: c.get('/bulk/export.jsonl'),
+    'stats.json recompute': lambda c, t, n: _fresh_stats(c),
+}
+
+# -------------------
+# MEASURING
+# -------------------
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def measure(app, client, scenario, targets, iterations):
+    """
+    Runs a scenario `iterations` times for latency, then once more under
+    tracemalloc for peak memory (tracing slows requests down, so the two
+    are kept apart). Statements are counted on the engine rather than with
+    X-Query-Count, which is sent before a streamed body has run its queries.
+    """
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        scenario(client, targets, 0).get_data()  # warm-up
+        timings, queries, statuses = [], [], set()
+        for n in range(1, iterations + 1):
+            statements[0] = 0
+            started = time.perf_counter()
+            response = scenario(client, targets, n)
+            response.get_data()  # drain streamed bodies
+            timings.append((time.perf_counter() - started) * 1000)
+            queries.append(statements[0])
+            statuses.add(response.status_code)
+
+        tracemalloc.start()
+        scenario(client, targets, iterations + 1).get_data()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'status': sorted(statuses),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p50_ms': round(_percentile(timings, 0.50), 3),
+        'p95_ms': round(_percentile(timings, 0.95), 3),
+        'p99_ms': round(_percentile(timings, 0.99), 3),
+        'max_ms': round(timings[-1], 3),
+        'queries': max(queries),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def run_size(label, size, seed, iterations):
+    print(f'{label} ({size:,} media)')
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(directory, size, seed)
+        targets = pick_targets(app)
+        client = app.test_client()
+        client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+
+        results = {}
+        for name, scenario in SCENARIOS.items():
+            if name in OPTIONAL_TARGETS and targets[OPTIONAL_TARGETS[name]] is None:
+                print(f'  {name:<34} skipped: no {OPTIONAL_TARGETS[name]} in this library')
+                continue
+            results[name] = measure(app, client, scenario, targets, iterations)
+            print_row(name, results[name])
+        for name, scenario in SLOW_SCENARIOS.items():
+            results[name] = measure(app, client, scenario, targets, max(3, iterations // 20))
+            print_row(name, results[name])
+        with app.app_context():
+            db.engine.dispose()
+    return results
+
+# -------------------
+# REPORTING
+# -------------------
+
+def print_row(name, result, baseline=None):
+    line = (f"  {name:<34} p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  "
+            f"p99 {result['p99_ms']:8.2f} ms  queries {result['queries']:4d}  peak {result['peak_kib']:9.1f} KiB")
+    if baseline:
+        change = (result['p50_ms'] / baseline['p50_ms'] - 1) * 100 if baseline['p50_ms'] else 0.0
+        line += f"  p50 {change:+6.1f}%  queries {result['queries'] - baseline['queries']:+d}"
+    print(line)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for label, results in report['results'].items():
+        if label not in baseline['results']:
+            continue
+        print(label)
+        for name, result in results.items():
+            print_row(name, result, baseline['results'][label].get(name))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1k,10k,100k', help='Comma-separated library sizes: 1k, 10k, 100k or a number.')
+    parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='An earlier --output file to compare against.')
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'iterations': args.iterations,
+        },
+        'results': {},
+    }
+    for label in args.sizes.split(','):
+        size = SIZES.get(label) or int(label)
+        report['results'][label] = run_size(label, size, args.seed, args.iterations)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == '__main__':
+    main()
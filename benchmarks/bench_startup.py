@@ -0,0 +1,31 @@
+# benchmarks/bench_startup.py
+#
+# Measures how long create_app() takes, i.e. the per-worker boot cost, and
+# checks that it opens no database connection.
+#
+#   python -m benchmarks.bench_startup
+
+import statistics
+import time
+
+from project import create_app, db
+
+def main(repeat=50):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        app = create_app()
+        timings.append((time.perf_counter() - start) * 1000)
+        with app.app_context():
+            connections = sum(engine.pool.checkedin() + engine.pool.checkedout()
+                              for engine in db.engines.values())
+        assert connections == 0, 'create_app() touched the database'
+
+    timings.sort()
+    print(f'create_app() x{repeat}:')
+    print(f'  median {statistics.median(timings):.2f} ms, '
+          f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, max {timings[-1]:.2f} ms')
+    print('  database connections opened: 0')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/datagen.py
+#
+# Seeded synthetic libraries for the benchmarks. Records use the bulk
+# import format (see project/bulk.py), so a library is loaded with
+# import_records() in batches rather than one ORM object at a time.
+#
+#   python -m benchmarks.datagen 10000 > library.jsonl
+#   flask --app run media import library.jsonl
+
+import random
+import sys
+
+from project.bulk import format_records
+from project.schema import CINEMATIC_TAGS, MUSICAL_TAGS
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000}
+
+# Share of each media type in a library
+MEDIA_MIX = (('movie', 0.45), ('album', 0.25), ('single', 0.20), ('tv_show', 0.10))
+
+WORDS = (
+    'midnight', 'river', 'echo', 'city', 'golden', 'shadow', 'summer', 'last', 'broken', 'wild',
+    'silent', 'electric', 'blue', 'lost', 'northern', 'paper', 'glass', 'fire', 'ocean', 'velvet',
+    'distant', 'neon', 'winter', 'hollow', 'crimson', 'empire', 'signal', 'garden', 'storm', 'rogue',
+)
+
+def _title(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+def _rating(rng, mean=7.0, spread=1.4):
+    """A 0-10 rating rounded to one decimal, clustered like real scores."""
+    return round(min(10.0, max(0.0, rng.gauss(mean, spread))), 1)
+
+def _tracks(rng):
+    # Most albums have 8-14 tracks, a few deluxe editions go past 20
+    count = rng.randint(8, 14) if rng.random() < 0.9 else rng.randint(18, 28)
+    mean = rng.uniform(5.5, 8.5)
+    return [{'track_number': n, 'title': _title(rng, rng.randint(1, 4)),
+             'rating': _rating(rng, mean, 1.0) if rng.random() < 0.9 else None}
+            for n in range(1, count + 1)]
+
+def _seasons(rng, first_year):
+    # Most shows are short; a long tail runs for many seasons
+    count = min(int(rng.paretovariate(1.3)), 15)
+    per_season = rng.choice((6, 8, 10, 13, 22))
+    mean = rng.uniform(6.0, 8.5)
+    return [{'season_number': s, 'year': str(first_year + s - 1), 'rating': _rating(rng, mean, 0.8),
+             'episodes': [{'episode_number': e, 'title': _title(rng, rng.randint(2, 4)),
+                           'rating': _rating(rng, mean, 1.0)}
+                          for e in range(1, per_season + rng.randint(0, 2) + 1)]}
+            for s in range(1, count + 1)]
+
+def generate_library(size, seed=0):
+    """
+    Yields `size` media records. The same size and seed always produce the
+    same library, so results from different commits are comparable.
+    """
+    rng = random.Random(seed)
+    types, weights = zip(*MEDIA_MIX)
+    artists = [_title(rng, 2) for _ in range(max(size // 8, 10))]
+    directors = [_title(rng, 2) for _ in range(max(size // 12, 10))]
+
+    for n in range(size):
+        media_type = rng.choices(types, weights)[0]
+        year = rng.randint(1955, 2025)
+        musical = media_type in ('album', 'single')
+        record = {
+            'title': f'{_title(rng, rng.randint(1, 3))} {n}',
+            'creator': rng.choice(artists if musical else directors),
+            'years': str(year),
+            'media_type': media_type,
+            'official_rating': _rating(rng),
+            'poster_img': None,
+            'banner_img': None,
+            'tags': rng.sample(MUSICAL_TAGS if musical else CINEMATIC_TAGS, rng.randint(0, 3)),
+            'tracks': _tracks(rng) if media_type == 'album' else [],
+            'seasons': [],
+        }
+        if media_type == 'tv_show':
+            record['seasons'] = _seasons(rng, year)
+            last_year = int(record['seasons'][-1]['year'])
+            if last_year > year:
+                record['years'] = f'{year}-{last_year}'
+        yield record
+
+def main():
+    size = sys.argv[1] if len(sys.argv) > 1 else '1k'
+    size = SIZES.get(size) or int(size)
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for chunk in format_records(generate_library(size, seed), 'jsonl'):
+        sys.stdout.write(chunk)
+
+if __name__ == '__main__':
+    main()
@@ -4,36 +4,47 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from werkzeug.security import generate_password_hash
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
 
-db = SQLAlchemy()
+from .database import RoutingSession
 
-# --- NEW: Enable SQLite Foreign Key Constraints ---
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-def create_app():
+# Prefix of the environment variables that configure the app, e.g.
+# MEDIA_RATER_SQLALCHEMY_DATABASE_URI or MEDIA_RATER_DATABASE_POOL_SIZE=20
+ENV_PREFIX = 'MEDIA_RATER'
+
+def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
 
     # --- Configuration ---
-    app.config['SECRET_KEY'] = 'a_very_secret_key_change_this'
-    os.makedirs(app.app_context().app.instance_path, exist_ok=True)
-    
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(app.instance_path, 'media_rater.db')}"
-    
-    app.config['SQLALCHEMY_BINDS'] = {
-        'tags': f"sqlite:///{os.path.join(app.instance_path, 'tags.db')}"
-    }
-    
-    app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static/uploads')
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-    db.init_app(app)
+    # Later sources win: these single-box defaults, then the Python config
+    # file named by MEDIA_RATER_SETTINGS, then MEDIA_RATER_* environment
+    # variables (values that parse as JSON are converted), then test_config.
+    # Every node of a deployment needs the same SECRET_KEY.
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.config.from_mapping(
+        SECRET_KEY='a_very_secret_key_change_this',
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(app.instance_path, 'media_rater.db')}",
+        UPLOAD_FOLDER=os.path.join(app.root_path, 'static/uploads'),
+    )
+    app.config.from_envvar(f'{ENV_PREFIX}_SETTINGS', silent=True)
+    app.config.from_prefixed_env(ENV_PREFIX)
+
+    if test_config is not None:
+        app.config.update(test_config)
+
+    # --- Database (pool profile, SQLite pragmas, read replica) ---
+    from .database import init_database
+    init_database(app)
+
+    from .instrumentation import init_instrumentation
+    init_instrumentation(app)
+
+    from .cache import init_render_cache
+    init_render_cache(app)
+
+    from .uploads import init_uploads
+    init_uploads(app)
 
     # --- Login Manager ---
     login_manager = LoginManager()
@@ -49,41 +60,26 @@ def create_app():
     # --- Blueprints (Routes) ---
     from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    from .api import api as api_blueprint
+    app.register_blueprint(api_blueprint)
+
+    # --- CLI ---
+    from .bulk import media_cli
+    app.cli.add_command(media_cli)
+    from .search import search_cli
+    app.cli.add_command(search_cli)
+    from .schema import db_cli
+    app.cli.add_command(db_cli)
+    from .leaderboards import leaderboard_cli
+    app.cli.add_command(leaderboard_cli)
+    from .similarity import similarity_cli
+    app.cli.add_command(similarity_cli)
+    from .ratings import ratings_cli
+    app.cli.add_command(ratings_cli)
+    from .uploads import uploads_cli
+    app.cli.add_command(uploads_cli)
 
-    # --- Create Databases and Initial Data ---
-    with app.app_context():
-        db.create_all()
-        
-        def populate_tags():
-            cinematic_tags = [
-                'Action', 'Adventure', 'Comedy', 'Drama', 'Romance', 'Horror',
-                'Thriller / Suspense', 'Science Fiction (Sci-Fi)', 'Fantasy',
-                'Crime / Mystery', 'Documentary', 'Animation', 'Anime', 'Marvel'
-            ]
-            
-            musical_tags = [
-                'Pop', 'Rock', 'Hip-Hop / Rap', 'R&B / Soul', 'Country', 'Jazz',
-                'Classical', 'EDM', 'Reggae', 'Metal', 'Folk', 'Blues'
-            ]
-
-            for tag_name in cinematic_tags:
-                if not models.Tag.query.filter_by(name=tag_name, category='cinematic').first():
-                    new_tag = models.Tag(name=tag_name, category='cinematic')
-                    db.session.add(new_tag)
-            
-            for tag_name in musical_tags:
-                if not models.Tag.query.filter_by(name=tag_name, category='musical').first():
-                    new_tag = models.Tag(name=tag_name, category='musical')
-                    db.session.add(new_tag)
-            
-            db.session.commit()
-        
-        populate_tags()
-
-        if not models.User.query.filter_by(username='Ryan').first():
-            hashed_password = generate_password_hash('06242005', method='pbkdf2:sha256')
-            admin_user = models.User(username='Ryan', password=hashed_password)
-            db.session.add(admin_user)
-            db.session.commit()
+    # No database I/O here: the schema and seed data are applied once per
+    # deploy with 'flask db upgrade' (see schema.py), not by every worker.
 
     return app
@@ -0,0 +1,203 @@
+# project/api.py
+
+import json
+
+from flask import Blueprint, Response, abort, request, url_for
+from sqlalchemy import func, select
+from werkzeug.exceptions import HTTPException
+
+from . import db
+from .cache import cached_page
+from .listing import PAGE_SIZE, SORTS, _after, _ordering, decode_cursor, encode_cursor, parse_tag_ids, tag_filter_clause
+from .uploads import upload_url
+
+try:
+    import orjson
+except ImportError:  # orjson is optional: without it the standard library encoder is used
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_PAGE_SIZE = 200
+MEDIA_TYPES = ('movie', 'tv_show', 'album', 'single')
+# Parts of a media detail response beyond its own columns
+DETAIL_PARTS = ('tags', 'tracks', 'seasons')
+
+def _upload_url(filename):
+    return upload_url(filename) if filename else None
+
+# field name -> (column builder, value converter or None). Responses are
+# built straight from the selected column tuples, never from ORM objects.
+MEDIA_FIELDS = {
+    'id': (lambda Media: Media.id, None),
+    'media_type': (lambda Media: Media.media_type, None),
+    'title': (lambda Media: Media.title, None),
+    'creator': (lambda Media: Media.creator, None),
+    'years': (lambda Media: Media.years, None),
+    'start_year': (lambda Media: Media.start_year, None),
+    'official_rating': (lambda Media: Media.official_rating, None),
+    'overall_score': (lambda Media: Media.overall_score, None),
+    'community_score': (lambda Media: Media.community_score, None),
+    'community_count': (lambda Media: Media.user_rating_count, None),
+    'poster_url': (lambda Media: Media.poster_img, _upload_url),
+    'banner_url': (lambda Media: Media.banner_img, _upload_url),
+}
+
+# -------------------
+# ENCODING
+# -------------------
+
+def _dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, check_circular=False, separators=(',', ':')).encode()
+
+def json_response(payload, status=200):
+    return Response(_dumps(payload), status=status, mimetype='application/json')
+
+def _records(names, converters, rows):
+    """Row tuples -> dicts; converters is a parallel tuple of callables or None."""
+    if not any(converters):
+        return [dict(zip(names, row)) for row in rows]
+    return [{name: convert(value) if convert else value
+             for name, convert, value in zip(names, converters, row)} for row in rows]
+
+@api.errorhandler(HTTPException)
+def _error(exc):
+    return json_response({'error': exc.description, 'status': exc.code}, exc.code)
+
+# -------------------
+# PARAMETERS
+# -------------------
+
+def _fields(available, extra=()):
+    """
+    The ?fields=a,b list checked against the available names, in the order
+    given; every field when the parameter is absent. 'id' is always sent.
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return list(available) + list(extra)
+    fields = ['id']
+    for name in raw.split(','):
+        name = name.strip()
+        if name not in available and name not in extra:
+            abort(400, f'Unknown field {name!r}.')
+        if name not in fields:
+            fields.append(name)
+    return fields
+
+def _page_size():
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        abort(400, 'limit must be an integer.')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        abort(400, f'limit must be between 1 and {MAX_PAGE_SIZE}.')
+    return limit
+
+def _media_columns(Media, names):
+    columns = tuple(MEDIA_FIELDS[name][0](Media).label(name) for name in names)
+    converters = tuple(MEDIA_FIELDS[name][1] for name in names)
+    return columns, converters
+
+# -------------------
+# ENDPOINTS
+# -------------------
+
+@api.route('/media')
+@cached_page(lambda: 'library', mimetype='application/json')
+def media_list():
+    """
+    Media in pages of ?limit= (default PAGE_SIZE), keyset-paginated with the
+    same ?sort= keys and cursors as the index page, filtered by ?type= and
+    ?tag= (?mode=all to require every tag).
+    """
+    from .models import Media  # lazy import
+    sort_by = request.args.get('sort', 'title_asc')
+    if sort_by not in SORTS:
+        abort(400, f"sort must be one of {', '.join(SORTS)}.")
+    media_type = request.args.get('type')
+    if media_type is not None and media_type not in MEDIA_TYPES:
+        abort(400, f"type must be one of {', '.join(MEDIA_TYPES)}.")
+    after = request.args.get('after')
+    position = decode_cursor(after)
+    if after and position is None:
+        abort(400, 'Malformed cursor.')
+    names = _fields(MEDIA_FIELDS)
+    per_page = _page_size()
+
+    key_builder, descending = SORTS[sort_by]
+    key = key_builder(Media)
+    columns, converters = _media_columns(Media, names)
+    stmt = select(*columns, key.label('sort_key'), Media.id.label('cursor_id'))
+    if media_type is not None:
+        stmt = stmt.where(Media.media_type == media_type)
+    tag_ids = parse_tag_ids(request.args.getlist('tag'))
+    if tag_ids:
+        stmt = stmt.where(tag_filter_clause(Media.id, tag_ids, 'all' if request.args.get('mode') == 'all' else 'any'))
+    if position is not None:
+        stmt = stmt.where(_after((key, Media.id), position, descending))
+    stmt = stmt.order_by(*_ordering((key, Media.id), descending)).limit(per_page + 1)
+
+    rows = db.session.execute(stmt).all()
+    next_cursor = next_url = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_cursor(last.sort_key, last.cursor_id)
+        next_url = url_for('api.media_list', **{**request.args.to_dict(flat=False), 'after': next_cursor})
+    data = _records(names, converters, (row[:len(names)] for row in rows[:per_page]))
+    return json_response({'data': data, 'next_cursor': next_cursor, 'next': next_url})
+
+@api.route('/media/<int:media_id>')
+@cached_page(lambda media_id: f'media:{media_id}', mimetype='application/json')
+def media_detail(media_id):
+    """
+    One media with its tags, tracks and seasons (each with its episodes),
+    one query per part; ?fields= can leave parts out.
+    """
+    from .models import Episode, Media, Season, Tag, Track, media_tags  # lazy import
+    names = _fields(MEDIA_FIELDS, DETAIL_PARTS)
+    own = [name for name in names if name in MEDIA_FIELDS]
+    columns, converters = _media_columns(Media, own)
+    row = db.session.execute(select(*columns).where(Media.id == media_id)).first()
+    if row is None:
+        abort(404, f'No media with id {media_id}.')
+    data = _records(own, converters, [row])[0]
+
+    if 'tags' in names:
+        data['tags'] = _records(('id', 'name', 'category'), (None,) * 3, db.session.execute(
+            select(Tag.id, Tag.name, Tag.category)
+            .join(media_tags, media_tags.c.tag_id == Tag.id)
+            .where(media_tags.c.media_id == media_id).order_by(Tag.name)))
+    if 'tracks' in names:
+        data['tracks'] = _records(('id', 'track_number', 'title', 'rating'), (None,) * 4, db.session.execute(
+            select(Track.id, Track.track_number, Track.title, Track.rating)
+            .where(Track.media_id == media_id).order_by(Track.track_number)))
+    if 'seasons' in names:
+        seasons = _records(('id', 'season_number', 'rating', 'year'), (None,) * 4, db.session.execute(
+            select(Season.id, Season.season_number, Season.rating, Season.year)
+            .where(Season.media_id == media_id).order_by(Season.season_number)))
+        by_season = {season['id']: season for season in seasons}
+        for season in seasons:
+            season['episodes'] = []
+        episodes = db.session.execute(
+            select(Episode.season_id, Episode.id, Episode.episode_number, Episode.title, Episode.rating)
+            .where(Episode.season_id.in_(list(by_season)))
+            .order_by(Episode.season_id, Episode.episode_number)) if by_season else ()
+        for season_id, *episode in episodes:
+            by_season[season_id]['episodes'].append(dict(zip(('id', 'episode_number', 'title', 'rating'), episode)))
+        data['seasons'] = seasons
+    return json_response({'data': data})
+
+@api.route('/tags')
+@cached_page(lambda: 'library', mimetype='application/json')
+def tag_list():
+    """Every tag with the number of media carrying it."""
+    from .models import Tag, media_tags  # lazy import
+    counts = (select(media_tags.c.tag_id, func.count().label('media_count'))
+              .group_by(media_tags.c.tag_id).subquery())
+    rows = db.session.execute(
+        select(Tag.id, Tag.name, Tag.category, func.coalesce(counts.c.media_count, 0))
+        .outerjoin(counts, counts.c.tag_id == Tag.id).order_by(Tag.name, Tag.category))
+    return json_response({'data': _records(('id', 'name', 'category', 'media_count'), (None,) * 4, rows)})
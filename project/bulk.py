@@ -0,0 +1,375 @@
+# project/bulk.py
+
+import csv
+import io
+import json
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 500
+
+# Scalar Media columns carried by an import/export record
+MEDIA_FIELDS = ('title', 'creator', 'years', 'media_type', 'official_rating', 'poster_img', 'banner_img')
+# CSV layout: the scalar columns, then tags, tracks and seasons as JSON
+# (tags may also be plain names joined by '|')
+CSV_FIELDS = MEDIA_FIELDS + ('tags', 'tracks', 'seasons')
+
+MEDIA_TYPES = ('movie', 'tv_show', 'album', 'single')
+MUSICAL_TYPES = ('album', 'single')
+
+class RecordError(ValueError):
+    """An import record that cannot be stored, with the line it came from."""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+# -------------------
+# READING / WRITING RECORDS
+# -------------------
+
+def _float_or_none(value):
+    return float(value) if value not in (None, '') else None
+
+def _check_rating(value, what):
+    if value is None:
+        return
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 10:
+        raise ValueError(f'{what} must be a number from 0 to 10, not {value!r}')
+
+def _check_number(value, what):
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+        raise ValueError(f'{what} must be a whole number, not {value!r}')
+
+def _check_rows(rows, what):
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError(f'{what} must be a list of objects')
+
+def validate_record(record):
+    """
+    Raises ValueError when a record would not import as a valid Media: a
+    title, a known media_type, ratings from 0 to 10 and well-formed tags,
+    tracks and seasons.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('a record must be an object')
+    title = record.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError('title is required')
+    if record.get('media_type') not in MEDIA_TYPES:
+        raise ValueError(f"media_type must be one of {', '.join(MEDIA_TYPES)}, not {record.get('media_type')!r}")
+    _check_rating(record.get('official_rating'), 'official_rating')
+    for field in MEDIA_FIELDS:
+        if field != 'official_rating' and not isinstance(record.get(field), (str, type(None))):
+            raise ValueError(f'{field} must be text')
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(
+            (isinstance(tag, str) and tag)
+            or (isinstance(tag, dict) and isinstance(tag.get('name'), str) and tag['name']
+                and isinstance(tag.get('category'), str) and tag['category']) for tag in tags):
+        raise ValueError('tags must be a list of names or {"name", "category"} objects')
+    _check_rows(record.get('tracks') or [], 'tracks')
+    for track in record.get('tracks') or ():
+        _check_number(track.get('track_number'), 'track_number')
+        _check_rating(track.get('rating'), 'track rating')
+    _check_rows(record.get('seasons') or [], 'seasons')
+    for season in record.get('seasons') or ():
+        _check_number(season.get('season_number'), 'season_number')
+        _check_rating(season.get('rating'), 'season rating')
+        _check_rows(season.get('episodes') or [], 'episodes')
+        for episode in season.get('episodes') or ():
+            _check_number(episode.get('episode_number'), 'episode_number')
+            _check_rating(episode.get('rating'), 'episode rating')
+
+def _csv_record(row):
+    record = {field: row.get(field) or None for field in MEDIA_FIELDS}
+    record['official_rating'] = _float_or_none(record['official_rating'])
+    tags = row.get('tags') or ''
+    record['tags'] = json.loads(tags) if tags.startswith('[') else [name for name in tags.split('|') if name]
+    record['tracks'] = json.loads(row['tracks']) if row.get('tracks') else []
+    record['seasons'] = json.loads(row['seasons']) if row.get('seasons') else []
+    return record
+
+def _numbered_rows(text_stream, fmt):
+    """(line number, raw row, parser) for each record; CSV rows are numbered by the line they end on."""
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(text_stream, start=1):
+            if line.strip():
+                yield line_number, line, json.loads
+    elif fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row, _csv_record
+    else:
+        raise ValueError(f'Unknown format {fmt!r}, expected one of {FORMATS}')
+
+def iter_records(text_stream, fmt):
+    """
+    Lazily parses an import stream into record dicts, one per Media:
+    the MEDIA_FIELDS plus 'tags' ({'name', 'category'} objects, or bare
+    names), 'tracks' and 'seasons' (each season with its 'episodes').
+    Only one line is held at a time. A line that does not parse or
+    validate raises RecordError.
+    """
+    for line_number, row, parse in _numbered_rows(text_stream, fmt):
+        try:
+            record = parse(row)
+            validate_record(record)
+        except ValueError as exc:
+            raise RecordError(line_number, exc) from exc
+        yield record
+
+def format_records(records, fmt):
+    """Serializes record dicts to text chunks, one chunk per record (plus a CSV header)."""
+    if fmt == 'jsonl':
+        for record in records:
+            yield json.dumps(record, separators=(',', ':')) + '\n'
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for record in records:
+            row = {field: record[field] for field in MEDIA_FIELDS}
+            row['tags'] = json.dumps(record['tags'], separators=(',', ':')) if record['tags'] else ''
+            row['tracks'] = json.dumps(record['tracks'], separators=(',', ':')) if record['tracks'] else ''
+            row['seasons'] = json.dumps(record['seasons'], separators=(',', ':')) if record['seasons'] else ''
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        raise ValueError(f'Unknown format {fmt!r}, expected one of {FORMATS}')
+
+# -------------------
+# IMPORT
+# -------------------
+
+class ImportStats:
+    def __init__(self):
+        self.media = 0
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def _load_tag_ids():
+    from .models import Tag  # lazy import
+    return {(name, category): tag_id
+            for tag_id, name, category in db.session.execute(select(Tag.id, Tag.name, Tag.category))}
+
+def _tag_keys(record):
+    """
+    (name, category) of each of a record's tags. A tag given by name alone
+    gets the category of the media type, as in edit_media's tag picker.
+    """
+    default = 'musical' if record.get('media_type') in MUSICAL_TYPES else 'cinematic'
+    return [(tag['name'], tag['category']) if isinstance(tag, dict) else (tag, default)
+            for tag in record.get('tags') or ()]
+
+def _resolve_tags(batch, tag_ids):
+    """
+    Maps every tag in the batch to an id using the in-memory tag table,
+    creating the unknown ones in a single INSERT.
+    """
+    from .models import Tag  # lazy import
+    missing = set()
+    for record in batch:
+        for key in _tag_keys(record):
+            if key not in tag_ids:
+                missing.add(key)
+    if missing:
+        created = db.session.execute(
+            insert(Tag).returning(Tag.id, Tag.name, Tag.category),
+            [{'name': name, 'category': category} for name, category in sorted(missing)])
+        tag_ids.update({(row.name, row.category): row.id for row in created})
+
+def _import_batch(batch, tag_ids, stats):
+    from .leaderboards import refresh_leaderboards  # lazy import
+    from .models import Media, Track, Season, Episode, media_tags, parse_start_year, compute_overall_score  # lazy import
+    _resolve_tags(batch, tag_ids)
+
+    media_params = []
+    for record in batch:
+        ratings = [t.get('rating') for t in record.get('tracks') or () if t.get('rating') is not None]
+        track_average = sum(ratings) / len(ratings) if ratings else None
+        params = {field: record.get(field) for field in MEDIA_FIELDS}
+        params['overall_score'] = compute_overall_score(params['media_type'], params['official_rating'], track_average)
+        params['start_year'] = parse_start_year(params['years'])
+        params['track_rating_count'], params['track_rating_sum'] = len(ratings), float(sum(ratings))
+        media_params.append(params)
+    media_ids = db.session.scalars(
+        insert(Media).returning(Media.id, sort_by_parameter_order=True), media_params).all()
+
+    tag_rows, track_rows, season_params, season_episodes = [], [], [], []
+    for media_id, record in zip(media_ids, batch):
+        for tag_id in {tag_ids[key] for key in _tag_keys(record)}:
+            tag_rows.append({'media_id': media_id, 'tag_id': tag_id})
+        for track in record.get('tracks') or ():
+            track_rows.append({'media_id': media_id, 'track_number': track.get('track_number'),
+                               'title': track.get('title'), 'rating': track.get('rating')})
+        for season in record.get('seasons') or ():
+            ratings = [e.get('rating') for e in season.get('episodes') or () if e.get('rating') is not None]
+            season_params.append({'media_id': media_id, 'season_number': season.get('season_number'),
+                                  'rating': season.get('rating'), 'year': season.get('year'),
+                                  'episode_rating_count': len(ratings), 'episode_rating_sum': float(sum(ratings))})
+            season_episodes.append(season.get('episodes') or ())
+
+    episode_rows = []
+    if season_params:
+        season_ids = db.session.scalars(
+            insert(Season).returning(Season.id, sort_by_parameter_order=True), season_params).all()
+        for season_id, episodes in zip(season_ids, season_episodes):
+            for episode in episodes:
+                episode_rows.append({'season_id': season_id, 'episode_number': episode.get('episode_number'),
+                                     'title': episode.get('title'), 'rating': episode.get('rating')})
+
+    # executemany for each child table
+    if tag_rows:
+        db.session.execute(media_tags.insert(), tag_rows)
+    if track_rows:
+        db.session.execute(insert(Track), track_rows)
+    if episode_rows:
+        db.session.execute(insert(Episode), episode_rows)
+    refresh_leaderboards(media_ids)
+    db.session.commit()
+
+    stats.media += len(batch)
+    stats.rows += len(batch) + len(tag_rows) + len(track_rows) + len(season_params) + len(episode_rows)
+    return media_ids
+
+def import_records(records, batch_size=BATCH_SIZE, stats=None):
+    """
+    Inserts records as new Media in transactions of batch_size items.
+    Memory is bounded by one batch (plus the new ids), whatever the size
+    of the input. Returns ImportStats; pass one in to read how far an
+    import that raised got; the batches before the failure stay imported.
+    """
+    from .cache import invalidate  # lazy import
+    from .similarity import refresh_similarity  # lazy import
+    stats = stats or ImportStats()
+    tag_ids = _load_tag_ids()
+    imported = []
+    try:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                imported += _import_batch(batch, tag_ids, stats)
+                batch = []
+        if batch:
+            imported += _import_batch(batch, tag_ids, stats)
+    finally:
+        # The similarity index is refreshed once at the end (for a large
+        # import, a full rebuild), including after a failure, for the
+        # batches already committed
+        db.session.rollback()
+        if imported:
+            panels = refresh_similarity(imported)
+            invalidate('library', *panels)
+            db.session.commit()
+    return stats
+
+# -------------------
+# EXPORT
+# -------------------
+
+def export_records(batch_size=BATCH_SIZE):
+    """
+    Yields one record dict per Media in id order. Media are read in
+    keyset-paginated batches and their children fetched as plain column
+    tuples with one IN query per table, so only one batch is in memory.
+    """
+    from .models import Media, Track, Season, Episode, Tag, media_tags  # lazy import
+    columns = [getattr(Media, field) for field in MEDIA_FIELDS]
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Media.id, *columns).where(Media.id > last_id).order_by(Media.id).limit(batch_size)).all()
+        if not rows:
+            return
+        ids = [row.id for row in rows]
+        last_id = ids[-1]
+
+        tags, tracks, seasons, episodes = {}, {}, {}, {}
+        for media_id, name, category in db.session.execute(
+                select(media_tags.c.media_id, Tag.name, Tag.category).join(Tag, Tag.id == media_tags.c.tag_id)
+                .where(media_tags.c.media_id.in_(ids)).order_by(Tag.name, Tag.category)):
+            tags.setdefault(media_id, []).append({'name': name, 'category': category})
+        for row in db.session.execute(
+                select(Track.media_id, Track.track_number, Track.title, Track.rating)
+                .where(Track.media_id.in_(ids)).order_by(Track.track_number)):
+            tracks.setdefault(row.media_id, []).append(
+                {'track_number': row.track_number, 'title': row.title, 'rating': row.rating})
+        season_media = {}
+        for row in db.session.execute(
+                select(Season.id, Season.media_id, Season.season_number, Season.rating, Season.year)
+                .where(Season.media_id.in_(ids)).order_by(Season.season_number)):
+            season_media[row.id] = row.media_id
+            seasons.setdefault(row.media_id, []).append(
+                {'season_number': row.season_number, 'rating': row.rating, 'year': row.year,
+                 'episodes': episodes.setdefault(row.id, [])})
+        if season_media:
+            for row in db.session.execute(
+                    select(Episode.season_id, Episode.episode_number, Episode.title, Episode.rating)
+                    .where(Episode.season_id.in_(list(season_media))).order_by(Episode.episode_number)):
+                episodes[row.season_id].append(
+                    {'episode_number': row.episode_number, 'title': row.title, 'rating': row.rating})
+
+        for row in rows:
+            record = {field: getattr(row, field) for field in MEDIA_FIELDS}
+            record['tags'] = tags.get(row.id, [])
+            record['tracks'] = tracks.get(row.id, [])
+            record['seasons'] = seasons.get(row.id, [])
+            yield record
+
+# -------------------
+# CLI
+# -------------------
+
+media_cli = AppGroup('media', help='Bulk import/export of the media library.')
+
+@media_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+def import_command(source, fmt, batch_size):
+    """Import media from a JSONL or CSV file ('-' for stdin)."""
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'jsonl')
+    stats = ImportStats()
+    try:
+        import_records(iter_records(source, fmt), batch_size=batch_size, stats=stats)
+    except (ValueError, KeyError, TypeError, SQLAlchemyError) as exc:
+        db.session.rollback()
+        raise click.ClickException(f'Import failed: {exc}. The {stats.media} media before it were imported.')
+    click.echo(f'Imported {stats.media} media ({stats.rows} rows) in {stats.seconds:.2f}s '
+               f'({stats.rows_per_second:,.0f} rows/s)')
+
+@media_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help='Output format (default: from the file extension).')
+def export_command(target, fmt):
+    """Export every media to a JSONL or CSV file (stdout by default)."""
+    fmt = fmt or ('csv' if target.name.endswith('.csv') else 'jsonl')
+    started = time.perf_counter()
+    count = 0
+    for chunk in format_records(export_records(), fmt):
+        target.write(chunk)
+        count += 1
+    seconds = time.perf_counter() - started
+    click.echo(f'Exported {count} media in {seconds:.2f}s '
+               f'({count / seconds if seconds else 0:,.0f} media/s)', err=True)
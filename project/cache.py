@@ -0,0 +1,214 @@
+# project/cache.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import select
+
+from . import db
+from .database import upsert
+
+# Scope that every invalidate() call bumps: its version is the time of the last write
+ANY_SCOPE = '*'
+
+class CacheBackend:
+    """
+    Interface for render cache storage. A shared backend (memcached, redis,
+    ...) only needs get/set/delete over string keys and bytes values.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+class LRUCacheBackend(CacheBackend):
+    """In-process backend that evicts least recently used entries beyond max_bytes."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value):
+        return len(value) if isinstance(value, bytes) else 64
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self._size(old)
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._size(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self._size(old)
+
+    def __len__(self):
+        return len(self._entries)
+
+class RenderCache:
+    """
+    Caches rendered pages keyed by endpoint, arguments and the versions of
+    the scopes the page depends on ('library' for listings, 'media:<id>' for
+    a detail page). Writers call invalidate() with the scopes they touched;
+    that gives each scope a fresh version, so old entries are simply never
+    looked up again and age out of the backend.
+
+    The pages may live in each worker's own backend, but the versions are
+    rows of the cache_version table, written in the writer's transaction:
+    every worker sees an edit as soon as it is committed, and never a
+    version whose rows are not. They are read once per request, by primary
+    key on the primary. Versions are nanosecond timestamps, so they double
+    as the Last-Modified time of the page; a scope never written is 0.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _known():
+        # Versions already read in this request; reset by before_request
+        if 'cache_versions' not in g:
+            g.cache_versions = {}
+        return g.cache_versions
+
+    def versions(self, *scopes):
+        """The versions of the scopes, fetching the ones not yet read in one query."""
+        from .models import CacheVersion  # lazy import
+        known = self._known()
+        missing = [scope for scope in scopes if scope not in known]
+        if missing:
+            known.update(dict.fromkeys(missing, 0))
+            # Always the primary: a replica's versions could predate its rows
+            known.update(db.session.execute(
+                select(CacheVersion.scope, CacheVersion.version).where(CacheVersion.scope.in_(missing)),
+                bind_arguments={'bind': db.engine}).all())
+        return [known[scope] for scope in scopes]
+
+    def version(self, scope):
+        return self.versions(scope)[0]
+
+    def invalidate(self, *scopes):
+        from .models import CacheVersion  # lazy import
+        now = time.time_ns()
+        rows = [{'scope': scope, 'version': now} for scope in dict.fromkeys((*scopes, ANY_SCOPE))]
+        stmt = upsert(CacheVersion)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['scope'],
+                                                      set_={'version': stmt.excluded.version}), rows)
+        self._known().update((row['scope'], now) for row in rows)
+
+    def get(self, key):
+        return self.backend.get(f'page:{key}')
+
+    def set(self, key, body):
+        self.backend.set(f'page:{key}', body)
+
+def init_render_cache(app):
+    app.config.setdefault('RENDER_CACHE_ENABLED', True)
+    app.config.setdefault('RENDER_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+    app.config.setdefault('RENDER_CACHE_BACKEND', None)
+
+    backend = app.config['RENDER_CACHE_BACKEND'] or LRUCacheBackend(app.config['RENDER_CACHE_MAX_BYTES'])
+    app.extensions['render_cache'] = RenderCache(backend)
+
+    @app.before_request
+    def forget_cache_versions():
+        # A test client request can reuse an app context that is already pushed
+        g.pop('cache_versions', None)
+
+def invalidate(*scopes):
+    """
+    Marks every cached page depending on any of the scopes as stale. Call it
+    before the commit of the write, which it becomes part of.
+    """
+    current_app.extensions['render_cache'].invalidate(*scopes)
+
+def _tee_into_cache(cache, key, chunks):
+    """Passes a streamed body through unchanged and caches it once complete."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+        yield chunk
+    cache.set(key, b''.join(parts))
+
+def cached_page(*scope_builders, mimetype='text/html'):
+    """
+    Serves a GET view from the render cache. Each scope builder receives the
+    view's keyword arguments and returns a scope name, e.g.
+    lambda media_id: f'media:{media_id}'. Cached bodies are served with
+    `mimetype`, so JSON views must pass theirs.
+
+    Responses carry an ETag derived from the cache key and a Last-Modified
+    from the newest scope version, so unchanged pages revalidate as 304s
+    without touching the database or the template engine. Pages are not
+    cached while flashed messages are pending, since those render once.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            cache = current_app.extensions['render_cache']
+            if not current_app.config['RENDER_CACHE_ENABLED'] or session.get('_flashes'):
+                return view(**kwargs)
+
+            versions = cache.versions(*(build(**kwargs) for build in scope_builders))
+            authenticated = current_user.is_authenticated
+            # Admins see edit links that other users do not
+            viewer = ('admin' if current_user.is_admin else 'user') if authenticated else None
+            raw_key = repr((request.endpoint, sorted(kwargs.items()),
+                            sorted(request.args.items(multi=True)), viewer, versions))
+            key = hashlib.sha1(raw_key.encode()).hexdigest()
+
+            def finish(response):
+                response.set_etag(key)
+                response.last_modified = max(versions) / 1e9
+                response.cache_control.no_cache = True
+                if authenticated:
+                    response.cache_control.private = True
+                response.vary.add('Cookie')
+                return response
+
+            if request.if_none_match.contains(key):
+                return finish(current_app.response_class(status=304))
+
+            body = cache.get(key)
+            if body is not None:
+                return finish(current_app.response_class(body, mimetype=mimetype))
+
+            response = make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                response.response = _tee_into_cache(cache, key, response.response)
+            else:
+                cache.set(key, response.get_data())
+            return finish(response)
+        return wrapper
+    return decorator
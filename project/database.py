@@ -0,0 +1,158 @@
+# project/database.py
+
+import time
+from functools import partial, wraps
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+
+# Flask-SQLAlchemy bind key of the read replica engine
+REPLICA_BIND = 'replica'
+
+# Applied to every new SQLite connection of this app's engines.
+# WAL lets readers keep reading while the admin's edit commits, instead of
+# failing with "database is locked"; NORMAL sync is durable across app
+# crashes in WAL mode and only risks the last commits on power loss.
+DEFAULT_SQLITE_PRAGMAS = {
+    'foreign_keys': 'ON',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,         # ms to wait for a lock before giving up
+    'cache_size': -64000,         # negative = KiB, so 64 MB of page cache
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Dialects the app's SQL is written for. Both spell upserts as INSERT ...
+# ON CONFLICT, each through its own insert() construct.
+UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+def _apply_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def _is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+def _engine_options(app, uri):
+    """
+    Pool settings for an engine: a sized pool for SQLite files (one
+    connection per concurrent request thread), the DATABASE_POOL_* profile
+    for database servers, nothing for in-memory SQLite.
+    """
+    if make_url(uri).get_backend_name() != 'sqlite':
+        return {
+            'pool_size': app.config['DATABASE_POOL_SIZE'],
+            'max_overflow': app.config['DATABASE_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DATABASE_POOL_TIMEOUT'],
+            # Servers and proxies close idle connections and failovers drop
+            # them all: recycle before the server does, and test each
+            # connection on checkout rather than fail the request using it
+            'pool_recycle': app.config['DATABASE_POOL_RECYCLE'],
+            'pool_pre_ping': app.config['DATABASE_POOL_PRE_PING'],
+        }
+    if not _is_sqlite_file(uri):
+        return {}
+    busy_timeout = app.config['SQLITE_PRAGMAS'].get('busy_timeout', 5000)
+    return {
+        'pool_size': app.config['SQLITE_POOL_SIZE'],
+        'max_overflow': app.config['SQLITE_POOL_OVERFLOW'],
+        'pool_timeout': app.config['SQLITE_POOL_TIMEOUT'],
+        'connect_args': {'timeout': busy_timeout / 1000},
+    }
+
+def init_database(app):
+    """
+    Binds db to the app with the pool profile of its database and, with
+    DATABASE_REPLICA_URI set, a second engine for the read replica (see
+    reads_from_replica). SQLITE_PRAGMAS are applied to each new connection
+    of this app's SQLite engines only, not to every Engine in the process.
+    """
+    from . import db  # lazy import
+    app.config.setdefault('SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    app.config.setdefault('SQLITE_POOL_SIZE', 10)
+    app.config.setdefault('SQLITE_POOL_OVERFLOW', 10)
+    app.config.setdefault('SQLITE_POOL_TIMEOUT', 30)
+    app.config.setdefault('DATABASE_POOL_SIZE', 10)
+    app.config.setdefault('DATABASE_MAX_OVERFLOW', 20)
+    app.config.setdefault('DATABASE_POOL_TIMEOUT', 30)
+    app.config.setdefault('DATABASE_POOL_RECYCLE', 1800)  # seconds
+    app.config.setdefault('DATABASE_POOL_PRE_PING', True)
+    app.config.setdefault('DATABASE_REPLICA_URI', None)
+    app.config.setdefault('DATABASE_REPLICA_MAX_LAG', 5)  # seconds
+
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', _engine_options(app, app.config['SQLALCHEMY_DATABASE_URI']))
+    replica_uri = app.config['DATABASE_REPLICA_URI']
+    if replica_uri:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA_BIND, {'url': replica_uri, **_engine_options(app, replica_uri)})
+
+    db.init_app(app)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', partial(_apply_pragmas, app.config['SQLITE_PRAGMAS']))
+
+def upsert(table):
+    """
+    An INSERT into table for the primary's dialect, with the
+    on_conflict_do_update() / on_conflict_do_nothing() methods.
+    """
+    from . import db  # lazy import
+    dialect = db.engine.dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise NotImplementedError(f'Upserts are written for {", ".join(UPSERT_INSERTS)}, not {dialect}.')
+    return UPSERT_INSERTS[dialect](table)
+
+# -------------------
+# READ REPLICA
+# -------------------
+
+class RoutingSession(Session):
+    """
+    Session that sends the statements of requests marked by
+    reads_from_replica to the replica engine. Flushes, and everything in
+    any other request or CLI command, use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get('read_replica'):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def _replica_caught_up():
+    """
+    True when the last write is older than DATABASE_REPLICA_MAX_LAG. Every
+    write path invalidates the render cache, so its newest version is the
+    time of the last write, read from the primary like every version.
+    """
+    from .cache import ANY_SCOPE  # lazy import
+    last_write = current_app.extensions['render_cache'].version(ANY_SCOPE)
+    return time.time_ns() - last_write >= current_app.config['DATABASE_REPLICA_MAX_LAG'] * 1e9
+
+def reads_from_replica(view):
+    """
+    Runs a read-only view's queries on the read replica, when one is
+    configured. Until the replica has had DATABASE_REPLICA_MAX_LAG to catch
+    up with the last write, they stay on the primary: the writer sees their
+    change on the page they are redirected to, and no page is rendered from
+    stale rows and cached under the version that write created. The mark
+    lasts the whole request, so queries of a streamed template follow it.
+    """
+    @wraps(view)
+    def wrapper(**kwargs):
+        if current_app.config['DATABASE_REPLICA_URI'] and _replica_caught_up():
+            g.read_replica = True
+        return view(**kwargs)
+    return wrapper
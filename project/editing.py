@@ -0,0 +1,163 @@
+# project/editing.py
+
+from sqlalchemy import delete, insert, select, update
+
+from . import db
+
+def _index_rows(rows, key):
+    """
+    Maps key(row) -> row for existing rows. Older saves could leave
+    duplicate numbers behind; the first row wins and the rest are returned
+    as ids to delete.
+    """
+    indexed, duplicates = {}, []
+    for row in rows:
+        k = key(row)
+        if k in indexed:
+            duplicates.append(row.id)
+        else:
+            indexed[k] = row
+    return indexed, duplicates
+
+def _diff(existing, wanted, fields):
+    """
+    Compares existing rows against wanted dicts, both keyed the same way.
+    Returns (keys to insert, update param dicts, ids to delete); rows whose
+    fields already match are left alone.
+    """
+    inserts = [k for k in wanted if k not in existing]
+    updates = []
+    for k, row in existing.items():
+        if k in wanted:
+            values = {field: wanted[k][field] for field in fields}
+            if any(getattr(row, field) != value for field, value in values.items()):
+                updates.append({'id': row.id, **values})
+    deletes = [row.id for k, row in existing.items() if k not in wanted]
+    return inserts, updates, deletes
+
+def _delete_ids(model, ids):
+    if not ids:
+        return 0
+    stmt = delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)
+    return db.session.execute(stmt).rowcount
+
+def _bulk_update(model, params):
+    if params:
+        db.session.execute(update(model), params)
+    return len(params)
+
+def _bulk_insert(model, params):
+    if params:
+        db.session.execute(insert(model), params)
+    return len(params)
+
+def sync_tags(media_id, tag_ids):
+    """Brings media_tags for one media in line with tag_ids. Returns rows touched."""
+    from .models import media_tags  # lazy import
+    current = {row.tag_id for row in db.session.execute(
+        select(media_tags.c.tag_id).where(media_tags.c.media_id == media_id))}
+    wanted = set(tag_ids)
+
+    touched = 0
+    removed = current - wanted
+    if removed:
+        touched += db.session.execute(
+            media_tags.delete().where(media_tags.c.media_id == media_id,
+                                      media_tags.c.tag_id.in_(removed))).rowcount
+    added = wanted - current
+    if added:
+        db.session.execute(media_tags.insert(),
+                           [{'media_id': media_id, 'tag_id': tag_id} for tag_id in sorted(added)])
+        touched += len(added)
+    return touched
+
+def sync_tracks(media_id, tracks):
+    """
+    Diffs the album's tracks against 'tracks' (dicts with track_number, title,
+    rating) keyed by track number. Returns rows touched.
+    """
+    from .models import Track  # lazy import
+    rows = db.session.execute(
+        select(Track.id, Track.track_number, Track.title, Track.rating)
+        .where(Track.media_id == media_id).order_by(Track.id))
+    existing, duplicates = _index_rows(rows, lambda row: row.track_number)
+    wanted = {t['track_number']: t for t in tracks}
+
+    inserts, updates, deletes = _diff(existing, wanted, ('title', 'rating'))
+    touched = _delete_ids(Track, deletes + duplicates)
+    touched += _bulk_update(Track, updates)
+    touched += _bulk_insert(Track, [{**wanted[k], 'media_id': media_id} for k in inserts])
+    return touched
+
+def sync_seasons(media_id, seasons):
+    """
+    Diffs a show's seasons and episodes against 'seasons' (dicts with
+    season_number, rating, year and a list of episode dicts with
+    episode_number, title, rating). Seasons are keyed by season number and
+    episodes by (season number, episode number). Returns rows touched.
+    """
+    from .models import Season, Episode  # lazy import
+    season_rows = db.session.execute(
+        select(Season.id, Season.season_number, Season.rating, Season.year)
+        .where(Season.media_id == media_id).order_by(Season.id))
+    existing_seasons, duplicate_seasons = _index_rows(season_rows, lambda row: row.season_number)
+    wanted_seasons = {s['season_number']: s for s in seasons}
+
+    season_inserts, season_updates, season_deletes = _diff(existing_seasons, wanted_seasons, ('rating', 'year'))
+    dropped_season_ids = season_deletes + duplicate_seasons
+
+    # Episodes of seasons that stay are diffed; those of dropped seasons go with them
+    kept = {row.id: number for number, row in existing_seasons.items() if number in wanted_seasons}
+    existing_episodes, duplicate_episodes = {}, []
+    if kept:
+        episode_rows = db.session.execute(
+            select(Episode.id, Episode.season_id, Episode.episode_number, Episode.title, Episode.rating)
+            .where(Episode.season_id.in_(select(Season.id).where(Season.media_id == media_id)))
+            .order_by(Episode.id))
+        existing_episodes, duplicate_episodes = _index_rows(
+            (row for row in episode_rows if row.season_id in kept),
+            lambda row: (kept[row.season_id], row.episode_number))
+    wanted_episodes = {(number, ep['episode_number']): ep
+                       for number in kept.values()
+                       for ep in wanted_seasons[number]['episodes']}
+    episode_inserts, episode_updates, episode_deletes = _diff(existing_episodes, wanted_episodes, ('title', 'rating'))
+
+    touched = _delete_ids(Episode, episode_deletes + duplicate_episodes)
+    if dropped_season_ids:
+        touched += db.session.execute(
+            delete(Episode).where(Episode.season_id.in_(dropped_season_ids))
+            .execution_options(synchronize_session=False)).rowcount
+        touched += _delete_ids(Season, dropped_season_ids)
+    touched += _bulk_update(Season, season_updates)
+    touched += _bulk_update(Episode, episode_updates)
+
+    season_ids = {number: row.id for number, row in existing_seasons.items()}
+    if season_inserts:
+        params = [{'season_number': number,
+                   'rating': wanted_seasons[number]['rating'],
+                   'year': wanted_seasons[number]['year'],
+                   'media_id': media_id} for number in season_inserts]
+        created = db.session.execute(
+            insert(Season).returning(Season.id, Season.season_number, sort_by_parameter_order=True), params)
+        season_ids.update({row.season_number: row.id for row in created})
+        touched += len(params)
+        new_episodes = {(number, ep['episode_number']): ep
+                        for number in season_inserts
+                        for ep in wanted_seasons[number]['episodes']}
+        wanted_episodes.update(new_episodes)
+        episode_inserts += list(new_episodes)
+
+    touched += _bulk_insert(Episode, [{**wanted_episodes[key], 'season_id': season_ids[key[0]]}
+                                      for key in episode_inserts])
+    return touched
+
+def sync_children(media, seasons, tracks):
+    """
+    Applies the submitted seasons/episodes or tracks to a media, keeping
+    only what matches its type (a movie keeps neither). Returns rows touched.
+    """
+    if media.media_type != 'tv_show':
+        seasons = []
+    if media.media_type != 'album':
+        tracks = []
+    return sync_seasons(media.id, seasons) + sync_tracks(media.id, tracks)
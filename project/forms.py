@@ -1,28 +1,50 @@
 # project/forms.py
 
+import re
 from flask_wtf import FlaskForm
+from werkzeug.datastructures import MultiDict
 from wtforms import StringField, PasswordField, SubmitField, SelectField, FileField, IntegerField, FloatField, FieldList, FormField
-from wtforms.validators import DataRequired, Length, Optional, NumberRange
+from wtforms.validators import DataRequired, InputRequired, Length, Optional, NumberRange
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
     password = PasswordField('Password', validators=[DataRequired()])
     submit = SubmitField('Login')
 
+# Sub-forms for the dynamic season/episode/track rows of edit_media.
+# They are validated inside the MediaForm post, which already carries the CSRF token.
+# InputRequired rather than DataRequired so that season/episode 0 stays valid.
+
 class EpisodeForm(FlaskForm):
-    episode_number = IntegerField('E#', validators=[DataRequired()])
+    class Meta:
+        csrf = False
+
+    episode_number = IntegerField('E#', validators=[InputRequired()])
     title = StringField('Title')
     rating = FloatField('Rating', validators=[Optional(), NumberRange(min=0, max=10)])
 
 class SeasonForm(FlaskForm):
-    season_number = IntegerField('S#', validators=[DataRequired()])
+    class Meta:
+        csrf = False
+
+    season_number = IntegerField('S#', validators=[InputRequired()])
+    year = StringField('Year')
+    rating = FloatField('Rating', validators=[Optional(), NumberRange(min=0, max=10)])
     episodes = FieldList(FormField(EpisodeForm))
 
 class TrackForm(FlaskForm):
-    track_number = IntegerField('T#', validators=[DataRequired()])
+    class Meta:
+        csrf = False
+
+    track_number = IntegerField('T#', validators=[InputRequired()])
     title = StringField('Title')
     rating = FloatField('Rating', validators=[Optional(), NumberRange(min=0, max=10)])
 
+class RatingForm(FlaskForm):
+    rating = FloatField('Your rating', validators=[Optional(), NumberRange(min=0, max=10)])
+    submit = SubmitField('Rate')
+    clear = SubmitField('Clear')
+
 class MediaForm(FlaskForm):
     media_type = SelectField('Type', choices=[
         ('tv_show', 'TV Show'),
@@ -39,5 +61,97 @@ class MediaForm(FlaskForm):
     # UPDATED: This field is now for all media types
     official_rating = FloatField('Official Rating', validators=[Optional(), NumberRange(min=0, max=10)])
     
-    # Dynamic fields for seasons/tracks will be handled in the route
+    # Dynamic fields for seasons/tracks are parsed by parse_media_children()
     submit = SubmitField('Save Media')
+
+class ImportForm(FlaskForm):
+    file = FileField('File (JSONL or CSV)', validators=[DataRequired()])
+    format = SelectField('Format', choices=[('jsonl', 'JSON Lines'), ('csv', 'CSV')])
+    submit = SubmitField('Import')
+
+# season_number_3, ep_title_3_1004, track_rating_7, ...
+NESTED_FIELD_RE = re.compile(r'^(season|ep|track)_(number|title|rating|year)_(\d+)(?:_(\d+))?$')
+
+# Flat edit_media field name -> sub-form field name
+SEASON_FIELDS = {'number': 'season_number', 'year': 'year', 'rating': 'rating'}
+EPISODE_FIELDS = {'number': 'episode_number', 'title': 'title', 'rating': 'rating'}
+TRACK_FIELDS = {'number': 'track_number', 'title': 'title', 'rating': 'rating'}
+
+def parse_media_children(formdata):
+    """
+    Groups the flat season_*/ep_*/track_* keys posted by edit_media.html
+    into nested data in one pass over the form, then validates each season
+    (with its episodes) and each track through SeasonForm/TrackForm.
+
+    Returns (seasons, tracks, errors): lists of dicts ready for
+    editing.sync_children(), and a list of error messages (empty if valid).
+    Rows are kept in the order they appear in the form.
+    """
+    seasons, tracks = {}, {}
+    for key, value in formdata.items():
+        match = NESTED_FIELD_RE.match(key)
+        if match is None:
+            continue
+        kind, field, first, second = match.groups()
+        if kind == 'season' and second is None and field in SEASON_FIELDS:
+            season = seasons.setdefault(first, {'fields': MultiDict(), 'episodes': {}})
+            season['fields'][SEASON_FIELDS[field]] = value
+        elif kind == 'ep' and second is not None and field in EPISODE_FIELDS:
+            season = seasons.setdefault(first, {'fields': MultiDict(), 'episodes': {}})
+            season['episodes'].setdefault(second, {})[EPISODE_FIELDS[field]] = value
+        elif kind == 'track' and second is None and field in TRACK_FIELDS:
+            tracks.setdefault(first, MultiDict())[TRACK_FIELDS[field]] = value
+
+    parsed_seasons, parsed_tracks, errors = [], [], []
+
+    # Episode rows whose season block was removed are dropped
+    kept_seasons = [season for season in seasons.values() if 'season_number' in season['fields']]
+    for s_position, season in enumerate(kept_seasons):
+        fields = season['fields']
+        # Consecutive positions, so FieldList errors line up with the names
+        episodes = [episode for episode in season['episodes'].values() if 'episode_number' in episode]
+        for position, episode in enumerate(episodes):
+            for name, value in episode.items():
+                fields[f'episodes-{position}-{name}'] = value
+        form = SeasonForm(formdata=fields)
+        if not form.validate():
+            errors.append(f"Season {fields.get('season_number') or '?'}: "
+                          f"{_describe(form.errors, f'seasons-{s_position}-')}")
+            continue
+        parsed_seasons.append({
+            'season_number': form.season_number.data,
+            'rating': form.rating.data,
+            'year': form.year.data or '',
+            'episodes': [{'episode_number': ep.episode_number.data,
+                          'title': ep.title.data or '',
+                          'rating': ep.rating.data} for ep in form.episodes],
+        })
+
+    kept_tracks = [fields for fields in tracks.values() if 'track_number' in fields]
+    for t_position, fields in enumerate(kept_tracks):
+        form = TrackForm(formdata=fields)
+        if not form.validate():
+            errors.append(f"Track {fields.get('track_number') or '?'}: "
+                          f"{_describe(form.errors, f'tracks-{t_position}-')}")
+            continue
+        parsed_tracks.append({'track_number': form.track_number.data,
+                              'title': form.title.data or '',
+                              'rating': form.rating.data})
+
+    return parsed_seasons, parsed_tracks, errors
+
+def _describe(form_errors, prefix=''):
+    """
+    Flattens WTForms' nested error dict into one readable line, each message
+    after the path of its field ('seasons-0-episodes-3-rating: ...').
+    """
+    parts = []
+    for name, messages in form_errors.items():
+        for position, message in enumerate(messages):
+            if isinstance(message, dict):
+                # A FieldList entry: its errors, or {} when it has none
+                if message:
+                    parts.append(_describe(message, f'{prefix}{name}-{position}-'))
+            else:
+                parts.append(f'{prefix}{name}: {message}')
+    return '; '.join(parts)
@@ -0,0 +1,158 @@
+# project/instrumentation.py
+
+import hmac
+import time
+from functools import partial
+
+from flask import (Response, abort, before_render_template, g, has_app_context, request, request_started,
+                   template_rendered)
+from sqlalchemy import event
+
+from . import db
+from .metrics import COUNT_BUCKETS, MetricsRegistry
+
+# Longest parameter repr written to the slow-query log; executemany batches can be huge
+SLOW_QUERY_MAX_PARAMS = 500
+
+# -------------------
+# SQL
+# -------------------
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def query_count():
+    """Number of SQL statements executed so far in the current request."""
+    return g.get('query_count', 0)
+
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _stop_timer(app, conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    metrics = app.extensions['metrics']
+    metrics.sql_seconds.observe(elapsed)
+    if has_app_context():
+        g.db_time = g.get('db_time', 0.0) + elapsed
+
+    threshold = app.config['SLOW_QUERY_THRESHOLD_MS']
+    if threshold is not None and elapsed * 1000 >= threshold:
+        metrics.slow_statements.inc()
+        params = repr(parameters)
+        if len(params) > SLOW_QUERY_MAX_PARAMS:
+            params = params[:SLOW_QUERY_MAX_PARAMS] + '...'
+        app.logger.warning('Slow query (%.1f ms%s): %s\nParameters: %s', elapsed * 1000,
+                           ', executemany' if executemany else '', statement, params)
+
+def _discard_timer(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+# -------------------
+# REQUESTS
+# -------------------
+
+def _request_started(sender, **extra):
+    g.request_started = time.perf_counter()
+
+def _render_started(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+def _render_finished(sender, template, context, **extra):
+    # Includes queries the template triggers, e.g. rows of a streamed page
+    started = g.pop('render_started', None)
+    if started is not None:
+        g.render_time = g.get('render_time', 0.0) + time.perf_counter() - started
+
+def _record_request(metrics, state, endpoint, method, status):
+    """
+    Runs when the server closes the response, which for streamed responses
+    is after the last chunk was sent, so the timings cover the whole body.
+    `state` is the request's g, kept past the end of its app context.
+    """
+    metrics.requests.inc(endpoint, method, status)
+    metrics.request_seconds.observe(time.perf_counter() - state.request_started, endpoint)
+    metrics.request_db_seconds.observe(state.get('db_time', 0.0), endpoint)
+    metrics.request_queries.observe(state.get('query_count', 0), endpoint)
+    if 'render_time' in state:
+        metrics.request_render_seconds.observe(state.render_time, endpoint)
+
+class AppMetrics(MetricsRegistry):
+    def __init__(self):
+        super().__init__()
+        self.requests = self.counter(
+            'http_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+        self.request_seconds = self.histogram(
+            'http_request_duration_seconds', 'Wall time per request, including streamed bodies.', ('endpoint',))
+        self.request_db_seconds = self.histogram(
+            'http_request_db_seconds', 'Time spent executing SQL per request.', ('endpoint',))
+        self.request_render_seconds = self.histogram(
+            'http_request_render_seconds', 'Template render time per request.', ('endpoint',))
+        self.request_queries = self.histogram(
+            'http_request_queries', 'SQL statements per request.', ('endpoint',), buckets=COUNT_BUCKETS)
+        self.sql_seconds = self.histogram(
+            'sql_statement_duration_seconds', 'Execution time of each SQL statement.')
+        self.slow_statements = self.counter(
+            'sql_slow_statements_total', 'Statements slower than SLOW_QUERY_THRESHOLD_MS.')
+
+def init_instrumentation(app):
+    """
+    Counts SQL statements per request on this app's own engines. With
+    SQL_QUERY_COUNT_HEADER enabled the count is also returned in an
+    X-Query-Count response header, so tests can assert on it through the
+    test client.
+
+    With METRICS_ENABLED (the default) it also times every statement and,
+    per endpoint, each request's wall, SQL and template render time, served
+    in the Prometheus text format at /metrics to scrapers that send
+    "Authorization: Bearer <METRICS_TOKEN>"; without a METRICS_TOKEN the
+    endpoint is not served at all. Statements slower than
+    SLOW_QUERY_THRESHOLD_MS are logged with their parameters (None turns
+    the log off). Each observation is one bucket increment, cheap enough to
+    leave on in production. Metrics are kept per process.
+    """
+    app.config.setdefault('SQL_QUERY_COUNT_HEADER', False)
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 250)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _count_query)
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.config['SQL_QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(query_count())
+        if 'request_started' in g:
+            response.call_on_close(partial(
+                _record_request, app.extensions['metrics'], g._get_current_object(),
+                request.endpoint or '<unmatched>', request.method, response.status_code))
+        return response
+
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.extensions['metrics'] = AppMetrics()
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _start_timer)
+        event.listen(engine, 'after_cursor_execute', partial(_stop_timer, app))
+        event.listen(engine, 'handle_error', _discard_timer)
+
+    request_started.connect(_request_started, app)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            abort(401)
+        return Response(app.extensions['metrics'].expose(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
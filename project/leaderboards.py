@@ -0,0 +1,202 @@
+# project/leaderboards.py
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+from . import db
+from .database import upsert
+from .listing import PAGE_SIZE, _after, _ordering, decode_cursor, encode_cursor
+
+# Boards: one per media type, one per tag ('tag:<id>') and one for songs
+# (singles plus every album track). Each board keeps an entry for every
+# item rather than only the top N, so removing an entry never requires
+# finding the next one to promote. Pages are read best-first off the
+# (board, score, media_id, track_id) index, scanned backwards.
+TYPE_BOARDS = ('movie', 'tv_show', 'album', 'single')
+SONGS_BOARD = 'songs'
+BOARD_TITLES = {'movie': 'Movies', 'tv_show': 'TV Shows', 'album': 'Albums',
+                'single': 'Singles', SONGS_BOARD: 'Songs'}
+
+REFRESH_BATCH_SIZE = 500
+
+def tag_board(tag_id):
+    return f'tag:{tag_id}'
+
+def is_board(board):
+    if board in TYPE_BOARDS or board == SONGS_BOARD:
+        return True
+    prefix, _, tag_id = board.partition(':')
+    return prefix == 'tag' and tag_id.isdigit()
+
+# -------------------
+# MAINTENANCE
+# -------------------
+
+def _wanted_entries(media_ids):
+    """
+    The entries the given media should have, computed from the current
+    rows: (board, media_id, track_id) -> (score, tier).
+    """
+    from .models import Media, Track, media_tags, get_rating_class  # lazy import
+    wanted = {}
+    media = {}
+    for media_id, media_type, score in db.session.execute(
+            select(Media.id, Media.media_type, Media.overall_score).where(Media.id.in_(media_ids))):
+        media[media_id] = (media_type, score, get_rating_class(score, media_type))
+        if media_type in TYPE_BOARDS:
+            wanted[(media_type, media_id, 0)] = media[media_id][1:]
+        if media_type == 'single':
+            wanted[(SONGS_BOARD, media_id, 0)] = media[media_id][1:]
+    if not media:
+        return wanted
+
+    for media_id, tag_id in db.session.execute(
+            select(media_tags.c.media_id, media_tags.c.tag_id).where(media_tags.c.media_id.in_(media_ids))):
+        wanted[(tag_board(tag_id), media_id, 0)] = media[media_id][1:]
+
+    album_ids = [media_id for media_id, (media_type, _, _) in media.items() if media_type == 'album']
+    if album_ids:
+        # Same score as the songs listing: an unrated track counts as 0
+        for media_id, track_id, score in db.session.execute(
+                select(Track.media_id, Track.id, func.coalesce(Track.rating, 0.0))
+                .where(Track.media_id.in_(album_ids))):
+            wanted[(SONGS_BOARD, media_id, track_id)] = (score, get_rating_class(score, 'album_track'))
+    return wanted
+
+def _apply_tier_changes(changes):
+    """Adds the (board, tier) -> delta counts to leaderboard_tier with one upsert."""
+    from .models import LeaderboardTier  # lazy import
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if not changes:
+        return
+    stmt = upsert(LeaderboardTier)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['board', 'tier'], set_={'count': LeaderboardTier.count + stmt.excluded.count})
+    db.session.execute(stmt, [{'board': board, 'tier': tier, 'count': delta}
+                              for (board, tier), delta in changes.items()])
+    db.session.execute(delete(LeaderboardTier).where(
+        LeaderboardTier.count <= 0, LeaderboardTier.board.in_({board for board, _ in changes})))
+
+def _refresh_batch(media_ids):
+    from .models import LeaderboardEntry  # lazy import
+    existing = {(row.board, row.media_id, row.track_id): (row.score, row.tier)
+                for row in db.session.execute(
+                    select(LeaderboardEntry.board, LeaderboardEntry.media_id,
+                           LeaderboardEntry.track_id, LeaderboardEntry.score, LeaderboardEntry.tier)
+                    .where(LeaderboardEntry.media_id.in_(media_ids)))}
+    wanted = _wanted_entries(media_ids)
+
+    inserts, updates, deletes, tier_changes = [], [], [], {}
+    for key, (score, tier) in wanted.items():
+        old = existing.get(key)
+        if old == (score, tier):
+            continue
+        entry = {'board': key[0], 'media_id': key[1], 'track_id': key[2], 'score': score, 'tier': tier}
+        (inserts if old is None else updates).append(entry)
+        if old is None or old[1] != tier:
+            tier_changes[(key[0], tier)] = tier_changes.get((key[0], tier), 0) + 1
+        if old is not None and old[1] != tier:
+            tier_changes[(key[0], old[1])] = tier_changes.get((key[0], old[1]), 0) - 1
+    for key, (score, tier) in existing.items():
+        if key not in wanted:
+            deletes.append({'key_board': key[0], 'key_media_id': key[1], 'key_track_id': key[2]})
+            tier_changes[(key[0], tier)] = tier_changes.get((key[0], tier), 0) - 1
+
+    # executemany for each kind of change; the ORM bulk UPDATE goes by primary key
+    if inserts:
+        db.session.execute(insert(LeaderboardEntry), inserts)
+    if updates:
+        db.session.execute(update(LeaderboardEntry), updates)
+    if deletes:
+        table = LeaderboardEntry.__table__
+        db.session.execute(table.delete().where(table.c.board == bindparam('key_board'),
+                                                table.c.media_id == bindparam('key_media_id'),
+                                                table.c.track_id == bindparam('key_track_id')), deletes)
+    _apply_tier_changes(tier_changes)
+    return len(inserts) + len(updates) + len(deletes)
+
+def refresh_leaderboards(media_ids):
+    """
+    Brings the leaderboard entries and tier counts of the given media in
+    line with their current scores, tags and tracks. Only entries that
+    changed are written, so an edit costs a few rows whatever the size of
+    the library. Call it after the media rows are written (or deleted) and
+    before the commit. Returns the number of entries written.
+    """
+    media_ids = list(media_ids)
+    touched = 0
+    for start in range(0, len(media_ids), REFRESH_BATCH_SIZE):
+        touched += _refresh_batch(media_ids[start:start + REFRESH_BATCH_SIZE])
+    return touched
+
+def rebuild_leaderboards():
+    """Recomputes every board from scratch (new installs and repairs)."""
+    from .models import LeaderboardEntry, LeaderboardTier, Media  # lazy import
+    db.session.execute(delete(LeaderboardEntry))
+    db.session.execute(delete(LeaderboardTier))
+    last_id = 0
+    while True:
+        media_ids = db.session.scalars(
+            select(Media.id).where(Media.id > last_id).order_by(Media.id).limit(REFRESH_BATCH_SIZE)).all()
+        if not media_ids:
+            return
+        _refresh_batch(media_ids)
+        last_id = media_ids[-1]
+
+# -------------------
+# READING
+# -------------------
+
+def tier_counts(board):
+    """[(tier, count)] for a board, best tier first, including empty tiers."""
+    from .models import LeaderboardTier, RATING_TIERS  # lazy import
+    counts = dict(db.session.execute(
+        select(LeaderboardTier.tier, LeaderboardTier.count).where(LeaderboardTier.board == board)).all())
+    return [(tier, counts.get(tier, 0)) for tier in RATING_TIERS]
+
+def leaderboard_page(board, after=None, per_page=PAGE_SIZE):
+    """
+    One page of a board, best first, read straight off the rank index, so
+    a page costs per_page index steps whatever the size of the board.
+    The cursor carries the rank of the last row so later pages keep
+    numbering. Returns (entries, next_cursor).
+    """
+    from .models import LeaderboardEntry, Media, Track  # lazy import
+    stmt = (
+        select(LeaderboardEntry.media_id, LeaderboardEntry.track_id,
+               LeaderboardEntry.score, LeaderboardEntry.tier,
+               Media.title, Media.creator, Media.media_type, Media.poster_img,
+               Track.title.label('track_title'))
+        .join(Media, Media.id == LeaderboardEntry.media_id)
+        .outerjoin(Track, Track.id == LeaderboardEntry.track_id)
+        .where(LeaderboardEntry.board == board)
+    )
+    keys = (LeaderboardEntry.score, LeaderboardEntry.media_id, LeaderboardEntry.track_id)
+    rank = 0
+    position = decode_cursor(after, id_count=3)
+    if position is not None:
+        *position, rank = position
+        stmt = stmt.where(_after(keys, position, descending=True))
+    stmt = stmt.order_by(*_ordering(keys, descending=True)).limit(per_page + 1)
+
+    rows = db.session.execute(stmt).all()
+    entries = [{**row._asdict(), 'rank': rank + n} for n, row in enumerate(rows[:per_page], start=1)]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = entries[-1]
+        next_cursor = encode_cursor(last['score'], last['media_id'], last['track_id'], last['rank'])
+    return entries, next_cursor
+
+# -------------------
+# CLI
+# -------------------
+
+leaderboard_cli = AppGroup('leaderboard', help='Materialized leaderboard maintenance.')
+
+@leaderboard_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every leaderboard and tier count from the media tables."""
+    rebuild_leaderboards()
+    db.session.commit()
+    click.echo('Leaderboards rebuilt.')
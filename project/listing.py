@@ -0,0 +1,210 @@
+# project/listing.py
+
+import base64
+import json
+
+from sqlalchemy import and_, exists, func, literal, select, tuple_, union_all
+
+from . import db
+
+PAGE_SIZE = 60
+
+# sort key -> (column expression builder, descending?)
+SORTS = {
+    'title_asc': (lambda Media: func.lower(Media.title), False),
+    'score_desc': (lambda Media: Media.overall_score, True),
+    'score_asc': (lambda Media: Media.overall_score, False),
+    'year_desc': (lambda Media: Media.start_year, True),
+    'year_asc': (lambda Media: Media.start_year, False),
+    'community_desc': (lambda Media: Media.community_score, True),
+    'community_asc': (lambda Media: Media.community_score, False),
+}
+
+def encode_cursor(value, *ids):
+    """Packs the sort value and id(s) of the last row on a page into an opaque token."""
+    raw = json.dumps([value, *ids], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, id_count=1):
+    """
+    Inverse of encode_cursor. Returns (value, id, ...) or None for missing or
+    malformed tokens.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, *ids = json.loads(base64.urlsafe_b64decode(padded))
+        if len(ids) != id_count:
+            return None
+        return (value, *(int(i) for i in ids))
+    except (ValueError, TypeError):
+        return None
+
+def parse_tag_ids(values):
+    """Turns ?tag=3&tag=7 into [3, 7]; 'all' and junk values are ignored."""
+    tag_ids = []
+    for value in values:
+        try:
+            tag_id = int(value)
+        except (ValueError, TypeError):
+            continue
+        if tag_id not in tag_ids:
+            tag_ids.append(tag_id)
+    return tag_ids
+
+def tag_filter_clause(media_id_column, tag_ids, mode='any'):
+    """
+    Correlated EXISTS against media_tags for the given media id column.
+    mode='any' keeps media carrying at least one of the tags, mode='all' only
+    media carrying every one of them. Each EXISTS is a single index probe on
+    the (media_id, tag_id) primary key, and the whole filter stays inside
+    the one listing query instead of shipping id lists back and forth.
+    """
+    from .models import media_tags  # lazy import
+
+    def has(*clauses):
+        return exists().where(media_tags.c.media_id == media_id_column, *clauses)
+
+    if mode == 'all':
+        return and_(*(has(media_tags.c.tag_id == tag_id) for tag_id in tag_ids))
+    if len(tag_ids) == 1:
+        return has(media_tags.c.tag_id == tag_ids[0])
+    return has(media_tags.c.tag_id.in_(tag_ids))
+
+def _after(keys, position, descending):
+    """WHERE clause selecting rows strictly past 'position' in (keys...) order."""
+    boundary = tuple_(*keys)
+    start = tuple_(*(literal(value) for value in position))
+    return boundary < start if descending else boundary > start
+
+def _ordering(keys, descending):
+    return [key.desc() if descending else key.asc() for key in keys]
+
+def paginate_media(query, sort_by, after=None, per_page=PAGE_SIZE):
+    """
+    Keyset pagination over Media: ORDER BY <sort key>, id LIMIT per_page+1,
+    starting strictly after the (value, id) pair in the 'after' cursor.
+    The cost of a page does not depend on how deep into the listing it is.
+
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    from .models import Media  # lazy import
+    key_builder, descending = SORTS.get(sort_by, SORTS['title_asc'])
+    key = key_builder(Media)
+
+    position = decode_cursor(after)
+    if position is not None:
+        query = query.filter(_after((key, Media.id), position, descending))
+    query = query.order_by(*_ordering((key, Media.id), descending))
+
+    rows = query.add_columns(key).limit(per_page + 1).all()
+    items = [row[0] for row in rows[:per_page]]
+    next_cursor = None
+    if len(rows) > per_page:
+        last_media, last_key = rows[per_page - 1]
+        next_cursor = encode_cursor(last_key, last_media.id)
+    return items, next_cursor
+
+# -------------------
+# SONGS
+# -------------------
+
+def songs_select(tag_ids=(), tag_mode='any'):
+    """
+    Every song in the library as one UNION ALL: singles straight from Media,
+    plus each album Track joined to its album. Columns match what index.html
+    reads from a media card, plus the sort keys and a track_id (0 for singles)
+    that makes (media_id, track_id) unique.
+    """
+    from .models import Media, Track  # lazy import
+
+    singles = (
+        select(
+            Media.id.label('id'),
+            literal(0).label('track_id'),
+            Media.title.label('title'),
+            Media.creator.label('creator'),
+            Media.years.label('years'),
+            Media.poster_img.label('poster_img'),
+            Media.overall_score.label('overall_score'),
+            Media.start_year.label('start_year'),
+            literal('single').label('media_type'),
+        )
+        .where(Media.media_type == 'single')
+    )
+    album_tracks = (
+        select(
+            Media.id,
+            Track.id,
+            func.coalesce(Track.title, ''),
+            Media.creator,
+            Media.years,
+            Media.poster_img,
+            func.coalesce(Track.rating, 0.0),
+            Media.start_year,
+            literal('album_track'),
+        )
+        .join(Media, Track.media_id == Media.id)
+        .where(Media.media_type == 'album')
+    )
+    if tag_ids:
+        singles = singles.where(tag_filter_clause(Media.id, tag_ids, tag_mode))
+        album_tracks = album_tracks.where(tag_filter_clause(Media.id, tag_ids, tag_mode))
+
+    return union_all(singles, album_tracks).subquery('songs')
+
+# No community sorts: users rate whole media, so album tracks have no community score
+SONG_SORTS = {
+    'title_asc': (lambda songs: func.lower(songs.c.title), False),
+    'score_desc': (lambda songs: songs.c.overall_score, True),
+    'score_asc': (lambda songs: songs.c.overall_score, False),
+    'year_desc': (lambda songs: songs.c.start_year, True),
+    'year_asc': (lambda songs: songs.c.start_year, False),
+}
+
+class SongPage:
+    """
+    A lazily-consumed page of songs. Iterating fetches the page's rows (one
+    round trip, at most per_page + 1 of them) only once the template
+    reaches the grid, hands them to prefetch so whatever the grid needs for
+    them is looked up at once, then yields them; next_cursor is only known
+    from then on, which is fine for templates that render the pager after
+    the grid.
+    """
+
+    def __init__(self, result, per_page, prefetch=None):
+        self._result = result
+        self._per_page = per_page
+        self._prefetch = prefetch
+        self.next_cursor = None
+
+    def __iter__(self):
+        rows = self._result.fetchmany(self._per_page + 1)
+        self._result.close()
+        if len(rows) > self._per_page:
+            rows = rows[:self._per_page]
+            last = rows[-1]
+            self.next_cursor = encode_cursor(last.sort_key, last.id, last.track_id)
+        if self._prefetch is not None:
+            self._prefetch(rows)
+        yield from rows
+
+def paginate_songs(sort_by, tag_ids=(), tag_mode='any', after=None, per_page=PAGE_SIZE, prefetch=None):
+    """
+    Keyset-paginated, database-sorted page of the songs UNION. Returns a
+    SongPage, whose rows are fetched when the streamed template reaches the
+    grid; prefetch is called with them.
+    """
+    songs = songs_select(tag_ids, tag_mode)
+    key_builder, descending = SONG_SORTS.get(sort_by, SONG_SORTS['title_asc'])
+    key = key_builder(songs)
+    keys = (key, songs.c.id, songs.c.track_id)
+
+    stmt = select(songs, key.label('sort_key'))
+    position = decode_cursor(after, id_count=2)
+    if position is not None:
+        stmt = stmt.where(_after(keys, position, descending))
+    stmt = stmt.order_by(*_ordering(keys, descending)).limit(per_page + 1)
+
+    return SongPage(db.session.execute(stmt), per_page, prefetch)
@@ -0,0 +1,19 @@
+# project/loaders.py
+
+from sqlalchemy.orm import selectinload
+
+def load_media_detail(media_id):
+    """
+    Fetches a Media with everything media_page.html renders: tags, tracks,
+    seasons and their episodes. Each relationship is loaded with one
+    SELECT ... WHERE parent_id IN (...), so the page costs the same fixed
+    number of queries whether a show has 1 season or 40.
+    Ordering comes from the relationship definitions on the models.
+    """
+    from .models import Media, Season  # lazy import
+    return (Media.query
+            .options(selectinload(Media.tags),
+                     selectinload(Media.tracks),
+                     selectinload(Media.seasons).selectinload(Season.episodes))
+            .filter(Media.id == media_id)
+            .first_or_404())
@@ -1,19 +1,76 @@
 # project/models.py
 
+import math
+
 from . import db
 from flask_login import UserMixin
 
+
+def parse_start_year(years):
+    """Returns the leading 4-digit year of a 'years' string (e.g. '2015-2019'), or 0."""
+    if not years:
+        return 0
+    try:
+        return int(years[:4])
+    except (ValueError, IndexError):
+        return 0
+
+def compute_overall_score(media_type, official_rating, track_average=None):
+    """
+    The unified score used for sorting and display:
+    - For albums: average track rating if available, otherwise official_rating
+    - For singles, movies, TV shows: official_rating
+    """
+    if media_type == 'album' and track_average is not None:
+        return track_average
+    return official_rating or 0.0
+
+# Rating tiers from best to worst, as returned by get_rating_class
+RATING_TIERS = ('legendary', 'awesome', 'great', 'good', 'okay', 'bad', 'garbage')
+
+def get_rating_class(rating, media_type=None, context='general'):
+    """
+    Determines the CSS class for a rating based on score, media type, and page context.
+    """
+    if rating is None:
+        return "garbage"
+    
+    threshold = 9.5
+
+    if media_type == 'album':
+        threshold = 8.75 if context == 'detail' else 8.5
+    elif media_type == 'single':
+        threshold = 9.5
+    elif media_type == 'movie':
+        threshold = 9.0
+    elif media_type == 'tv_show':
+        threshold = 9.0
+    elif media_type == 'album_track':
+        threshold = 9.5
+
+    if rating >= threshold: return "legendary"
+    if rating >= 9.0: return "awesome"
+    if rating >= 8.0: return "great"
+    if rating >= 7.0: return "good"
+    if rating >= 6.0: return "okay"
+    if rating >= 5.0: return "bad"
+    return "garbage"
+
 # Association table for many-to-many between Media and Tags
 media_tags = db.Table(
     'media_tags',
     db.Column('media_id', db.Integer, db.ForeignKey('media.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    # The primary key covers lookups by media; this covers lookups by tag
+    db.Index('ix_media_tags_tag_media', 'tag_id', 'media_id')
 )
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(256), nullable=False)
+    # Admins edit, import and export the library; other users only rate it
+    is_admin = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
 
 class Media(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -25,23 +82,67 @@ class Media(db.Model):
     poster_img = db.Column(db.String(200))
     banner_img = db.Column(db.String(200))
 
+    # Materialized sort keys, kept in sync by refresh_derived_fields()
+    overall_score = db.Column(db.Float, nullable=False, default=0.0, server_default='0', index=True)
+    start_year = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    # Rated tracks of an album and the sum of their ratings
+    track_rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    track_rating_sum = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    # Community rollups of the UserRating rows, kept by ratings.rate(); the
+    # mean is materialized (0 while unrated) so listings can sort on it
+    user_rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    user_rating_sum = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    user_rating_sum_sq = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    community_score = db.Column(db.Float, nullable=False, default=0.0, server_default='0', index=True)
+
     # Relationships
-    tracks = db.relationship('Track', backref='media', cascade="all, delete-orphan")
-    seasons = db.relationship('Season', backref='media', cascade="all, delete-orphan")
-    tags = db.relationship('Tag', secondary=media_tags, back_populates='media_items')
+    tracks = db.relationship('Track', backref='media', cascade="all, delete-orphan",
+                             order_by='Track.track_number')
+    seasons = db.relationship('Season', backref='media', cascade="all, delete-orphan",
+                              order_by='Season.season_number')
+    tags = db.relationship('Tag', secondary=media_tags, back_populates='media_items',
+                           order_by='Tag.name')
+
+    __table_args__ = (
+        db.Index('ix_media_title_lower', db.func.lower(title)),
+        # Score distributions per creator and per year (stats page)
+        db.Index('ix_media_creator_score', 'creator', 'overall_score'),
+        db.Index('ix_media_year_score', 'start_year', 'overall_score'),
+    )
 
     @property
-    def overall_score(self):
+    def community_stddev(self):
+        """Standard deviation of the users' ratings, from the rollups."""
+        if not self.user_rating_count:
+            return None
+        mean = self.user_rating_sum / self.user_rating_count
+        return math.sqrt(max(self.user_rating_sum_sq / self.user_rating_count - mean * mean, 0.0))
+
+    def refresh_derived_fields(self):
         """
-        Returns a unified score used by templates.
-        - For albums: average track rating if available, otherwise official_rating
-        - For singles, movies, TV shows: official_rating
+        Recomputes the persisted sort keys (see compute_overall_score and
+        parse_start_year) and rating rollups: the album's track count/sum
+        and each season's episode count/sum. Must be called whenever the
+        rating, years, tracks or episodes of this media change.
         """
-        if self.media_type == 'album' and self.tracks:
-            ratings = [t.rating for t in self.tracks if t.rating is not None]
-            if ratings:
-                return sum(ratings) / len(ratings)
-        return self.official_rating or 0.0
+        self.start_year = parse_start_year(self.years)
+        count, total = 0, 0.0
+        if self.media_type == 'album' and self.id is not None:
+            count, total = (db.session.query(db.func.count(Track.rating),
+                                             db.func.coalesce(db.func.sum(Track.rating), 0.0))
+                            .filter(Track.media_id == self.id)
+                            .one())
+        self.track_rating_count, self.track_rating_sum = count, total
+        if self.media_type == 'tv_show' and self.id is not None:
+            # Seasons are written with SQL (editing.sync_seasons), so their rollups are too
+            episodes = db.session.query(Episode.rating).filter(Episode.season_id == Season.id)
+            rated_count = episodes.with_entities(db.func.count(Episode.rating)).scalar_subquery()
+            rated_sum = episodes.with_entities(db.func.coalesce(db.func.sum(Episode.rating), 0.0)).scalar_subquery()
+            db.session.query(Season).filter(Season.media_id == self.id).update(
+                {Season.episode_rating_count: rated_count, Season.episode_rating_sum: rated_sum},
+                synchronize_session=False)
+        average = total / count if count else None
+        self.overall_score = compute_overall_score(self.media_type, self.official_rating, average)
 
 class Track(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,13 +151,23 @@ class Track(db.Model):
     rating = db.Column(db.Float)
     media_id = db.Column(db.Integer, db.ForeignKey('media.id'))
 
+    __table_args__ = (
+        # Covers an album's tracks and the per-album rating aggregates
+        db.Index('ix_track_media_rating', 'media_id', 'rating'),
+        db.Index('ix_track_rating', 'rating'),
+    )
+
 class Season(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     season_number = db.Column(db.Integer)
     rating = db.Column(db.Float)
     year = db.Column(db.String(50))
     media_id = db.Column(db.Integer, db.ForeignKey('media.id'))
-    episodes = db.relationship('Episode', backref='season', cascade="all, delete-orphan")
+    # Rated episodes and the sum of their ratings, kept by Media.refresh_derived_fields()
+    episode_rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    episode_rating_sum = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    episodes = db.relationship('Episode', backref='season', cascade="all, delete-orphan",
+                               order_by='Episode.episode_number')
 
 class Episode(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -65,10 +176,93 @@ class Episode(db.Model):
     rating = db.Column(db.Float)
     season_id = db.Column(db.Integer, db.ForeignKey('season.id'))
 
+    __table_args__ = (
+        # Covers a season's episodes and the per-season rating aggregates
+        db.Index('ix_episode_season_rating', 'season_id', 'rating'),
+        db.Index('ix_episode_rating', 'rating'),
+    )
+
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     category = db.Column(db.String(50))  # 'cinematic' or 'musical'
 
+    __table_args__ = (
+        db.Index('uq_tag_name_category', 'name', 'category', unique=True),
+    )
+
     # Relationship back to Media
     media_items = db.relationship('Media', secondary=media_tags, back_populates='tags')
+
+class UserRating(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    media_id = db.Column(db.Integer, db.ForeignKey('media.id'), primary_key=True)
+    rating = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        # A media's ratings, for deleting them with it and for recomputing its rollups
+        db.Index('ix_user_rating_media', 'media_id', 'rating'),
+    )
+
+# Materialized rankings, maintained by leaderboards.refresh_leaderboards().
+# No foreign keys: like the search index, rows are derived data that is
+# brought in line after the media change, including after a delete.
+
+class LeaderboardEntry(db.Model):
+    board = db.Column(db.String(50), primary_key=True)  # media type, 'songs' or 'tag:<id>'
+    media_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    track_id = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0)  # 0 unless an album track
+    score = db.Column(db.Float, nullable=False)
+    tier = db.Column(db.String(20), nullable=False)
+
+    __table_args__ = (
+        # One board's ranking; read backwards for best first
+        db.Index('ix_leaderboard_entry_rank', 'board', 'score', 'media_id', 'track_id'),
+    )
+
+class LeaderboardTier(db.Model):
+    board = db.Column(db.String(50), primary_key=True)
+    tier = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class SimilarityProfile(db.Model):
+    """What the 'more like this' index compares, one row per media (see similarity.py)."""
+    media_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    media_type = db.Column(db.String(50), nullable=False)
+    signature = db.Column(db.String(500), nullable=False, default='')  # sorted tag ids, comma-separated
+    creator = db.Column(db.String(200))
+    score = db.Column(db.Float, nullable=False)
+    floor = db.Column(db.Float, nullable=False, default=-1.0)  # score of the last neighbor; -1 while the list is short
+
+    __table_args__ = (
+        # Nearest-by-score reads within a (type, tags) group, a creator's type or a type
+        db.Index('ix_similarity_profile_group', 'media_type', 'signature', 'score'),
+        db.Index('ix_similarity_profile_creator', 'creator', 'media_type', 'score'),
+        db.Index('ix_similarity_profile_type', 'media_type', 'score'),
+        db.Index('ix_similarity_profile_floor', 'media_type', 'floor'),
+    )
+
+class SimilarityGroup(db.Model):
+    media_type = db.Column(db.String(50), primary_key=True)
+    signature = db.Column(db.String(500), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class MediaNeighbor(db.Model):
+    media_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    neighbor_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        # The lists a media appears in, for refreshing them when it changes
+        db.Index('ix_media_neighbor_neighbor', 'neighbor_id'),
+    )
+
+class CacheVersion(db.Model):
+    """A render cache scope's version, shared by every worker (see cache.RenderCache)."""
+    scope = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+
+class UploadDerivative(db.Model):
+    """An upload whose DERIVATIVES are all stored, recorded by uploads.generate_derivatives()."""
+    filename = db.Column(db.String(200), primary_key=True)
@@ -0,0 +1,122 @@
+# project/ratings.py
+
+import math
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, delete, func, select, update
+
+from . import db
+from .database import upsert
+
+# Every logged-in user can rate a media 0-10. The ratings live in
+# user_rating; each media keeps their count, sum and sum of squares (mean
+# and standard deviation without reading the rows) and the mean itself as
+# community_score, indexed for sorting. Writes adjust the rollups by the
+# difference the one rating makes, so a rating costs the same whatever the
+# number of ratings; `flask ratings recompute` repairs any drift.
+
+# -------------------
+# WRITING
+# -------------------
+
+def _adjust_rollups(media_id, count_delta, sum_delta, sum_sq_delta):
+    """Adds the deltas to a media's rollups and refreshes its mean, in one UPDATE."""
+    from .models import Media  # lazy import
+    count = Media.user_rating_count + count_delta
+    total = Media.user_rating_sum + sum_delta
+    total_sq = Media.user_rating_sum_sq + sum_sq_delta
+    # The SET expressions all read the old values; sums reset with the count
+    # so rounding left over from earlier deltas cannot outlive the ratings
+    db.session.execute(
+        update(Media).where(Media.id == media_id).values(
+            user_rating_count=count,
+            user_rating_sum=case((count > 0, total), else_=0.0),
+            user_rating_sum_sq=case((count > 0, total_sq), else_=0.0),
+            community_score=case((count > 0, total / count), else_=0.0)),
+        execution_options={'synchronize_session': False})
+
+def rate(user_id, media_id, rating):
+    """
+    Sets a user's rating of a media, or removes it when rating is None,
+    and updates the media's rollups to match. Call it before the commit.
+    Returns the previous rating.
+    """
+    from .models import UserRating  # lazy import
+    old = db.session.execute(select(UserRating.rating).where(
+        UserRating.user_id == user_id, UserRating.media_id == media_id)).scalar()
+    if rating == old:
+        return old
+    if rating is None:
+        db.session.execute(delete(UserRating).where(
+            UserRating.user_id == user_id, UserRating.media_id == media_id))
+    else:
+        stmt = upsert(UserRating).values(user_id=user_id, media_id=media_id, rating=rating)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'media_id'], set_={'rating': stmt.excluded.rating}))
+    new_value, old_value = rating or 0.0, old or 0.0
+    _adjust_rollups(media_id,
+                    (rating is not None) - (old is not None),
+                    new_value - old_value,
+                    new_value * new_value - old_value * old_value)
+    return old
+
+def delete_media_ratings(media_id):
+    """Removes every rating of a media that is being deleted."""
+    from .models import UserRating  # lazy import
+    db.session.execute(delete(UserRating).where(UserRating.media_id == media_id))
+
+# -------------------
+# READING
+# -------------------
+
+def user_rating(user_id, media_id):
+    from .models import UserRating  # lazy import
+    return db.session.execute(select(UserRating.rating).where(
+        UserRating.user_id == user_id, UserRating.media_id == media_id)).scalar()
+
+# -------------------
+# REPAIR
+# -------------------
+
+def recompute_rollups():
+    """
+    Recomputes every media's rollups from the user_rating rows, in one
+    GROUP BY over the (media_id, rating) index, and rewrites the ones that
+    drifted. Returns the number of media fixed.
+    """
+    from .models import Media, UserRating  # lazy import
+    actual = (select(UserRating.media_id, func.count().label('count'),
+                     func.sum(UserRating.rating).label('total'),
+                     func.sum(UserRating.rating * UserRating.rating).label('total_sq'))
+              .group_by(UserRating.media_id).subquery())
+    rows = db.session.execute(
+        select(Media.id, Media.user_rating_count, Media.user_rating_sum, Media.user_rating_sum_sq,
+               Media.community_score, func.coalesce(actual.c.count, 0),
+               func.coalesce(actual.c.total, 0.0), func.coalesce(actual.c.total_sq, 0.0))
+        .outerjoin(actual, actual.c.media_id == Media.id))
+
+    fixes = []
+    for media_id, count, total, total_sq, score, want_count, want_total, want_sq in rows:
+        want_score = want_total / want_count if want_count else 0.0
+        if count != want_count or not all(math.isclose(have, want, rel_tol=1e-9, abs_tol=1e-9)
+                                          for have, want in ((total, want_total), (total_sq, want_sq),
+                                                             (score, want_score))):
+            fixes.append({'id': media_id, 'user_rating_count': want_count, 'user_rating_sum': want_total,
+                          'user_rating_sum_sq': want_sq, 'community_score': want_score})
+    if fixes:
+        db.session.execute(update(Media), fixes)
+    return len(fixes)
+
+# -------------------
+# CLI
+# -------------------
+
+ratings_cli = AppGroup('ratings', help='Community rating maintenance.')
+
+@ratings_cli.command('recompute')
+def recompute_command():
+    """Recompute every media's rating rollups from the user ratings."""
+    fixed = recompute_rollups()
+    db.session.commit()
+    click.echo(f'Rating rollups recomputed; {fixed} media corrected.')
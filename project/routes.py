@@ -1,149 +1,196 @@
 # project/routes.py
 
-import os
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+import io
+from functools import wraps
+from flask import Blueprint, Response, abort, jsonify, render_template, stream_template, stream_with_context, redirect, url_for, request, flash, current_app
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.security import check_password_hash
-from werkzeug.utils import secure_filename
 from . import db
-from .forms import LoginForm, MediaForm
+from .bulk import FORMATS, ImportStats, export_records, format_records, import_records, iter_records
+from .cache import cached_page, invalidate
+from .database import reads_from_replica
+from .editing import sync_children, sync_tags
+from .forms import ImportForm, LoginForm, MediaForm, RatingForm, parse_media_children
+from .leaderboards import BOARD_TITLES, is_board, leaderboard_page, refresh_leaderboards, tier_counts
+from .listing import SONG_SORTS, paginate_media, paginate_songs, parse_tag_ids, tag_filter_clause
+from .loaders import load_media_detail
+from .models import get_rating_class
+from .ratings import delete_media_ratings, rate, user_rating
+from .search import search as search_library
+from .similarity import SIMILARITY_SCOPE, refresh_similarity, similar_media
+from .stats import library_stats
+from .uploads import derived_uploads, save_file
 
 main = Blueprint('main', __name__)
 
-def get_rating_class(rating, media_type=None, context='general'):
+# -------------------
+# ACCESS
+# -------------------
+
+def admin_required(view):
     """
-    Determines the CSS class for a rating based on score, media type, and page context.
+    Like login_required, for views that change or dump the library: users
+    who are not admins (see `flask db add-user --admin`) only rate media.
     """
-    if rating is None:
-        return "garbage"
-    
-    threshold = 9.5
-
-    if media_type == 'album':
-        threshold = 8.75 if context == 'detail' else 8.5
-    elif media_type == 'single':
-        threshold = 9.5
-    elif media_type == 'movie':
-        threshold = 9.0
-    elif media_type == 'tv_show':
-        threshold = 9.0
-    elif media_type == 'album_track':
-        threshold = 9.5
-
-    if rating >= threshold: return "legendary"
-    if rating >= 9.0: return "awesome"
-    if rating >= 8.0: return "great"
-    if rating >= 7.0: return "good"
-    if rating >= 6.0: return "okay"
-    if rating >= 5.0: return "bad"
-    return "garbage"
+    @wraps(view)
+    @login_required
+    def wrapper(**kwargs):
+        if not current_user.is_admin:
+            abort(403)
+        return view(**kwargs)
+    return wrapper
 
 # -------------------
 # ROUTES
 # -------------------
 
 @main.route('/')
+@reads_from_replica
+@cached_page(lambda: 'library', lambda: 'uploads')
 def index():
-    from .models import Media, Tag, media_tags  # lazy import
+    from .models import Media, Tag  # lazy import
     sort_by = request.args.get('sort', 'title_asc')
     filter_type = request.args.get('filter', 'all')
-    tag_filter = request.args.get('tag', 'all')
+    tag_ids = parse_tag_ids(request.args.getlist('tag'))
+    tag_mode = 'all' if request.args.get('mode') == 'all' else 'any'
 
     all_tags = Tag.query.order_by(Tag.name).all()
 
     if filter_type == 'songs':
-        all_songs = []
-
-        singles_query = Media.query.filter_by(media_type='single')
-        if tag_filter != 'all':
-            try:
-                tag_id = int(tag_filter)
-                media_ids_with_tag = db.session.query(media_tags.c.media_id).filter_by(tag_id=tag_id)
-                singles_query = singles_query.filter(Media.id.in_([item[0] for item in media_ids_with_tag]))
-            except (ValueError, TypeError):
-                pass
-
-        for s in singles_query.all():
-            all_songs.append({
-                'id': s.id,
-                'title': s.title,
-                'creator': s.creator,
-                'years': s.years,
-                'poster_img': s.poster_img,
-                'overall_score': s.overall_score or 0.0,
-                'media_type': 'single'
-            })
-
-        albums_query = Media.query.filter_by(media_type='album')
-        if tag_filter != 'all':
-            try:
-                tag_id = int(tag_filter)
-                media_ids_with_tag = db.session.query(media_tags.c.media_id).filter_by(tag_id=tag_id)
-                albums_query = albums_query.filter(Media.id.in_([item[0] for item in media_ids_with_tag]))
-            except (ValueError, TypeError):
-                pass
-
-        for album in albums_query.all():
-            for track in album.tracks:
-                all_songs.append({
-                    'id': album.id,
-                    'title': track.title,
-                    'creator': album.creator,
-                    'years': album.years,
-                    'poster_img': album.poster_img,
-                    'overall_score': track.rating or 0.0,
-                    'media_type': 'album_track'
-                })
-
-        all_media_list = all_songs
-
-        def get_year_for_sort_song(song_item):
-            if not song_item['years']: return 0
-            try: return int(song_item['years'][:4])
-            except (ValueError, IndexError): return 0
-
-        if sort_by == 'score_desc': all_media_list.sort(key=lambda m: m['overall_score'], reverse=True)
-        elif sort_by == 'score_asc': all_media_list.sort(key=lambda m: m['overall_score'])
-        elif sort_by == 'year_desc': all_media_list.sort(key=get_year_for_sort_song, reverse=True)
-        elif sort_by == 'year_asc': all_media_list.sort(key=get_year_for_sort_song)
-        else: all_media_list.sort(key=lambda m: m['title'].lower())
-    else:
-        query = Media.query
-        if filter_type != 'all':
-            query = query.filter(Media.media_type == filter_type)
-        if tag_filter != 'all':
-            try:
-                tag_id = int(tag_filter)
-                media_ids_with_tag = db.session.query(media_tags.c.media_id).filter_by(tag_id=tag_id)
-                query = query.filter(Media.id.in_([item[0] for item in media_ids_with_tag]))
-            except (ValueError, TypeError):
-                pass
-        all_media_list = query.all()
-
-        def get_year_for_sort(media_item):
-            if not media_item.years: return 0
-            try: return int(media_item.years[:4])
-            except (ValueError, IndexError): return 0
-
-        if sort_by == 'score_desc': all_media_list.sort(key=lambda m: m.overall_score, reverse=True)
-        elif sort_by == 'score_asc': all_media_list.sort(key=lambda m: m.overall_score)
-        elif sort_by == 'year_desc': all_media_list.sort(key=get_year_for_sort, reverse=True)
-        elif sort_by == 'year_asc': all_media_list.sort(key=get_year_for_sort)
-        else: all_media_list.sort(key=lambda m: m.title.lower())
+        if sort_by not in SONG_SORTS:
+            sort_by = 'title_asc'
+        song_page = paginate_songs(sort_by, tag_ids=tag_ids, tag_mode=tag_mode, after=request.args.get('after'),
+                                   prefetch=lambda rows: derived_uploads(row.poster_img for row in rows))
+        # Streamed, so the page starts rendering before its rows are fetched
+        return stream_template('index.html',
+                               all_media=song_page,
+                               song_page=song_page,
+                               all_tags=all_tags,
+                               current_sort=sort_by,
+                               current_filter=filter_type,
+                               current_tags=tag_ids,
+                               current_mode=tag_mode,
+                               get_rating_class=get_rating_class)
+
+    query = Media.query
+    if filter_type != 'all':
+        query = query.filter(Media.media_type == filter_type)
+    if tag_ids:
+        query = query.filter(tag_filter_clause(Media.id, tag_ids, tag_mode))
+    all_media_list, next_cursor = paginate_media(query, sort_by, after=request.args.get('after'))
+    derived_uploads(media.poster_img for media in all_media_list)
 
     return render_template('index.html', 
                            all_media=all_media_list, 
                            all_tags=all_tags,
                            current_sort=sort_by, 
                            current_filter=filter_type,
-                           current_tag=tag_filter,
+                           current_tags=tag_ids,
+                           current_mode=tag_mode,
+                           next_cursor=next_cursor,
                            get_rating_class=get_rating_class)
 
+def _render_media_page(media_id):
+    media_item = load_media_detail(media_id)
+    similar = similar_media(media_id)
+    derived_uploads([media_item.poster_img, media_item.banner_img, *(item['poster_img'] for item in similar)])
+    rating_form = None
+    if current_user.is_authenticated:
+        rating_form = RatingForm(formdata=None, rating=user_rating(current_user.id, media_id))
+    return render_template('media_page.html', media=media_item, similar=similar,
+                           rating_form=rating_form, get_rating_class=get_rating_class)
+
+_cached_media_page = cached_page(lambda media_id: f'media:{media_id}', lambda media_id: 'uploads',
+                                 lambda media_id: SIMILARITY_SCOPE)(_render_media_page)
+
 @main.route('/media/<int:media_id>')
+@reads_from_replica
 def media_page(media_id):
+    if current_user.is_authenticated:
+        # The rating form carries the viewer's own rating and CSRF token, so
+        # logged-in views are rendered for each request
+        return _render_media_page(media_id)
+    return _cached_media_page(media_id=media_id)
+
+@main.route('/media/<int:media_id>/rate', methods=['POST'])
+@login_required
+def rate_media(media_id):
     from .models import Media  # lazy import
-    media_item = Media.query.get_or_404(media_id)
-    return render_template('media_page.html', media=media_item, get_rating_class=get_rating_class)
+    if db.session.get(Media, media_id) is None:
+        abort(404)
+    form = RatingForm()
+    if not form.validate():
+        flash('Ratings go from 0 to 10.', 'danger')
+        return redirect(url_for('main.media_page', media_id=media_id))
+    rating = None if form.clear.data else form.rating.data
+    rate(current_user.id, media_id, rating)
+    # 'library': listings sort on the community score
+    invalidate('library', f'media:{media_id}')
+    db.session.commit()
+    flash('Rating removed.' if rating is None else 'Rating saved.', 'success')
+    return redirect(url_for('main.media_page', media_id=media_id))
+
+@main.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    results = search_library(query) if query else []
+    derived_uploads(result['poster_img'] for result in results)
+    return render_template('search.html', query=query, results=results, get_rating_class=get_rating_class)
+
+@main.route('/search/suggest')
+def search_suggest():
+    """Type-ahead: a handful of prefix matches as JSON."""
+    query = request.args.get('q', '').strip()
+    results = search_library(query, limit=8) if query else []
+    return jsonify([{'media_id': r['media_id'],
+                     'kind': r['kind'],
+                     'title': r['media_title'],
+                     'match': str(r['title_snippet'] or ''),
+                     'url': url_for('main.media_page', media_id=r['media_id'])} for r in results])
+
+@main.route('/leaderboard')
+@cached_page(lambda: 'library', lambda: 'uploads')
+def leaderboard():
+    from .models import Tag  # lazy import
+    board = request.args.get('board', 'movie')
+    if not is_board(board):
+        abort(404)
+    entries, next_cursor = leaderboard_page(board, after=request.args.get('after'))
+    derived_uploads(entry['poster_img'] for entry in entries)
+    all_tags = Tag.query.order_by(Tag.name).all()
+    return render_template('leaderboard.html',
+                           board=board,
+                           board_titles=BOARD_TITLES,
+                           all_tags=all_tags,
+                           entries=entries,
+                           tiers=tier_counts(board),
+                           next_cursor=next_cursor)
+
+@main.route('/leaderboard.json')
+@cached_page(lambda: 'library', mimetype='application/json')
+def leaderboard_json():
+    board = request.args.get('board', 'movie')
+    if not is_board(board):
+        abort(404)
+    entries, next_cursor = leaderboard_page(board, after=request.args.get('after'))
+    return jsonify({
+        'board': board,
+        'tiers': [{'tier': tier, 'count': count} for tier, count in tier_counts(board)],
+        'entries': [{**entry, 'url': url_for('main.media_page', media_id=entry['media_id'])}
+                    for entry in entries],
+        'next_cursor': next_cursor,
+    })
+
+@main.route('/stats')
+@cached_page(lambda: 'library')
+def stats():
+    return render_template('stats.html', stats=library_stats())
+
+@main.route('/stats.json')
+@cached_page(lambda: 'library', mimetype='application/json')
+def stats_json():
+    return jsonify(library_stats())
 
 @main.route('/login', methods=['GET', 'POST'])
 def login():
@@ -166,84 +213,44 @@ def logout():
     logout_user()
     return redirect(url_for('main.index'))
 
-def save_file(file_storage):
-    filename = secure_filename(file_storage.filename)
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    file_storage.save(file_path)
-    return filename
-
 @main.route('/edit_media/<int:media_id>', methods=['GET', 'POST'])
-@login_required
+@admin_required
 def edit_media(media_id):
-    from .models import Media, Season, Episode, Track, Tag, media_tags  # lazy import
+    from .models import Media, Tag  # lazy import
     media = Media.query.get_or_404(media_id)
     form = MediaForm(obj=media)
     all_tags = Tag.query.order_by(Tag.name).all()
     media_tag_ids = [tag.id for tag in media.tags]
 
     if form.validate_on_submit():
-        media.media_type = form.media_type.data
-        media.title = form.title.data
-        media.creator = form.creator.data
-        media.years = form.years.data
-        media.official_rating = form.official_rating.data
+        seasons, tracks, errors = parse_media_children(request.form)
+        if not errors:
+            media.media_type = form.media_type.data
+            media.title = form.title.data
+            media.creator = form.creator.data
+            media.years = form.years.data
+            media.official_rating = form.official_rating.data
+
+            if form.poster_img.data:
+                media.poster_img = save_file(form.poster_img.data)
+            if form.banner_img.data:
+                media.banner_img = save_file(form.banner_img.data)
+
+            # Only the rows that actually changed are written
+            rows_touched = sync_tags(media.id, request.form.getlist('tags', type=int))
+            rows_touched += sync_children(media, seasons, tracks)
+            current_app.logger.info('edit_media %s: %d child rows touched', media.id, rows_touched)
+
+            media.refresh_derived_fields()
+            refresh_leaderboards([media.id])
+            panels = refresh_similarity([media.id])
+            invalidate('library', f'media:{media.id}', *panels)
+            db.session.commit()
+            flash('Media updated!', 'success')
+            return redirect(url_for('main.media_page', media_id=media.id))
+        for error in errors:
+            flash(error, 'danger')
 
-        if form.poster_img.data:
-            media.poster_img = save_file(form.poster_img.data)
-        if form.banner_img.data:
-            media.banner_img = save_file(form.banner_img.data)
-
-        delete_stmt = media_tags.delete().where(media_tags.c.media_id == media.id)
-        db.session.execute(delete_stmt)
-        selected_tag_ids = request.form.getlist('tags', type=int)
-        for tag_id in selected_tag_ids:
-            insert_stmt = media_tags.insert().values(media_id=media.id, tag_id=tag_id)
-            db.session.execute(insert_stmt)
-
-        if media.seasons:
-            for season in media.seasons:
-                db.session.delete(season)
-        if media.tracks:
-            for track in media.tracks:
-                db.session.delete(track)
-        
-        db.session.flush()
-
-        if media.media_type == 'tv_show':
-            for s_key, s_val in request.form.items():
-                if s_key.startswith('season_number_'):
-                    s_idx = s_key.split('_')[-1]
-                    season_rating_str = request.form.get(f'season_rating_{s_idx}', '')
-                    season_rating = float(season_rating_str) if season_rating_str else None
-                    season_year = request.form.get(f'season_year_{s_idx}', '')
-
-                    new_season = Season(season_number=int(s_val), rating=season_rating, year=season_year, media_id=media.id)
-                    db.session.add(new_season)
-                    db.session.flush()
-
-                    for e_key, e_val in request.form.items():
-                        if e_key.startswith(f'ep_number_{s_idx}_'):
-                            e_idx = e_key.split('_')[-1]
-                            ep_title = request.form.get(f'ep_title_{s_idx}_{e_idx}', '')
-                            ep_rating_str = request.form.get(f'ep_rating_{s_idx}_{e_idx}', '')
-                            ep_rating = float(ep_rating_str) if ep_rating_str else None
-                            new_ep = Episode(episode_number=int(e_val), title=ep_title, rating=ep_rating, season_id=new_season.id)
-                            db.session.add(new_ep)
-        
-        elif media.media_type == 'album':
-            for t_key, t_val in request.form.items():
-                if t_key.startswith('track_number_'):
-                    t_idx = t_key.split('_')[-1]
-                    track_title = request.form.get(f'track_title_{t_idx}', '')
-                    track_rating_str = request.form.get(f'track_rating_{t_idx}', '')
-                    track_rating = float(track_rating_str) if track_rating_str else None
-                    new_track = Track(track_number=int(t_val), title=track_title, rating=track_rating, media_id=media.id)
-                    db.session.add(new_track)
-
-        db.session.commit()
-        flash('Media updated!', 'success')
-        return redirect(url_for('main.media_page', media_id=media.id))
-        
     return render_template('edit_media.html', 
                            form=form, 
                            media=media, 
@@ -251,7 +258,7 @@ def edit_media(media_id):
                            media_tag_ids=media_tag_ids)
 
 @main.route('/add_media', methods=['GET', 'POST'])
-@login_required
+@admin_required
 def add_media():
     from .models import Media, Tag, media_tags  # lazy import
     form = MediaForm()
@@ -269,6 +276,11 @@ def add_media():
             new_media.banner_img = save_file(form.banner_img.data)
         
         db.session.add(new_media)
+        new_media.refresh_derived_fields()
+        db.session.flush()
+        refresh_leaderboards([new_media.id])
+        panels = refresh_similarity([new_media.id])
+        invalidate('library', *panels)
         db.session.commit()
         flash('New media created. You can now add episodes/tracks and tags.', 'success')
         return redirect(url_for('main.edit_media', media_id=new_media.id))
@@ -277,15 +289,48 @@ def add_media():
     return render_template('edit_media.html', form=form, media=None, all_tags=all_tags, media_tag_ids=[])
 
 @main.route('/delete_media/<int:media_id>', methods=['POST'])
-@login_required
+@admin_required
 def delete_media(media_id):
     from .models import Media, media_tags  # lazy import
     media_to_delete = Media.query.get_or_404(media_id)
     
     delete_stmt = media_tags.delete().where(media_tags.c.media_id == media_id)
     db.session.execute(delete_stmt)
+    delete_media_ratings(media_id)
     
     db.session.delete(media_to_delete)
+    db.session.flush()
+    refresh_leaderboards([media_id])
+    panels = refresh_similarity([media_id])
+    invalidate('library', f'media:{media_id}', *panels)
     db.session.commit()
     flash('Media has been deleted.', 'success')
     return redirect(url_for('main.index'))
+
+@main.route('/bulk', methods=['GET', 'POST'])
+@admin_required
+def bulk():
+    form = ImportForm()
+    if form.validate_on_submit():
+        text_stream = io.TextIOWrapper(form.file.data.stream, encoding='utf-8')
+        stats = ImportStats()
+        try:
+            import_records(iter_records(text_stream, form.format.data), stats=stats)
+        except (ValueError, KeyError, TypeError, SQLAlchemyError) as exc:
+            db.session.rollback()
+            flash(f'Import failed: {exc}. The {stats.media} media before it were imported.', 'danger')
+        else:
+            flash(f'Imported {stats.media} media ({stats.rows} rows) in {stats.seconds:.2f}s '
+                  f'({stats.rows_per_second:,.0f} rows/s).', 'success')
+        return redirect(url_for('main.bulk'))
+    return render_template('bulk.html', form=form, formats=FORMATS)
+
+@main.route('/bulk/export.<fmt>')
+@admin_required
+def bulk_export(fmt):
+    if fmt not in FORMATS:
+        abort(404)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(format_records(export_records(), fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=media.{fmt}'
+    return response
@@ -0,0 +1,267 @@
+# project/schema.py
+
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from . import db
+from .database import upsert
+
+CINEMATIC_TAGS = [
+    'Action', 'Adventure', 'Comedy', 'Drama', 'Romance', 'Horror',
+    'Thriller / Suspense', 'Science Fiction (Sci-Fi)', 'Fantasy',
+    'Crime / Mystery', 'Documentary', 'Animation', 'Anime', 'Marvel'
+]
+
+MUSICAL_TAGS = [
+    'Pop', 'Rock', 'Hip-Hop / Rap', 'R&B / Soul', 'Country', 'Jazz',
+    'Classical', 'EDM', 'Reggae', 'Metal', 'Folk', 'Blues'
+]
+
+ADMIN_USERNAME = 'Ryan'
+ADMIN_PASSWORD = '06242005'
+
+# -------------------
+# MIGRATIONS
+# -------------------
+# Each step brings a database from version N-1 to N; the current version is
+# the one row of schema_version (SQLite databases from before that table
+# kept it in PRAGMA user_version). db.create_all() (step 1) already
+# builds fresh databases at the latest schema, so later steps must be safe
+# to run against tables that have them applied.
+
+def _create_tables():
+    # The primary only: a replica is a copy of it
+    db.create_all(bind_key=None)
+
+def _add_sort_keys():
+    """Materialized Media.overall_score / start_year, backfilled once."""
+    from .models import compute_overall_score, parse_start_year  # lazy import
+    columns = {col['name'] for col in sa_inspect(db.engine).get_columns('media')}
+    missing = [name for name in ('overall_score', 'start_year') if name not in columns]
+    for name in missing:
+        column_type = 'FLOAT' if name == 'overall_score' else 'INTEGER'
+        db.session.execute(text(f"ALTER TABLE media ADD COLUMN {name} {column_type} NOT NULL DEFAULT 0"))
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_media_{name} ON media ({name})"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_media_title_lower ON media (lower(title))"))
+    if missing:
+        # Plain SQL: the Media model may already have columns later steps add
+        averages = dict(db.session.execute(text(
+            "SELECT media_id, avg(rating) FROM track WHERE rating IS NOT NULL GROUP BY media_id")).all())
+        rows = db.session.execute(text("SELECT id, media_type, official_rating, years FROM media")).all()
+        if rows:
+            db.session.execute(text("UPDATE media SET overall_score = :score, start_year = :year WHERE id = :id"),
+                               [{'id': row.id, 'year': parse_start_year(row.years),
+                                 'score': compute_overall_score(row.media_type, row.official_rating,
+                                                                averages.get(row.id))}
+                                for row in rows])
+
+def _index_media_tags_by_tag():
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_media_tags_tag_media ON media_tags (tag_id, media_id)"))
+
+def _create_search_index():
+    from .search import ensure_search_index  # lazy import
+    ensure_search_index()
+
+def _unique_tag_names():
+    db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_tag_name_category ON tag (name, category)"))
+
+def _create_leaderboards():
+    from .leaderboards import rebuild_leaderboards  # lazy import
+    db.create_all(bind_key=None)  # only creates the missing leaderboard tables
+    rebuild_leaderboards()
+
+def _add_rating_rollups():
+    """
+    Per-album track and per-season episode rating count/sum (kept by
+    Media.refresh_derived_fields), backfilled once, plus the indexes the
+    backfill and the stats page's GROUP BYs run on. The episode/track
+    parent indexes also serve detail pages.
+    """
+    for name, table, columns in (('ix_episode_season_rating', 'episode', 'season_id, rating'),
+                                 ('ix_episode_rating', 'episode', 'rating'),
+                                 ('ix_track_media_rating', 'track', 'media_id, rating'),
+                                 ('ix_track_rating', 'track', 'rating'),
+                                 ('ix_media_creator_score', 'media', 'creator, overall_score'),
+                                 ('ix_media_year_score', 'media', 'start_year, overall_score')):
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+    for table, prefix, child, parent_key in (('media', 'track', 'track', 'media_id'),
+                                             ('season', 'episode', 'episode', 'season_id')):
+        columns = {col['name'] for col in sa_inspect(db.engine).get_columns(table)}
+        if f'{prefix}_rating_count' in columns:
+            continue
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {prefix}_rating_count INTEGER NOT NULL DEFAULT 0"))
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {prefix}_rating_sum FLOAT NOT NULL DEFAULT 0"))
+        db.session.execute(text(
+            f"UPDATE {table} SET "
+            f"{prefix}_rating_count = (SELECT count(rating) FROM {child} WHERE {parent_key} = {table}.id), "
+            f"{prefix}_rating_sum = (SELECT coalesce(sum(rating), 0) FROM {child} WHERE {parent_key} = {table}.id)"))
+
+def _create_similarity_index():
+    from .similarity import rebuild_similarity  # lazy import
+    db.create_all(bind_key=None)  # only creates the missing similarity tables
+    rebuild_similarity()
+
+def _add_user_ratings():
+    """
+    The user_rating table and Media's community rollups, which start at
+    zero since nothing has been rated yet.
+    """
+    db.create_all(bind_key=None)  # only creates the missing user_rating table
+    columns = {col['name'] for col in sa_inspect(db.engine).get_columns('media')}
+    for name, column_type in (('user_rating_count', 'INTEGER'), ('user_rating_sum', 'FLOAT'),
+                              ('user_rating_sum_sq', 'FLOAT'), ('community_score', 'FLOAT')):
+        if name not in columns:
+            db.session.execute(text(f"ALTER TABLE media ADD COLUMN {name} {column_type} NOT NULL DEFAULT 0"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_media_community_score ON media (community_score)"))
+
+def _record_upload_derivatives():
+    """
+    The upload_derivative table, backfilled once by asking the upload
+    storage which of the linked uploads already have their derivatives.
+    """
+    from .models import UploadDerivative  # lazy import
+    from .uploads import DERIVATIVES, HASHED_NAME_RE, derivative_name, get_storage  # lazy import
+    db.create_all(bind_key=None)  # only creates the missing upload_derivative table
+    storage = get_storage()
+    names = {name for row in db.session.execute(text("SELECT poster_img, banner_img FROM media"))
+             for name in row if name and HASHED_NAME_RE.match(name)}
+    rows = [{'filename': name} for name in sorted(names)
+            if all(storage.exists(derivative_name(name, size)) for size in DERIVATIVES)]
+    if rows:
+        db.session.execute(upsert(UploadDerivative).on_conflict_do_nothing(), rows)
+
+def _add_admin_flag():
+    """User.is_admin, set for the seeded admin; users added before it only rate."""
+    columns = {col['name'] for col in sa_inspect(db.engine).get_columns('user')}
+    if 'is_admin' not in columns:
+        db.session.execute(text('ALTER TABLE "user" ADD COLUMN is_admin BOOLEAN NOT NULL DEFAULT FALSE'))
+    db.session.execute(text('UPDATE "user" SET is_admin = :admin WHERE username = :username'),
+                       {'admin': True, 'username': ADMIN_USERNAME})
+
+def _create_cache_versions():
+    db.create_all(bind_key=None)  # only creates the missing cache_version table
+
+MIGRATIONS = [
+    _create_tables,
+    _add_sort_keys,
+    _index_media_tags_by_tag,
+    _create_search_index,
+    _unique_tag_names,
+    _create_leaderboards,
+    _add_rating_rollups,
+    _create_similarity_index,
+    _add_user_ratings,
+    _record_upload_derivatives,
+    _add_admin_flag,
+    _create_cache_versions,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version():
+    if sa_inspect(db.engine).has_table('schema_version'):
+        return db.session.execute(text("SELECT version FROM schema_version")).scalar() or 0
+    if db.engine.dialect.name == 'sqlite':
+        return db.session.execute(text("PRAGMA user_version")).scalar()
+    return 0
+
+def _set_schema_version(version):
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    if not db.session.execute(text("UPDATE schema_version SET version = :version"), {'version': version}).rowcount:
+        db.session.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {'version': version})
+
+def upgrade_database():
+    """
+    Applies pending migrations, then the seed data. Safe to run repeatedly;
+    an up-to-date database costs one version read plus the seed upserts.
+    Returns the list of migration step names that were applied.
+    """
+    applied = []
+    current = schema_version()
+    for version, step in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        step()
+        _set_schema_version(version)
+        db.session.commit()
+        applied.append(step.__name__.lstrip('_'))
+    seed_data()
+    return applied
+
+# -------------------
+# SEED DATA
+# -------------------
+
+def seed_data():
+    """Inserts the built-in tags with one upsert and creates the admin user if missing."""
+    from .models import Tag, User  # lazy import
+    tag_rows = ([{'name': name, 'category': 'cinematic'} for name in CINEMATIC_TAGS]
+                + [{'name': name, 'category': 'musical'} for name in MUSICAL_TAGS])
+    db.session.execute(upsert(Tag).values(tag_rows).on_conflict_do_nothing())
+
+    if not db.session.query(User.query.filter_by(username=ADMIN_USERNAME).exists()).scalar():
+        hashed_password = generate_password_hash(ADMIN_PASSWORD, method='pbkdf2:sha256')
+        db.session.add(User(username=ADMIN_USERNAME, password=hashed_password, is_admin=True))
+    db.session.commit()
+
+# -------------------
+# CLI
+# -------------------
+
+db_cli = AppGroup('db', help='Database schema and seed data.')
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Create or migrate the database to the latest schema and seed it."""
+    started = time.perf_counter()
+    applied = upgrade_database()
+    seconds = time.perf_counter() - started
+    if applied:
+        click.echo(f"Applied {', '.join(applied)}")
+    click.echo(f'Database at schema version {schema_version()} ({seconds * 1000:.0f} ms)')
+
+@db_cli.command('version')
+def version_command():
+    """Show the schema version of the database and of this code."""
+    click.echo(f'database: {schema_version()}, code: {SCHEMA_VERSION}')
+
+@db_cli.command('add-user')
+@click.argument('username')
+@click.password_option()
+@click.option('--admin', is_flag=True, help='Allow editing, importing and exporting the library.')
+def add_user_command(username, password, admin):
+    """Create a login, by default for someone who only rates media."""
+    from .models import User  # lazy import
+    if db.session.query(User.query.filter_by(username=username).exists()).scalar():
+        raise click.ClickException(f'User {username!r} already exists.')
+    db.session.add(User(username=username, password=generate_password_hash(password, method='pbkdf2:sha256'),
+                        is_admin=admin))
+    db.session.commit()
+    click.echo(f'Created user {username!r}.')
+
+@db_cli.command('sync-replica')
+def sync_replica_command():
+    """
+    Copy the primary SQLite database into the DATABASE_REPLICA_URI file, the
+    local stand-in for a replica that a database server keeps up to date.
+    """
+    from .database import REPLICA_BIND  # lazy import
+    replica = db.engines.get(REPLICA_BIND)
+    if replica is None:
+        raise click.ClickException('No DATABASE_REPLICA_URI is configured.')
+    if db.engine.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise click.ClickException('Only a SQLite stand-in replica can be synced; '
+                                   'a server replica is kept up to date by the server.')
+    source, target = db.engine.raw_connection(), replica.raw_connection()
+    try:
+        source.driver_connection.backup(target.driver_connection)
+    finally:
+        target.close()
+        source.close()
+    click.echo(f'Replica synced at schema version {schema_version()}.')
@@ -0,0 +1,179 @@
+# project/search.py
+
+import re
+
+import click
+from flask.cli import AppGroup
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from . import db
+
+# One FTS5 row per searchable thing. The rowid encodes what the row is
+# (media: id * 4, track: id * 4 + 1, episode: id * 4 + 2) so the triggers
+# find it by rowid instead of scanning the table.
+
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        kind UNINDEXED, media_id UNINDEXED, title, creator,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    # media
+    """CREATE TRIGGER IF NOT EXISTS search_media_ai AFTER INSERT ON media BEGIN
+        INSERT INTO search_index (rowid, kind, media_id, title, creator)
+        VALUES (NEW.id * 4, 'media', NEW.id, NEW.title, NEW.creator);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_media_au AFTER UPDATE OF title, creator ON media BEGIN
+        UPDATE search_index SET title = NEW.title, creator = NEW.creator WHERE rowid = NEW.id * 4;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_media_ad AFTER DELETE ON media BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4;
+    END""",
+    # track
+    """CREATE TRIGGER IF NOT EXISTS search_track_ai AFTER INSERT ON track BEGIN
+        INSERT INTO search_index (rowid, kind, media_id, title)
+        VALUES (NEW.id * 4 + 1, 'track', NEW.media_id, NEW.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_track_au AFTER UPDATE OF title, media_id ON track BEGIN
+        UPDATE search_index SET title = NEW.title, media_id = NEW.media_id WHERE rowid = NEW.id * 4 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_track_ad AFTER DELETE ON track BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1;
+    END""",
+    # episode
+    """CREATE TRIGGER IF NOT EXISTS search_episode_ai AFTER INSERT ON episode BEGIN
+        INSERT INTO search_index (rowid, kind, media_id, title)
+        VALUES (NEW.id * 4 + 2, 'episode', (SELECT media_id FROM season WHERE id = NEW.season_id), NEW.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_episode_au AFTER UPDATE OF title ON episode BEGIN
+        UPDATE search_index SET title = NEW.title WHERE rowid = NEW.id * 4 + 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_episode_ad AFTER DELETE ON episode BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2;
+    END""",
+]
+
+REBUILD_SQL = [
+    "DELETE FROM search_index",
+    """INSERT INTO search_index (rowid, kind, media_id, title, creator)
+       SELECT id * 4, 'media', id, title, creator FROM media""",
+    """INSERT INTO search_index (rowid, kind, media_id, title)
+       SELECT id * 4 + 1, 'track', media_id, title FROM track""",
+    """INSERT INTO search_index (rowid, kind, media_id, title)
+       SELECT episode.id * 4 + 2, 'episode', season.media_id, episode.title
+       FROM episode JOIN season ON season.id = episode.season_id""",
+    "INSERT INTO search_index (search_index) VALUES ('optimize')",
+]
+
+# Snippet highlight markers: control characters that cannot come from user text,
+# swapped for <mark> tags after the snippet has been HTML-escaped.
+MARK_START, MARK_END = '\x02', '\x03'
+
+SEARCH_SQL = text(f"""
+    SELECT search_index.kind AS kind,
+           search_index.media_id AS media_id,
+           snippet(search_index, 2, '{MARK_START}', '{MARK_END}', '…', 12) AS title_snippet,
+           snippet(search_index, 3, '{MARK_START}', '{MARK_END}', '…', 8) AS creator_snippet,
+           media.title AS media_title,
+           media.media_type AS media_type,
+           media.poster_img AS poster_img,
+           media.overall_score AS overall_score
+    FROM search_index
+    JOIN media ON media.id = search_index.media_id
+    WHERE search_index MATCH :query
+    ORDER BY bm25(search_index, 0, 0, 10.0, 4.0)
+    LIMIT :limit
+""")
+
+LIKE_SEARCH_SQL = text("""
+    SELECT 'media' AS kind, id AS media_id, title AS title_snippet, creator AS creator_snippet,
+           title AS media_title, media_type, poster_img, overall_score
+    FROM media
+    WHERE lower(title) LIKE lower(:pattern) ESCAPE '\\' OR lower(creator) LIKE lower(:pattern) ESCAPE '\\'
+    ORDER BY lower(title)
+    LIMIT :limit
+""")
+
+def ensure_search_index():
+    """
+    Creates the FTS5 table and its sync triggers if they are missing, and
+    fills the table when it was just created. Returns False on other
+    databases than SQLite, or a SQLite build without FTS5, in which case
+    search falls back to LIKE.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    existed = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first() is not None
+    try:
+        for statement in SEARCH_DDL:
+            db.session.execute(text(statement))
+    except OperationalError:
+        db.session.rollback()
+        return False
+    if not existed:
+        rebuild_search_index()
+    db.session.commit()
+    return True
+
+def rebuild_search_index():
+    for statement in REBUILD_SQL:
+        db.session.execute(text(statement))
+
+def build_match_query(user_query, prefix=True):
+    """
+    Turns free text into an FTS5 MATCH expression: every word must match,
+    each quoted so FTS5 operators in user input are taken literally. With
+    prefix=True every word of 2+ characters also matches as a prefix
+    ('star wa' finds 'Star Wars'), served by the table's prefix indexes;
+    single letters would match most of the index. Returns None if there is
+    nothing to search for.
+    """
+    words = re.findall(r'\w+', user_query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' if prefix and len(word) > 1 else f'"{word}"' for word in words)
+
+def _highlight(snippet):
+    if not snippet:
+        return None
+    return Markup(str(escape(snippet)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+def search(user_query, limit=50, prefix=True):
+    """
+    Ranked search over media titles/creators, track titles and episode
+    titles. Returns a list of result rows with highlighted snippets.
+    """
+    match = build_match_query(user_query, prefix=prefix)
+    if match is None:
+        return []
+    rows = None
+    if db.engine.dialect.name == 'sqlite':
+        try:
+            rows = db.session.execute(SEARCH_SQL, {'query': match, 'limit': limit}).mappings().all()
+        except OperationalError:
+            # No FTS5 table (SQLite without FTS5)
+            db.session.rollback()
+    if rows is None:
+        # Other databases, or no FTS5: plain substring search over media only
+        escaped = re.sub(r'([%_\\])', r'\\\1', user_query.strip())
+        rows = db.session.execute(LIKE_SEARCH_SQL, {'pattern': f'%{escaped}%', 'limit': limit}).mappings().all()
+    return [{**row,
+             'title_snippet': _highlight(row['title_snippet']),
+             'creator_snippet': _highlight(row['creator_snippet'])} for row in rows]
+
+# -------------------
+# CLI
+# -------------------
+
+search_cli = AppGroup('search', help='Full-text search index maintenance.')
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Re-create the search index from the media, track and episode tables."""
+    if not ensure_search_index():
+        raise click.ClickException('Full-text search needs SQLite with FTS5; other databases use LIKE.')
+    rebuild_search_index()
+    db.session.commit()
+    click.echo('Search index rebuilt.')
@@ -0,0 +1,506 @@
+# project/similarity.py
+
+import heapq
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, case, delete, func, insert, literal, select, union_all, update
+
+from . import db
+from .database import upsert
+
+# "More like this": every media's NEIGHBOR_COUNT most similar media, kept in
+# media_neighbor so a detail page reads its panel with one primary-key range
+# scan. The similarity of two media is a weighted sum of
+#   tags     Jaccard overlap of their tag-incidence vectors
+#   type     1 when the media types match
+#   creator  1 when the creators match
+#   rating   1 - |score difference| / 10
+# Each media's inputs are kept in similarity_profile, with the tag vector as
+# a signature (its sorted tag ids). Media sharing type and signature form a
+# group in which only creator and rating vary, so a group's best candidates
+# are its media nearest in score, read off the (type, signature, score)
+# index. A list is found by visiting groups in order of tag overlap until
+# no remaining group can beat the current K-th neighbor: a few index seeks
+# per media instead of a comparison with every other one.
+
+NEIGHBOR_COUNT = 8
+TAG_WEIGHT = 0.55
+TYPE_WEIGHT = 0.15
+CREATOR_WEIGHT = 0.15
+RATING_WEIGHT = 0.15
+
+# A rebuild costs about 0.2 ms per media in the library, refreshing about
+# 15 ms per changed media, so a batch changing more than REBUILD_FRACTION
+# of the library is rebuilt. Up to REBUILD_MIN_CHANGES are always
+# refreshed: a rebuild also resets every detail page's cached panel.
+REBUILD_FRACTION = 0.01
+REBUILD_MIN_CHANGES = 20
+WRITE_BATCH_SIZE = 5000
+SIMILARITY_SCOPE = 'similarity'  # render cache scope bumped by full rebuilds
+
+Profile = namedtuple('Profile', 'media_id media_type signature creator score')
+
+# -------------------
+# SCORING
+# -------------------
+
+def _signature(tag_ids):
+    return ','.join(str(tag_id) for tag_id in sorted(tag_ids))
+
+@lru_cache(maxsize=65536)
+def _tags(signature):
+    return frozenset(int(tag_id) for tag_id in signature.split(',')) if signature else frozenset()
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _score(base, a, b):
+    """base (the tag and type terms) plus the creator and rating terms."""
+    if a.creator and a.creator == b.creator:
+        base += CREATOR_WEIGHT
+    return round(base + RATING_WEIGHT * (1 - min(abs(a.score - b.score), 10) / 10), 4)
+
+def similarity(a, b):
+    """Similarity of two profiles, from 0 to 1."""
+    base = TAG_WEIGHT * _jaccard(_tags(a.signature), _tags(b.signature))
+    return _score(base + TYPE_WEIGHT if a.media_type == b.media_type else base, a, b)
+
+def _floor(neighbors):
+    """The score a media must reach to join a list; -1 while the list has room."""
+    return neighbors[-1][1] if len(neighbors) >= NEIGHBOR_COUNT else -1.0
+
+# -------------------
+# CANDIDATES
+# -------------------
+
+class _Groups:
+    """The (type, signature) groups present, with the tag overlap between signatures."""
+
+    def __init__(self, keys):
+        self.types = {}
+        for media_type, signature in keys:
+            self.types.setdefault(signature, []).append(media_type)
+        self.media_types = sorted({media_type for types in self.types.values() for media_type in types})
+        self._by_tag = {}
+        for signature in self.types:
+            for tag_id in _tags(signature):
+                self._by_tag.setdefault(tag_id, []).append(signature)
+        self._overlaps = {}
+
+    def overlapping(self, signature):
+        """
+        ([(jaccard, signature)] closest first, {signature: jaccard}) for the
+        signatures sharing a tag with this one.
+        """
+        overlaps = self._overlaps.get(signature)
+        if overlaps is None:
+            tags = _tags(signature)
+            others = {other for tag_id in tags for other in self._by_tag.get(tag_id, ())}
+            ranked = sorted(((_jaccard(tags, _tags(other)), other) for other in others),
+                            key=lambda item: (-item[0], item[1]))
+            overlaps = self._overlaps[signature] = (ranked, {other: overlap for overlap, other in ranked})
+        return overlaps
+
+def _closest(above, below, score, limit):
+    """The `limit` profiles nearest to score, from two runs sorted outwards from it."""
+    closest, i, j = [], 0, 0
+    while len(closest) < limit and (i < len(above) or j < len(below)):
+        if j == len(below) or (i < len(above) and above[i].score - score <= score - below[j].score):
+            closest.append(above[i])
+            i += 1
+        else:
+            closest.append(below[j])
+            j += 1
+    return closest
+
+class _IndexedSource:
+    """Candidates read from similarity_profile, two index seeks per lookup."""
+
+    def __init__(self):
+        from .models import SimilarityGroup  # lazy import
+        self.groups = _Groups(db.session.execute(select(SimilarityGroup.media_type, SimilarityGroup.signature)))
+        self._statements = {}
+
+    def _nearest_statement(self, names, limit):
+        """
+        The lookup for one shape of filters, built once and run with bound
+        values: the run at or above the score and the run below it, each
+        read off the index outwards from it, tagged and sent as one UNION ALL.
+        A creator's media of every type are found through media's
+        (creator, overall_score) index and joined to their profiles.
+        """
+        from .models import Media, SimilarityProfile  # lazy import
+        P = SimilarityProfile
+        statement = self._statements.get((names, limit))
+        if statement is None:
+            if names == ('creator',):
+                keys = {'creator': Media.creator, 'score': Media.overall_score, 'media_id': Media.id}
+            else:
+                keys = {'score': P.score, 'media_id': P.media_id}
+
+            def column(name):
+                return keys.get(name, getattr(P, name))
+
+            def run(above):
+                stmt = select(P.media_id, P.media_type, P.signature, P.creator, P.score, literal(above).label('above'))
+                if names == ('creator',):
+                    stmt = stmt.join(Media, Media.id == P.media_id)
+                score, media_id = column('score'), column('media_id')
+                return (stmt.where(*(column(name) == bindparam(name) for name in names))
+                        .where(score >= bindparam('score') if above else score < bindparam('score'))
+                        .order_by(*((score, media_id) if above else (score.desc(), media_id.desc())))
+                        .limit(limit).subquery())
+            statement = self._statements[(names, limit)] = union_all(
+                select(run(True)), select(run(False)))
+        return statement
+
+    def nearest(self, score, limit, **where):
+        above, below = [], []
+        for *row, is_above in db.session.connection().execute(
+                self._nearest_statement(tuple(where), limit), {**where, 'score': score}):
+            (above if is_above else below).append(Profile(*row))
+        # UNION ALL keeps no order; put each run back in order outwards from score
+        above.sort(key=lambda profile: (profile.score, profile.media_id))
+        below.sort(key=lambda profile: (-profile.score, -profile.media_id))
+        return _closest(above, below, score, limit)
+
+class _LoadedSource:
+    """The same lookups over every profile held in memory, for rebuilds."""
+
+    KEYS = (('media_type', 'signature'), ('creator',), ('media_type',))
+
+    def __init__(self, profiles):
+        self.groups = _Groups({(profile.media_type, profile.signature) for profile in profiles})
+        self._runs = {}
+        ordered = sorted(profiles, key=lambda profile: (profile.score, profile.media_id))
+        for names in self.KEYS:
+            for profile in ordered:
+                key = tuple((name, getattr(profile, name)) for name in names)
+                self._runs.setdefault(key, []).append(profile)
+        self._scores = {key: [profile.score for profile in run] for key, run in self._runs.items()}
+
+    def nearest(self, score, limit, **where):
+        key = tuple(where.items())
+        run = self._runs.get(key)
+        if run is None:
+            return []
+        split = bisect_left(self._scores[key], score)
+        return _closest(run[split:split + limit], run[max(split - limit, 0):split][::-1], score, limit)
+
+def _rating_term(difference):
+    return RATING_WEIGHT * (1 - min(difference, 10) / 10)
+
+def _neighbors(profile, source):
+    """[(neighbor_id, similarity)] best first, at most NEIGHBOR_COUNT."""
+    best = []  # min-heap of (similarity, -neighbor_id), the NEIGHBOR_COUNT best so far
+    seen = {profile.media_id}
+    limit = NEIGHBOR_COUNT + 1  # the media itself may be among the nearest
+    ranked, overlaps = source.groups.overlapping(profile.signature)
+
+    def consider(candidates, base=None):
+        for other in candidates:
+            if other.media_id in seen:
+                continue
+            seen.add(other.media_id)
+            if base is None:
+                tag_term = TAG_WEIGHT * overlaps.get(other.signature, 0.0)
+                entry = (_score(tag_term + TYPE_WEIGHT if other.media_type == profile.media_type else tag_term,
+                                profile, other), -other.media_id)
+            else:
+                entry = (_score(base, profile, other), -other.media_id)
+            if len(best) < NEIGHBOR_COUNT:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+    def threshold():
+        return best[0][0] if len(best) == NEIGHBOR_COUNT else -1.0
+
+    # The creator's media of every type, read outwards from the score until
+    # the rest, however well their tags and type match, cannot reach the
+    # list. Every creator match that can is then considered, so the bounds
+    # below need no room for CREATOR_WEIGHT.
+    if profile.creator:
+        fetch = limit
+        while True:
+            candidates = source.nearest(profile.score, fetch, creator=profile.creator)
+            consider(candidates)
+            if len(candidates) < fetch:
+                break
+            farthest = max(abs(other.score - profile.score) for other in candidates)
+            if TAG_WEIGHT + TYPE_WEIGHT + CREATOR_WEIGHT + _rating_term(farthest) <= threshold():
+                break
+            fetch *= 4
+    for overlap, signature in ranked:
+        # Best any media of this group not yet considered can do
+        tag_term = TAG_WEIGHT * overlap
+        if tag_term + TYPE_WEIGHT + RATING_WEIGHT <= threshold():
+            break
+        for media_type in source.groups.types[signature]:
+            base = tag_term + TYPE_WEIGHT if media_type == profile.media_type else tag_term
+            if base + RATING_WEIGHT > threshold():
+                consider(source.nearest(profile.score, limit, media_type=media_type, signature=signature), base)
+    # Media sharing no tag score on type and rating alone, and on rating
+    # alone when their type differs as well
+    if TYPE_WEIGHT + RATING_WEIGHT > threshold():
+        consider(source.nearest(profile.score, limit, media_type=profile.media_type))
+    for media_type in source.groups.media_types:
+        if media_type != profile.media_type and RATING_WEIGHT > threshold():
+            consider(source.nearest(profile.score, limit, media_type=media_type))
+    return [(-negative_id, score) for score, negative_id in sorted(best, reverse=True)]
+
+# -------------------
+# MAINTENANCE
+# -------------------
+
+def _load_profiles(media_ids=None):
+    """{media_id: Profile} computed from the media tables; every media when media_ids is None."""
+    from .models import Media, media_tags  # lazy import
+    stmt = select(Media.id, Media.media_type, Media.creator, Media.overall_score)
+    tag_stmt = select(media_tags.c.media_id, media_tags.c.tag_id)
+    if media_ids is not None:
+        stmt = stmt.where(Media.id.in_(media_ids))
+        tag_stmt = tag_stmt.where(media_tags.c.media_id.in_(media_ids))
+    tags = {}
+    for media_id, tag_id in db.session.execute(tag_stmt):
+        tags.setdefault(media_id, []).append(tag_id)
+    return {media_id: Profile(media_id, media_type or '', _signature(tags.get(media_id, ())),
+                              creator or None, score or 0.0)
+            for media_id, media_type, creator, score in db.session.execute(stmt)}
+
+def _stored_profiles(media_ids):
+    from .models import SimilarityProfile  # lazy import
+    P = SimilarityProfile
+    return {row.media_id: (Profile(*row[:5]), row.floor) for row in db.session.execute(
+        select(P.media_id, P.media_type, P.signature, P.creator, P.score, P.floor)
+        .where(P.media_id.in_(media_ids)))}
+
+def _apply_group_changes(changes):
+    """Adds the (media_type, signature) -> delta counts to similarity_group with one upsert."""
+    from .models import SimilarityGroup  # lazy import
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if not changes:
+        return
+    stmt = upsert(SimilarityGroup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['media_type', 'signature'], set_={'count': SimilarityGroup.count + stmt.excluded.count})
+    db.session.execute(stmt, [{'media_type': media_type, 'signature': signature, 'count': delta}
+                              for (media_type, signature), delta in changes.items()])
+    db.session.execute(delete(SimilarityGroup).where(SimilarityGroup.count <= 0))
+
+def _write_profiles(old, new, changed):
+    from .models import MediaNeighbor, SimilarityProfile  # lazy import
+    inserts, updates, deletes, group_changes = [], [], [], Counter()
+    for media_id in changed:
+        if media_id in old:
+            group_changes[(old[media_id].media_type, old[media_id].signature)] -= 1
+        if media_id in new:
+            group_changes[(new[media_id].media_type, new[media_id].signature)] += 1
+            (updates if media_id in old else inserts).append(new[media_id]._asdict())
+        else:
+            deletes.append(media_id)
+    if inserts:
+        db.session.execute(insert(SimilarityProfile), inserts)
+    if updates:
+        db.session.execute(update(SimilarityProfile), updates)
+    if deletes:
+        db.session.execute(delete(SimilarityProfile).where(SimilarityProfile.media_id.in_(deletes)))
+        db.session.execute(delete(MediaNeighbor).where(MediaNeighbor.media_id.in_(deletes)))
+    _apply_group_changes(group_changes)
+
+def _gainers(profile):
+    """
+    Media whose list the profile may now belong in, because it scores at
+    least as high as their last neighbor (ties go by id). Candidates share
+    a tag, the creator or the type, or, sharing none of those, have room
+    for a rating-only match; SQL drops those whose floor is above the best
+    the profile could score against them, the rest are scored exactly.
+    """
+    from .models import SimilarityGroup, SimilarityProfile, media_tags  # lazy import
+    P = SimilarityProfile
+    bound = (case((P.media_type == profile.media_type, TYPE_WEIGHT), else_=0.0)
+             + RATING_WEIGHT * (1 - func.abs(P.score - profile.score) / 10))
+    if profile.creator:
+        bound = bound + case((P.creator == profile.creator, CREATOR_WEIGHT), else_=0.0)
+    stmt = select(P.media_id, P.media_type, P.signature, P.creator, P.score, P.floor)
+
+    queries = [stmt.where(P.media_type == profile.media_type,
+                          P.floor <= TYPE_WEIGHT + CREATOR_WEIGHT + RATING_WEIGHT, P.floor <= bound)]
+    other_types = db.session.scalars(select(SimilarityGroup.media_type).distinct()
+                                     .where(SimilarityGroup.media_type != profile.media_type)).all()
+    if other_types:
+        queries.append(stmt.where(P.media_type.in_(other_types), P.floor <= RATING_WEIGHT, P.floor <= bound))
+    if profile.creator:
+        queries.append(stmt.where(P.creator == profile.creator, P.floor <= bound))
+    tag_ids = _tags(profile.signature)
+    if tag_ids:
+        sharing = select(media_tags.c.media_id).where(media_tags.c.tag_id.in_(tag_ids))
+        queries.append(stmt.where(P.media_id.in_(sharing), P.floor <= TAG_WEIGHT + bound))
+
+    gainers = set()
+    for query in queries:
+        for row in db.session.execute(query):
+            other = Profile(*row[:5])
+            if other.media_id != profile.media_id and similarity(other, profile) >= row.floor:
+                gainers.add(other.media_id)
+    return gainers
+
+def _write_lists(lists):
+    """Replaces the neighbor lists {media_id: [(neighbor_id, similarity)]} and their floors."""
+    from .models import MediaNeighbor, SimilarityProfile  # lazy import
+    db.session.execute(delete(MediaNeighbor).where(MediaNeighbor.media_id.in_(list(lists))))
+    rows = [{'media_id': media_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': score}
+            for media_id, neighbors in lists.items()
+            for rank, (neighbor_id, score) in enumerate(neighbors, start=1)]
+    if rows:
+        db.session.execute(insert(MediaNeighbor), rows)
+    db.session.execute(update(SimilarityProfile), [{'media_id': media_id, 'floor': _floor(neighbors)}
+                                                   for media_id, neighbors in lists.items()])
+
+def _patched(profile, neighbors, news):
+    """
+    The list with the changed media in `news` ({media_id: Profile}, None
+    when deleted) rescored and merged in, or None when one of them scores
+    lower than it did, or was deleted, and so may leave room for a media
+    only a new search finds.
+    """
+    scores = dict(neighbors)
+    for media_id, other in news.items():
+        score = similarity(profile, other) if other is not None else None
+        if media_id in scores and (score is None or score < scores[media_id]):
+            return None
+        if score is not None:
+            scores[media_id] = score
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:NEIGHBOR_COUNT]
+
+def _recompute(reasons, profiles):
+    """
+    Brings the lists of the media in `reasons` ({media_id: ids of the
+    changed media reaching its list}) up to date, given the changed
+    profiles; writes and returns the lists that changed. A changed media's
+    own list is searched again; others are patched where possible.
+    """
+    from .models import MediaNeighbor  # lazy import
+    if not reasons:
+        return {}
+    current = {}
+    for media_id, neighbor_id, score in db.session.execute(
+            select(MediaNeighbor.media_id, MediaNeighbor.neighbor_id, MediaNeighbor.score)
+            .where(MediaNeighbor.media_id.in_(list(reasons)))
+            .order_by(MediaNeighbor.media_id, MediaNeighbor.rank)):
+        current.setdefault(media_id, []).append((neighbor_id, score))
+
+    source, lists = None, {}
+    for media_id, (profile, _) in _stored_profiles(list(reasons)).items():
+        neighbors = None
+        if media_id not in profiles:
+            neighbors = _patched(profile, current.get(media_id, []),
+                                 {other_id: profiles[other_id] for other_id in reasons[media_id]})
+        if neighbors is None:
+            source = source or _IndexedSource()
+            neighbors = _neighbors(profile, source)
+        lists[media_id] = neighbors
+    changed = {media_id: neighbors for media_id, neighbors in lists.items()
+               if neighbors != current.get(media_id, [])}
+    if changed:
+        _write_lists(changed)
+    return changed
+
+def _library_size():
+    from .models import Media  # lazy import
+    return db.session.execute(select(func.count()).select_from(Media)).scalar()
+
+def refresh_similarity(media_ids):
+    """
+    Brings the similarity index in line with the given media after their
+    type, creator, score or tags changed (or they were added or deleted).
+    Only lists the change can reach are touched: the media's own, the
+    lists it was in and the lists it now reaches the last neighbor of. Call
+    it after the media rows are written and before the commit. Returns the
+    render cache scopes of the pages whose "more like this" panel changed
+    or shows one of the media.
+    """
+    from .models import MediaNeighbor  # lazy import
+    media_ids = set(media_ids)
+    if not media_ids:
+        return []
+    if len(media_ids) > REBUILD_MIN_CHANGES and len(media_ids) > REBUILD_FRACTION * _library_size():
+        rebuild_similarity()
+        return [SIMILARITY_SCOPE]
+
+    listing = db.session.execute(select(MediaNeighbor.media_id, MediaNeighbor.neighbor_id)
+                                 .where(MediaNeighbor.neighbor_id.in_(media_ids))).all()
+    panels = {media_id for media_id, _ in listing}
+    old = {media_id: profile for media_id, (profile, _) in _stored_profiles(media_ids).items()}
+    new = _load_profiles(media_ids)
+    changed = {media_id: new.get(media_id) for media_id in media_ids if old.get(media_id) != new.get(media_id)}
+    if changed:
+        _write_profiles(old, new, changed)
+        reasons = {}
+        for media_id, neighbor_id in listing:
+            if neighbor_id in changed:
+                reasons.setdefault(media_id, set()).add(neighbor_id)
+        for media_id, profile in changed.items():
+            if profile is not None:
+                reasons.setdefault(media_id, set())
+                for gainer in _gainers(profile):
+                    reasons.setdefault(gainer, set()).add(media_id)
+        for media_id, profile in changed.items():
+            if profile is None:
+                reasons.pop(media_id, None)
+        panels |= _recompute(reasons, changed).keys()
+    return [f'media:{media_id}' for media_id in sorted(panels)]
+
+def rebuild_similarity():
+    """Recomputes every profile, group and neighbor list (new installs and repairs)."""
+    from .models import MediaNeighbor, SimilarityGroup, SimilarityProfile  # lazy import
+    db.session.execute(delete(MediaNeighbor))
+    db.session.execute(delete(SimilarityProfile))
+    db.session.execute(delete(SimilarityGroup))
+    profiles = list(_load_profiles().values())
+    source = _LoadedSource(profiles)
+    _apply_group_changes(Counter((profile.media_type, profile.signature) for profile in profiles))
+    # Core inserts: these are plain rows, so ORM bulk-insert bookkeeping is skipped
+    for start in range(0, len(profiles), WRITE_BATCH_SIZE):
+        batch = profiles[start:start + WRITE_BATCH_SIZE]
+        lists = {profile.media_id: _neighbors(profile, source) for profile in batch}
+        db.session.execute(SimilarityProfile.__table__.insert(),
+                           [{**profile._asdict(), 'floor': _floor(lists[profile.media_id])} for profile in batch])
+        rows = [{'media_id': media_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': score}
+                for media_id, neighbors in lists.items()
+                for rank, (neighbor_id, score) in enumerate(neighbors, start=1)]
+        if rows:
+            db.session.execute(MediaNeighbor.__table__.insert(), rows)
+
+# -------------------
+# READING
+# -------------------
+
+def similar_media(media_id):
+    """A media's neighbors, best first, with what the panel shows, in one indexed read."""
+    from .models import Media, MediaNeighbor  # lazy import
+    rows = db.session.execute(
+        select(MediaNeighbor.neighbor_id.label('media_id'), MediaNeighbor.score.label('similarity'),
+               Media.title, Media.creator, Media.media_type, Media.poster_img, Media.overall_score)
+        .join(Media, Media.id == MediaNeighbor.neighbor_id)
+        .where(MediaNeighbor.media_id == media_id).order_by(MediaNeighbor.rank))
+    return [row._asdict() for row in rows]
+
+# -------------------
+# CLI
+# -------------------
+
+similarity_cli = AppGroup('similarity', help='"More like this" index maintenance.')
+
+@similarity_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every media's similar items from the media tables."""
+    rebuild_similarity()
+    db.session.commit()
+    click.echo('Similarity index rebuilt.')
@@ -0,0 +1,257 @@
+# project/stats.py
+
+import math
+
+from flask import current_app
+from sqlalchemy import exists, func, or_, select
+
+from . import db
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: without it the same summaries are computed in Python
+    np = None
+
+PERCENTILES = (25, 50, 75, 90)
+HISTOGRAM_BUCKETS = 10  # [0, 1), [1, 2), ... [9, 10]
+CREATOR_LIMIT = 50      # creators with the most rated media
+RANKED_GROUPS = 10      # best/worst seasons and albums listed
+MIN_GROUP_SIZE = 3      # episodes/tracks a season/album needs to be ranked
+
+# -------------------
+# SUMMARIES
+# -------------------
+
+def _empty_summary():
+    return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None,
+            'percentiles': {f'p{p}': None for p in PERCENTILES}, 'histogram': [0] * HISTOGRAM_BUCKETS}
+
+def _summary(count, total, total_sq, low, high, percentiles, histogram):
+    mean = total / count
+    return {
+        'count': int(count),
+        'mean': round(float(mean), 3),
+        'std': round(math.sqrt(max(total_sq / count - mean * mean, 0.0)), 3),
+        'min': round(float(low), 2),
+        'max': round(float(high), 2),
+        'percentiles': {f'p{p}': round(float(value), 2) for p, value in zip(PERCENTILES, percentiles)},
+        'histogram': [int(n) for n in histogram],
+    }
+
+def _bucket(value):
+    return min(max(int(value), 0), HISTOGRAM_BUCKETS - 1)
+
+def _summarise_values(values):
+    """Summary of a list of scores; percentiles interpolate linearly, as numpy.percentile does."""
+    if not len(values):
+        return _empty_summary()
+    if np is not None:
+        values = np.asarray(values, dtype=float)
+        histogram, _ = np.histogram(values, bins=HISTOGRAM_BUCKETS, range=(0, 10))
+        return _summary(len(values), values.sum(), np.square(values).sum(), values.min(), values.max(),
+                        np.percentile(values, PERCENTILES), histogram)
+
+    values = sorted(values)
+    percentiles = []
+    for p in PERCENTILES:
+        k = (len(values) - 1) * p / 100
+        lower, upper = values[math.floor(k)], values[math.ceil(k)]
+        percentiles.append(lower + (upper - lower) * (k - math.floor(k)))
+    histogram = [0] * HISTOGRAM_BUCKETS
+    for value in values:
+        histogram[_bucket(value)] += 1
+    return _summary(len(values), sum(values), sum(v * v for v in values), values[0], values[-1],
+                    percentiles, histogram)
+
+def _summarise_counts(values, counts):
+    """
+    Same summary as _summarise_values, from values and how often each
+    occurs, as a GROUP BY on the score column returns them: the rows they
+    stand for are never fetched. Values may repeat and come in any order.
+    """
+    size = sum(counts)
+    if not size:
+        return _empty_summary()
+    ranks = [(size - 1) * p / 100 for p in PERCENTILES]
+    if np is not None:
+        values, counts = np.asarray(values, dtype=float), np.asarray(counts, dtype=float)
+        order = np.argsort(values, kind='stable')
+        values, counts = values[order], counts[order]
+        cumulative, ranks = np.cumsum(counts), np.asarray(ranks)
+        lower = values[np.searchsorted(cumulative, np.floor(ranks), side='right')]
+        upper = values[np.searchsorted(cumulative, np.ceil(ranks), side='right')]
+        histogram = np.bincount(np.clip(values.astype(np.intp), 0, HISTOGRAM_BUCKETS - 1),
+                                weights=counts, minlength=HISTOGRAM_BUCKETS)
+        return _summary(size, values @ counts, np.square(values) @ counts, values[0], values[-1],
+                        lower + (upper - lower) * (ranks - np.floor(ranks)), histogram)
+
+    values, counts = zip(*sorted(zip(values, counts)))
+
+    def nth(n):  # n-th smallest value, counting from 0
+        for value, count in zip(values, counts):
+            if n < count:
+                return value
+            n -= count
+
+    percentiles = []
+    for k in ranks:
+        lower, upper = nth(math.floor(k)), nth(math.ceil(k))
+        percentiles.append(lower + (upper - lower) * (k - math.floor(k)))
+    histogram = [0] * HISTOGRAM_BUCKETS
+    for value, count in zip(values, counts):
+        histogram[_bucket(value)] += count
+    return _summary(size, sum(v * c for v, c in zip(values, counts)),
+                    sum(v * v * c for v, c in zip(values, counts)), values[0], values[-1], percentiles, histogram)
+
+def _summarise_groups(rows):
+    """{group: summary} from (group, value, count) rows with each group's rows adjacent."""
+    if not rows:
+        return {}
+    groups, values, counts = zip(*rows)
+    starts = [0] + [i for i in range(1, len(groups)) if groups[i] != groups[i - 1]]
+    ends = starts[1:] + [len(groups)]
+    return {groups[start]: _summarise_counts(values[start:end], counts[start:end])
+            for start, end in zip(starts, ends)}
+
+# -------------------
+# QUERIES
+# -------------------
+
+def _fetch(stmt):
+    """
+    Rows of a column-only select, executed on the session's connection so
+    the tens of thousands of aggregate rows skip ORM result processing.
+    """
+    return db.session.connection().execute(stmt).all()
+
+def _rated(Media):
+    """
+    Whether a media has a score. overall_score is 0 both for a 0 rating and
+    for no rating at all; only albums score from their tracks.
+    """
+    return or_(Media.official_rating.isnot(None), Media.track_rating_count > 0)
+
+def _value_counts(group, score, rated):
+    """
+    (group, score, count) rows for rated media, in index order. Only the
+    zero scores have to be checked with `rated`.
+    """
+    return (select(group, score, func.count()).where(or_(score != 0, rated))
+            .group_by(group, score).order_by(group, score))
+
+def _media_stats():
+    """
+    Media scores by type, tag, decade and creator, leaving out media that
+    were never rated (see _rated). Types and
+    tags are read off the leaderboard rank index, which already holds each
+    media's score per board in (board, score) order; the others have
+    (column, overall_score) indexes, so no GROUP BY needs a sort.
+    """
+    from .leaderboards import TYPE_BOARDS  # lazy import
+    from .models import LeaderboardEntry, Media, Tag  # lazy import
+    board, score = LeaderboardEntry.board, LeaderboardEntry.score
+    # A primary key lookup for each zero-scored entry; media_id is in the rank index
+    entry_rated = exists().where(Media.id == LeaderboardEntry.media_id, _rated(Media))
+
+    by_type = _summarise_groups(_fetch(
+        _value_counts(board, score, entry_rated).where(board.in_(TYPE_BOARDS))))
+    # A range rather than LIKE 'tag:%', so SQLite can seek the index (';' follows ':')
+    by_board = _summarise_groups(_fetch(
+        _value_counts(board, score, entry_rated).where(board > 'tag:', board < 'tag;')))
+    tag_names = {f'tag:{tag_id}': name for tag_id, name in db.session.execute(select(Tag.id, Tag.name))}
+    by_tag = {tag_names[key]: summary for key, summary in by_board.items() if key in tag_names}
+
+    # Grouped by year to stay on the (start_year, overall_score) index; in year
+    # order each decade's rows are adjacent, so relabelling them is enough
+    by_year = _fetch(_value_counts(Media.start_year, Media.overall_score, _rated(Media))
+                     .where(Media.start_year > 0))
+    by_decade = _summarise_groups([(year // 10 * 10, value, count) for year, value, count in by_year])
+
+    top_creators = (select(Media.creator).where(_rated(Media), Media.creator.isnot(None))
+                    .group_by(Media.creator).order_by(func.count().desc(), Media.creator)
+                    .limit(CREATOR_LIMIT).scalar_subquery())
+    by_creator = _summarise_groups(_fetch(
+        _value_counts(Media.creator, Media.overall_score, _rated(Media)).where(Media.creator.in_(top_creators))))
+
+    return {
+        'media_type': by_type,
+        'decade': {f'{decade}s': summary for decade, summary in by_decade.items()},
+        'tag': dict(sorted(by_tag.items())),
+        'creator': dict(sorted(by_creator.items(), key=lambda item: (-item[1]['count'], item[0]))),
+    }
+
+def _rating_stats(rating):
+    """Summary of every rating in a column, from one GROUP BY over its index."""
+    rows = _fetch(select(rating, func.count()).where(rating.isnot(None)).group_by(rating).order_by(rating))
+    return _summarise_counts(*zip(*rows)) if rows else _empty_summary()
+
+def _group_averages(rollups, label_select):
+    """
+    Per-parent averages (seasons from episodes, albums from tracks) from
+    the parents' maintained rating count/sum, fetched as column arrays and
+    summarised as a distribution, with the best and worst parents that
+    have at least MIN_GROUP_SIZE ratings.
+    """
+    rows = _fetch(rollups)
+    ids, totals, counts = zip(*rows) if rows else ((), (), ())
+
+    if np is not None:
+        counts = np.asarray(counts, dtype=float)
+        averages = np.asarray(totals, dtype=float) / counts
+        ranked = np.flatnonzero(counts >= MIN_GROUP_SIZE)
+        order = ranked[np.argsort(averages[ranked], kind='stable')]
+        best, worst = order[::-1][:RANKED_GROUPS].tolist(), order[:RANKED_GROUPS].tolist()
+    else:
+        averages = [total / count for total, count in zip(totals, counts)]
+        order = sorted((i for i, count in enumerate(counts) if count >= MIN_GROUP_SIZE),
+                       key=lambda i: averages[i])
+        best, worst = order[::-1][:RANKED_GROUPS], order[:RANKED_GROUPS]
+
+    wanted = {ids[i] for i in best + worst}
+    labels = {row.id: row._asdict() for row in db.session.execute(label_select(wanted))} if wanted else {}
+
+    def listing(positions):
+        return [{**labels[ids[i]], 'average': round(float(averages[i]), 2), 'count': int(counts[i])}
+                for i in positions]
+
+    return {'averages': _summarise_values(averages), 'best': listing(best), 'worst': listing(worst)}
+
+def _child_stats():
+    from .models import Episode, Media, Season, Track  # lazy import
+    seasons = _group_averages(
+        select(Season.id, Season.episode_rating_sum, Season.episode_rating_count)
+        .where(Season.episode_rating_count > 0),
+        lambda ids: select(Season.id, Season.season_number, Media.id.label('media_id'), Media.title)
+        .join(Media, Media.id == Season.media_id).where(Season.id.in_(ids)))
+    albums = _group_averages(
+        select(Media.id, Media.track_rating_sum, Media.track_rating_count)
+        .where(Media.media_type == 'album', Media.track_rating_count > 0),
+        lambda ids: select(Media.id, Media.id.label('media_id'), Media.title, Media.creator)
+        .where(Media.id.in_(ids)))
+    return {
+        'episodes': _rating_stats(Episode.rating),
+        'tracks': _rating_stats(Track.rating),
+        'seasons': seasons,
+        'albums': albums,
+    }
+
+# -------------------
+# ENTRY POINT
+# -------------------
+
+def compute_library_stats():
+    return {**_media_stats(), **_child_stats()}
+
+def library_stats():
+    """
+    The rating statistics of the whole library, computed once per version
+    of the render cache's 'library' scope: every write path already bumps
+    it, so results are reused until the next edit, add, delete or import.
+    """
+    version = current_app.extensions['render_cache'].version('library')
+    cached = current_app.extensions.get('library_stats')
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    stats = compute_library_stats()
+    current_app.extensions['library_stats'] = (version, stats)
+    return stats
@@ -0,0 +1,324 @@
+# project/uploads.py
+
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import Blueprint, abort, current_app, g, send_file, send_from_directory, url_for
+from flask.cli import AppGroup
+from sqlalchemy import select, update
+
+from . import db
+from .database import upsert
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it only originals are served
+    Image = None
+
+uploads = Blueprint('uploads', __name__)
+
+# Derivative name -> (max width, max height, WebP quality)
+DERIVATIVES = {
+    'thumb': (400, 600, 75),     # index / search grid cards
+    'poster': (800, 1200, 80),   # media_page poster
+    'banner': (1920, 700, 70),   # media_page banner
+}
+
+# Pillow format -> stored extension, which sets the mimetype the file is served
+# with. Uploads Pillow cannot identify (every upload without Pillow) are '.bin'
+IMAGE_EXTENSIONS = {
+    'JPEG': '.jpg', 'MPO': '.jpg',  # MPO: camera JPEGs carrying extra frames
+    'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp', 'AVIF': '.avif', 'BMP': '.bmp', 'TIFF': '.tiff',
+}
+
+# 'ab/ab12...ef.jpg' and its derivatives 'ab/ab12...ef.thumb.webp'
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z]+)?\.[a-z0-9]+$')
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# -------------------
+# STORAGE
+# -------------------
+
+class UploadStorage:
+    """
+    Interface for upload storage, by name relative to its root ('ab/<hash>.jpg').
+    A store shared by several app nodes (S3, GCS, ...) implements exists,
+    open and save; url can point browsers straight at the store, and send
+    serves a file through the app when url returns None.
+    """
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def open(self, name):
+        """A binary file object to read the stored file from."""
+        raise NotImplementedError
+
+    def save(self, name, fileobj):
+        """Stores the rest of fileobj under name, replacing it atomically."""
+        raise NotImplementedError
+
+    def url(self, name):
+        """Public URL of a stored file, or None to serve it from /uploads."""
+        return None
+
+    def send(self, name, max_age=None):
+        try:
+            fileobj = self.open(name)
+        except FileNotFoundError:
+            abort(404)
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        return send_file(fileobj, mimetype=mimetype, max_age=max_age, conditional=True)
+
+class DirectoryStorage(UploadStorage):
+    """
+    Files under a local directory, UPLOAD_FOLDER by default. A directory
+    that every node mounts (NFS, ...) is shared storage as well; with a
+    base_url (UPLOAD_BASE_URL) pages link files on the web server or CDN
+    that publishes the directory instead of serving them from the app.
+    """
+
+    def __init__(self, folder, base_url=None):
+        self.folder = folder
+        self.base_url = base_url
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def open(self, name):
+        return open(self._path(name), 'rb')
+
+    def save(self, name, fileobj):
+        target = self._path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Unique temp name: the same content may be stored twice at once
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                shutil.copyfileobj(fileobj, temp_file, CHUNK_SIZE)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def url(self, name):
+        return f"{self.base_url.rstrip('/')}/{name}" if self.base_url else None
+
+    def send(self, name, max_age=None):
+        return send_from_directory(self.folder, name, max_age=max_age)
+
+def get_storage(app=None):
+    return (app or current_app).extensions['upload_storage']
+
+# -------------------
+# UPLOADS
+# -------------------
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=current_app.config['THUMBNAIL_WORKERS'],
+                                       thread_name_prefix='thumbnails')
+    return _executor
+
+def derivative_name(filename, size):
+    return f'{os.path.splitext(filename)[0]}.{size}.webp'
+
+def _detect_extension(fileobj):
+    """The extension for the image format Pillow reads from the file's header, or '.bin'."""
+    if Image is None:
+        return '.bin'
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as image:
+            return IMAGE_EXTENSIONS.get(image.format, '.bin')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return '.bin'
+
+def _store(fileobj):
+    """
+    Stores a file under its SHA-256 ('ab/<hash>.<ext>'). The body is hashed
+    while it is spooled to a temporary file, then handed to the upload
+    storage unless that content is already stored. Returns the stored name.
+    """
+    storage = get_storage()
+
+    digest = hashlib.sha256()
+    with tempfile.TemporaryFile() as temp_file:
+        for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            temp_file.write(chunk)
+        content_hash = digest.hexdigest()
+        filename = f'{content_hash[:2]}/{content_hash}{_detect_extension(temp_file)}'
+        if not storage.exists(filename):
+            temp_file.seek(0)
+            storage.save(filename, temp_file)
+    return filename
+
+def save_file(file_storage):
+    """
+    Stores an upload under its content hash, so identical files are kept
+    once and two different files with the same name no longer overwrite
+    each other. The extension comes from the content, not the client's
+    filename, so the same bytes always get the same name and are served
+    with the right mimetype. Derivatives are generated in the background.
+    Returns the stored name.
+    """
+    filename = _store(file_storage.stream)
+    if Image is not None and not derived_uploads([filename]):
+        app = current_app._get_current_object()
+        _get_executor().submit(generate_derivatives, app, filename)
+    return filename
+
+def generate_derivatives(app, filename):
+    """
+    Stores every missing DERIVATIVES size of an uploaded image as WebP,
+    then records the upload in upload_derivative so pages link them.
+    Returns whether the derivatives were stored.
+    """
+    from .cache import invalidate  # lazy import
+    from .models import UploadDerivative  # lazy import
+    storage = get_storage(app)
+    try:
+        with storage.open(filename) as source, Image.open(source) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            for size, (width, height, quality) in DERIVATIVES.items():
+                target = derivative_name(filename, size)
+                if storage.exists(target):
+                    continue
+                resized = image.copy()
+                resized.thumbnail((width, height), Image.LANCZOS)
+                buffer = io.BytesIO()
+                resized.save(buffer, 'WEBP', quality=quality, method=4)
+                buffer.seek(0)
+                storage.save(target, buffer)
+    except (OSError, ValueError):
+        app.logger.warning('Could not generate derivatives for %s', filename, exc_info=True)
+        return False
+    # Pages rendered before the derivatives existed link the originals
+    with app.app_context():
+        db.session.execute(upsert(UploadDerivative).values(filename=filename).on_conflict_do_nothing())
+        invalidate('uploads')
+        db.session.commit()
+    return True
+
+def derived_uploads(filenames):
+    """
+    The ones among filenames whose derivatives are stored, read from
+    upload_derivative (kept by generate_derivatives) so rendering never asks
+    the storage which files exist. Answers are kept for the rest of the
+    request: views pass in every upload their page shows, which costs one
+    query, and upload_url then finds each of them already looked up.
+    """
+    from .models import UploadDerivative  # lazy import
+    filenames = set(filenames)
+    known = g.setdefault('derived_uploads', {})
+    # Names from before content addressing never have derivatives
+    missing = {name for name in filenames if name and name not in known and HASHED_NAME_RE.match(name)}
+    if missing:
+        derived = set(db.session.scalars(select(UploadDerivative.filename)
+                                         .where(UploadDerivative.filename.in_(missing))))
+        known.update((name, name in derived) for name in missing)
+    return {name for name in filenames if known.get(name)}
+
+def upload_url(filename, size=None):
+    """
+    URL for an uploaded file, or for its derivative of the given size once
+    they have been generated. Template global.
+    """
+    if size is not None and derived_uploads([filename]):
+        filename = derivative_name(filename, size)
+    return get_storage().url(filename) or url_for('uploads.serve', filename=filename)
+
+@uploads.route('/uploads/<path:filename>')
+def serve(filename):
+    storage = get_storage()
+    if not HASHED_NAME_RE.match(filename):
+        # Files uploaded before content addressing may still be replaced
+        return storage.send(filename)
+    # Content-addressed: the bytes behind this URL can never change
+    response = storage.send(filename, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+def init_uploads(app):
+    app.config.setdefault('THUMBNAIL_WORKERS', 2)
+    app.config.setdefault('UPLOAD_STORAGE', None)
+    app.config.setdefault('UPLOAD_BASE_URL', None)
+
+    app.extensions['upload_storage'] = (app.config['UPLOAD_STORAGE']
+                                        or DirectoryStorage(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_BASE_URL']))
+    app.register_blueprint(uploads)
+    app.add_template_global(upload_url)
+
+    @app.before_request
+    def forget_derived_uploads():
+        # A test client request can reuse an app context that is already pushed
+        g.pop('derived_uploads', None)
+
+# -------------------
+# CLI
+# -------------------
+
+uploads_cli = AppGroup('uploads', help='Uploaded poster and banner files.')
+
+@uploads_cli.command('rehash')
+def rehash_command():
+    """
+    Store uploads from before content addressing under their hash, point
+    media at the new names and generate every missing derivative.
+    """
+    from .cache import invalidate  # lazy import
+    from .models import Media  # lazy import
+    storage = get_storage()
+    rows = db.session.execute(select(Media.id, Media.poster_img, Media.banner_img)).all()
+
+    legacy = {name for row in rows for name in (row.poster_img, row.banner_img)
+              if name and not HASHED_NAME_RE.match(name)}
+    rehashed, missing = {}, []
+    for name in sorted(legacy):
+        try:
+            with storage.open(name) as fileobj:
+                rehashed[name] = _store(fileobj)
+        except FileNotFoundError:
+            missing.append(name)
+
+    changes = [{'id': row.id,
+                'poster_img': rehashed.get(row.poster_img, row.poster_img),
+                'banner_img': rehashed.get(row.banner_img, row.banner_img)}
+               for row in rows if row.poster_img in rehashed or row.banner_img in rehashed]
+    if changes:
+        db.session.execute(update(Media), changes)
+        invalidate('library', 'uploads', *(f"media:{change['id']}" for change in changes))
+        db.session.commit()
+    click.echo(f'Rehashed {len(rehashed)} uploads used by {len(changes)} media.')
+    for name in missing:
+        click.echo(f'Missing from the upload storage, left as is: {name}', err=True)
+
+    if Image is None:
+        click.echo('Pillow is not installed; no derivatives were generated.')
+        return
+    names = {name for row in rows for name in (row.poster_img, row.banner_img) if name}
+    names = {rehashed.get(name, name) for name in names} - set(missing)
+    pending = sorted(name for name in names - derived_uploads(names) if HASHED_NAME_RE.match(name))
+    app = current_app._get_current_object()
+    generated = sum(generate_derivatives(app, name) for name in pending)
+    click.echo(f'Generated derivatives for {generated} of {len(pending)} uploads without them.')
@@ -1,8 +1,13 @@
 # run.py
 
 from project import create_app
+from project.schema import upgrade_database
 
 app = create_app()
 
 if __name__ == '__main__':
+    # Development server: bring the database up to date first.
+    # Deployments run 'flask db upgrade' once instead.
+    with app.app_context():
+        upgrade_database()
     app.run(debug=True)
@@ -0,0 +1,121 @@
+# tests/conftest.py
+
+import pytest
+from sqlalchemy import select
+
+from project import create_app, db
+from project.bulk import import_records
+from project.models import Media, Tag, Track, media_tags
+from project.schema import upgrade_database
+
+from benchmarks.datagen import generate_library
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'SQL_QUERY_COUNT_HEADER': True,
+    })
+    with app.app_context():
+        upgrade_database()
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+@pytest.fixture
+def ctx(app):
+    """
+    An app context for the whole test, to use db.session directly. Requests
+    made meanwhile share it (and its g), so tests counting queries don't.
+    """
+    with app.app_context():
+        yield
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def load_library(app):
+    """Imports a seeded synthetic library (benchmarks/datagen.py) of the given size."""
+    def load(size, seed=0):
+        with app.app_context():
+            return import_records(generate_library(size, seed))
+    return load
+
+@pytest.fixture
+def admin_client(client):
+    from project.schema import ADMIN_PASSWORD, ADMIN_USERNAME  # lazy import
+    client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+    return client
+
+@pytest.fixture
+def random_edit(ctx):
+    """
+    edit(rng, kinds) makes one random change to the library through the
+    same steps as the edit, add and delete routes, and returns the id of
+    the media it touched. kinds are the changes to choose from ('rating',
+    'creator', 'type', 'tags', 'tracks', 'add', 'delete'); repeat one to
+    make it likelier. The media, creators and tags it picks from are read
+    on the first call, so load the library first.
+    """
+    media_types = ('movie', 'album', 'single', 'tv_show')
+    library = {}
+
+    def edit(rng, kinds):
+        if not library:
+            library['media_ids'] = db.session.scalars(select(Media.id).order_by(Media.id)).all()
+            library['creators'] = sorted(set(db.session.scalars(select(Media.creator))))
+            library['tag_ids'] = db.session.scalars(select(Tag.id).order_by(Tag.id)).all()
+        media_ids, creators, tag_ids = library['media_ids'], library['creators'], library['tag_ids']
+
+        def random_tags(count):
+            return db.session.scalars(select(Tag).where(Tag.id.in_(rng.sample(tag_ids, count)))).all()
+
+        kind = rng.choice(kinds)
+        if kind == 'add':
+            media = Media(title='New', creator=rng.choice(creators), years='2001',
+                          media_type=rng.choice(media_types), official_rating=round(rng.uniform(0, 10), 1))
+            media.tags = random_tags(2)
+            db.session.add(media)
+            db.session.flush()
+            media.refresh_derived_fields()
+            media_ids.append(media.id)
+            return media.id
+        media_id = rng.choice(media_ids)
+        media = db.session.get(Media, media_id)
+        if kind == 'delete':
+            db.session.execute(media_tags.delete().where(media_tags.c.media_id == media_id))
+            db.session.delete(media)
+            media_ids.remove(media_id)
+            db.session.flush()
+            return media_id
+        if kind == 'rating':
+            media.official_rating = rng.choice((None, round(rng.uniform(0, 10), 1)))
+        elif kind == 'creator':
+            media.creator = rng.choice(creators)
+        elif kind == 'type':
+            media.media_type = rng.choice(media_types)
+        elif kind == 'tags':
+            media.tags = random_tags(rng.randint(0, 3))
+        elif kind == 'tracks':
+            # Rerate, drop or add a track; albums move boards with their tracks
+            if media.tracks and rng.random() < 0.7:
+                track = rng.choice(media.tracks)
+                if rng.random() < 0.2:
+                    media.tracks.remove(track)
+                else:
+                    track.rating = rng.choice((None, round(rng.uniform(0, 10), 1)))
+            else:
+                media.tracks.append(Track(title='Extra', track_number=len(media.tracks) + 1,
+                                          rating=round(rng.uniform(0, 10), 1)))
+        db.session.flush()
+        media.refresh_derived_fields()
+        db.session.flush()
+        return media_id
+    return edit
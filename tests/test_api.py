@@ -0,0 +1,75 @@
+# tests/test_api.py
+
+import pytest
+from sqlalchemy import func, select
+
+from project import db
+from project.models import Media, Season, Tag, media_tags
+
+@pytest.fixture
+def api_client(app, load_library):
+    app.config['RENDER_CACHE_ENABLED'] = False
+    load_library(150)
+    return app.test_client()
+
+def get_json(client, url, status=200):
+    response = client.get(url)
+    assert response.status_code == status
+    assert response.mimetype == 'application/json'
+    return response.get_json()
+
+def test_media_pages_follow_the_cursor(app, api_client):
+    seen, scores = [], []
+    url = '/api/v1/media?sort=score_desc&limit=40&fields=overall_score'
+    while url:
+        page = get_json(api_client, url)
+        assert len(page['data']) <= 40
+        seen += [item['id'] for item in page['data']]
+        scores += [item['overall_score'] for item in page['data']]
+        url = page['next']
+        assert (url is None) == (page['next_cursor'] is None)
+    with app.app_context():
+        assert sorted(seen) == sorted(db.session.scalars(select(Media.id)))
+    assert scores == sorted(scores, reverse=True)
+
+    movies = get_json(api_client, '/api/v1/media?type=movie&limit=200&fields=media_type')['data']
+    assert movies and {item['media_type'] for item in movies} == {'movie'}
+    assert get_json(api_client, '/api/v1/media?after=not-a-cursor', 400)['status'] == 400
+
+def test_fields_are_checked_against_the_whitelist(api_client):
+    page = get_json(api_client, '/api/v1/media?fields=title,title&limit=5')
+    assert [list(item) for item in page['data']] == [['id', 'title']] * 5
+    assert 'poster_url' in get_json(api_client, '/api/v1/media?limit=1')['data'][0]
+    error = get_json(api_client, '/api/v1/media?fields=title,password', 400)
+    assert error == {'error': "Unknown field 'password'.", 'status': 400}
+
+    detail = get_json(api_client, '/api/v1/media/1?fields=title,tags')['data']
+    assert list(detail) == ['id', 'title', 'tags']
+
+def test_unknown_media_is_a_json_404(api_client):
+    assert get_json(api_client, '/api/v1/media/999999', 404) == {'error': 'No media with id 999999.', 'status': 404}
+
+def test_tags_carry_their_media_count(app, api_client):
+    tags = get_json(api_client, '/api/v1/tags')['data']
+    with app.app_context():
+        counts = dict(db.session.execute(select(media_tags.c.tag_id, func.count()).group_by(media_tags.c.tag_id)).all())
+        assert len(tags) == db.session.scalar(select(func.count(Tag.id)))
+    assert {tag['id']: tag['media_count'] for tag in tags} == {tag['id']: counts.get(tag['id'], 0) for tag in tags}
+    assert [tag['name'] for tag in tags] == sorted(tag['name'] for tag in tags)
+
+def test_api_query_budget(app, api_client):
+    with app.app_context():
+        show_id = db.session.scalar(select(Season.media_id).group_by(Season.media_id)
+                                    .order_by(func.count().desc()))
+
+    def query_count(url):
+        response = api_client.get(url)
+        assert response.status_code == 200
+        return int(response.headers['X-Query-Count'])
+
+    assert query_count('/api/v1/media?limit=200') == 1
+    assert query_count('/api/v1/media?tag=1&tag=2&mode=all&sort=year_desc') == 1
+    assert query_count('/api/v1/tags') == 1
+    # The media, then its tags, tracks, seasons and all their episodes
+    assert query_count(f'/api/v1/media/{show_id}') == 5
+    assert query_count(f'/api/v1/media/{show_id}?fields=title') == 1
@@ -0,0 +1,77 @@
+# tests/test_bulk.py
+
+import io
+import json
+
+import pytest
+from sqlalchemy import func, select
+
+from project import db
+from project.bulk import ImportStats, RecordError, import_records, iter_records
+from project.models import Media, MediaNeighbor
+
+def jsonl(*records):
+    return io.StringIO(''.join(json.dumps(record) + '\n' for record in records))
+
+def movie(title, rating=7.0):
+    return {'title': title, 'media_type': 'movie', 'official_rating': rating, 'tags': ['Drama']}
+
+@pytest.mark.parametrize('record, message', [
+    ({'bad': 1}, 'title is required'),
+    ({'title': 'X', 'media_type': 'book'}, 'media_type must be one of'),
+    ({'title': 'X', 'media_type': 'movie', 'official_rating': 11}, 'official_rating must be a number from 0 to 10'),
+    ({'title': 'X', 'media_type': 'album', 'tracks': [{'track_number': 1, 'rating': -1}]}, 'track rating'),
+])
+def test_invalid_records_report_their_line(app, ctx, record, message):
+    with pytest.raises(RecordError, match=f'line 3: {message}'):
+        list(iter_records(io.StringIO(json.dumps(movie('A')) + '\n\n' + json.dumps(record) + '\n'), 'jsonl'))
+
+def test_bulk_post_reports_a_bad_record(app, ctx, admin_client):
+    response = admin_client.post('/bulk', data={'format': 'jsonl', 'file': (io.BytesIO(b'{"bad": 1}\n'), 'x.jsonl')},
+                                 content_type='multipart/form-data', follow_redirects=True)
+    assert response.status_code == 200
+    assert b'line 1: title is required' in response.data
+    assert db.session.execute(select(func.count()).select_from(Media)).scalar() == 0
+
+def test_failed_import_finishes_the_committed_batches(app, ctx):
+    library_version = app.extensions['render_cache'].version('library')
+    stats = ImportStats()
+    records = jsonl(*(movie(f'Movie {n}', n) for n in range(4)), {'title': 'Broken', 'media_type': 'book'})
+    with pytest.raises(RecordError):
+        import_records(iter_records(records, 'jsonl'), batch_size=2, stats=stats)
+
+    assert stats.media == 4
+    assert db.session.execute(select(func.count()).select_from(Media)).scalar() == 4
+    # Their similarity lists were written and cached pages invalidated
+    assert db.session.execute(select(func.count(func.distinct(MediaNeighbor.media_id)))).scalar() == 4
+    assert app.extensions['render_cache'].version('library') != library_version
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+def test_export_then_import_keeps_tags(app, ctx, fmt):
+    from project.bulk import export_records, format_records  # lazy import
+    from project.models import Tag  # lazy import
+    # A musical tag on a movie: not the category its media type suggests
+    import_records([{'title': 'Film', 'media_type': 'movie', 'tags': [{'name': 'Rock', 'category': 'musical'}, 'Drama']}])
+    tags_before = db.session.execute(select(Tag.id, Tag.name, Tag.category).order_by(Tag.id)).all()
+
+    exported = ''.join(format_records(export_records(), fmt))
+    import_records(iter_records(io.StringIO(exported), fmt))
+
+    assert db.session.execute(select(Tag.id, Tag.name, Tag.category).order_by(Tag.id)).all() == tags_before
+    first, second = db.session.scalars(select(Media).order_by(Media.id)).all()
+    assert sorted((tag.name, tag.category) for tag in second.tags) == [('Drama', 'cinematic'), ('Rock', 'musical')]
+    assert {tag.id for tag in first.tags} == {tag.id for tag in second.tags}
+
+@pytest.mark.parametrize('broken', [
+    {'title': 'Broken', 'media_type': 'book'},  # RecordError
+    {'title': 'Broken', 'media_type': 'movie', 'creator': ['Two', 'Names']},  # rejected by the database
+])
+def test_import_command_reports_how_far_it_got(app, tmp_path, broken):
+    source = tmp_path / 'library.jsonl'
+    source.write_text(jsonl(*(movie(f'Movie {n}') for n in range(3)), broken).getvalue(), encoding='utf-8')
+    result = app.test_cli_runner().invoke(args=['media', 'import', str(source), '--batch-size', '2'])
+
+    assert result.exit_code == 1
+    assert 'Import failed' in result.output and 'The 2 media before it were imported.' in result.output
+    with app.app_context():
+        assert db.session.execute(select(func.count()).select_from(Media)).scalar() == 2
@@ -0,0 +1,32 @@
+# tests/test_cache.py
+
+from project import create_app, db
+from project.models import Media
+
+from benchmarks.bench_routes import edit_payload
+
+def test_edit_invalidates_every_worker(app, admin_client, load_library):
+    load_library(5)
+    # A second worker on the same database, with its own page cache
+    other = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+                        'UPLOAD_FOLDER': app.config['UPLOAD_FOLDER']}).test_client()
+    first = other.get('/media/1')
+    etag = first.headers['ETag']
+    assert other.get('/media/1', headers={'If-None-Match': etag}).status_code == 304
+    assert other.get('/media/1').data == first.data
+
+    form = admin_client.get('/edit_media/1')
+    assert form.status_code == 200
+    with app.app_context():
+        payload = edit_payload(db.session.get(Media, 1))
+    payload['title'] = 'Renamed Everywhere'
+    assert admin_client.post('/edit_media/1', data=payload).status_code == 302
+
+    revalidated = other.get('/media/1', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 200
+    assert b'Renamed Everywhere' in revalidated.data
+    assert revalidated.headers['ETag'] != etag
+    assert b'Renamed Everywhere' in other.get('/').data
+    with other.application.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
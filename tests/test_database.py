@@ -0,0 +1,73 @@
+# tests/test_database.py
+
+import time
+
+import pytest
+from flask import g
+from sqlalchemy import text
+
+from project import create_app, db
+from project.cache import invalidate
+from project.database import REPLICA_BIND
+from project.models import Media
+from project.schema import SCHEMA_VERSION, schema_version, upgrade_database
+
+MAX_LAG = 0.3
+
+@pytest.fixture
+def replicated(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'DATABASE_REPLICA_URI': f"sqlite:///{tmp_path / 'replica.db'}",
+        'DATABASE_REPLICA_MAX_LAG': MAX_LAG,
+        'RENDER_CACHE_ENABLED': False,
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+    })
+    with app.app_context():
+        upgrade_database()
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+def add_media(app, title):
+    with app.app_context():
+        db.session.add(Media(title=title, media_type='movie', official_rating=7.0))
+        invalidate('library')
+        db.session.commit()
+
+def test_session_reads_from_the_replica_only_when_marked(replicated):
+    with replicated.test_request_context():
+        primary, replica = db.engines[None], db.engines[REPLICA_BIND]
+        assert db.session.get_bind() is primary
+        g.read_replica = True
+        assert db.session.get_bind() is replica
+        session = db.session()
+        session._flushing = True  # flushes always write to the primary
+        try:
+            assert session.get_bind() is primary
+        finally:
+            session._flushing = False
+
+def test_pages_read_the_replica_once_it_has_caught_up(replicated):
+    assert replicated.test_cli_runner().invoke(args=['db', 'sync-replica']).exit_code == 0
+    client = replicated.test_client()
+
+    add_media(replicated, 'Only On The Primary')
+    # Just written: the replica may lag, so pages stay on the primary
+    assert b'Only On The Primary' in client.get('/').data
+    time.sleep(MAX_LAG + 0.1)
+    assert b'Only On The Primary' not in client.get('/').data
+    assert b'<mark>Primary</mark>' in client.get('/search?q=primary').data  # not routed
+
+    assert replicated.test_cli_runner().invoke(args=['db', 'sync-replica']).exit_code == 0
+    assert b'Only On The Primary' in client.get('/').data
+
+def test_schema_version_is_read_from_older_sqlite_databases(app, ctx):
+    assert schema_version() == SCHEMA_VERSION
+    db.session.execute(text('DROP TABLE schema_version'))
+    db.session.execute(text(f'PRAGMA user_version = {SCHEMA_VERSION}'))
+    db.session.commit()
+    assert schema_version() == SCHEMA_VERSION
+    assert upgrade_database() == []
@@ -0,0 +1,92 @@
+# tests/test_editing.py
+
+import logging
+
+from sqlalchemy import select
+
+from project import db
+from project.editing import sync_seasons, sync_tags, sync_tracks
+from project.models import Episode, Media, Season, Tag, Track
+
+from benchmarks.bench_routes import edit_payload
+
+def season_state(media_id):
+    seasons = db.session.execute(select(Season.id, Season.season_number, Season.rating, Season.year)
+                                 .where(Season.media_id == media_id).order_by(Season.season_number)).all()
+    return [{'season_number': number, 'rating': rating, 'year': year,
+             'episodes': [dict(row._mapping) for row in db.session.execute(
+                 select(Episode.episode_number, Episode.title, Episode.rating)
+                 .where(Episode.season_id == season_id).order_by(Episode.episode_number))]}
+            for season_id, number, rating, year in seasons]
+
+def track_state(media_id):
+    return [dict(row._mapping) for row in db.session.execute(
+        select(Track.track_number, Track.title, Track.rating)
+        .where(Track.media_id == media_id).order_by(Track.track_number))]
+
+def episode(number, title, rating=None):
+    return {'episode_number': number, 'title': title, 'rating': rating}
+
+def test_sync_seasons_converges_and_then_touches_nothing(app, ctx):
+    show = Media(title='Show', media_type='tv_show', seasons=[
+        Season(season_number=1, rating=7.0, year='2001', episodes=[
+            Episode(episode_number=1, title='Pilot', rating=7.0),
+            Episode(episode_number=2, title='Second', rating=6.0),
+            Episode(episode_number=2, title='Left behind by an older save')]),
+        Season(season_number=2, rating=8.0, year='2002', episodes=[Episode(episode_number=1, title='Return')]),
+        Season(season_number=2, year='2002'),
+    ])
+    db.session.add(show)
+    db.session.commit()
+
+    wanted = [
+        {'season_number': 1, 'rating': 7.5, 'year': '2001',
+         'episodes': [episode(1, 'Pilot', 7.0), episode(2, 'Second', 6.5), episode(3, 'Third')]},
+        {'season_number': 3, 'rating': None, 'year': '2004', 'episodes': [episode(1, 'Revival', 9.0)]},
+    ]
+    assert sync_seasons(show.id, wanted) > 0
+    db.session.commit()
+    assert season_state(show.id) == wanted
+    assert sync_seasons(show.id, wanted) == 0
+
+def test_sync_tracks_converges_and_then_touches_nothing(app, ctx):
+    album = Media(title='Album', media_type='album', tracks=[
+        Track(track_number=1, title='Intro', rating=5.0),
+        Track(track_number=2, title='Single', rating=8.0),
+        Track(track_number=2, title='Duplicate'),
+        Track(track_number=4, title='Cut'),
+    ])
+    db.session.add(album)
+    db.session.commit()
+
+    wanted = [{'track_number': 1, 'title': 'Intro', 'rating': 5.0},
+              {'track_number': 2, 'title': 'Single (Remastered)', 'rating': 8.0},
+              {'track_number': 3, 'title': 'Outro', 'rating': None}]
+    # Track 2 renamed, its duplicate and track 4 deleted, track 3 added
+    assert sync_tracks(album.id, wanted) == 4
+    db.session.commit()
+    assert track_state(album.id) == wanted
+    assert sync_tracks(album.id, wanted) == 0
+
+def test_sync_tags_touches_only_the_difference(app, ctx):
+    comedy, drama, horror = db.session.scalars(
+        select(Tag.id).where(Tag.name.in_(['Drama', 'Comedy', 'Horror'])).order_by(Tag.name)).all()
+    movie = Media(title='Movie', media_type='movie')
+    db.session.add(movie)
+    db.session.commit()
+    assert sync_tags(movie.id, [drama, comedy]) == 2
+    assert sync_tags(movie.id, [comedy, horror]) == 2
+    assert sync_tags(movie.id, [horror, comedy]) == 0
+
+def test_saving_an_unchanged_form_touches_no_rows(app, admin_client, load_library, caplog):
+    load_library(60)
+    with app.app_context():
+        show = Media.query.filter(Media.seasons.any()).order_by(Media.id).first()
+        album = Media.query.filter(Media.tracks.any()).order_by(Media.id).first()
+        forms = {show.id: edit_payload(show), album.id: edit_payload(album)}
+
+    with caplog.at_level(logging.INFO, logger=app.logger.name):
+        for media_id, form in forms.items():
+            assert admin_client.post(f'/edit_media/{media_id}', data=form).status_code == 302
+    logged = [record.getMessage() for record in caplog.records if record.getMessage().startswith('edit_media')]
+    assert logged == [f'edit_media {media_id}: 0 child rows touched' for media_id in forms]
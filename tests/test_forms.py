@@ -0,0 +1,26 @@
+# tests/test_forms.py
+
+from werkzeug.datastructures import MultiDict
+
+from project.forms import parse_media_children
+
+def test_errors_name_the_nested_field(app):
+    formdata = MultiDict({
+        'season_number_1': '1', 'season_year_1': '2001',
+        'ep_number_1_1': '1', 'ep_title_1_1': 'Pilot', 'ep_rating_1_1': '7',
+        'ep_number_1_2': '2', 'ep_title_1_2': 'Second', 'ep_rating_1_2': '11',
+        'season_number_2': '2',
+        'ep_title_2_1': 'No number: skipped',
+        'ep_number_2_2': '1', 'ep_rating_2_2': '-1',
+        'track_number_1': '1', 'track_rating_1': '4',
+        'track_number_2': '2', 'track_rating_2': '12',
+    })
+    with app.test_request_context():
+        seasons, tracks, errors = parse_media_children(formdata)
+
+    assert seasons == [] and tracks == [{'track_number': 1, 'title': '', 'rating': 4.0}]
+    assert errors == [
+        'Season 1: seasons-0-episodes-1-rating: Number must be between 0 and 10.',
+        'Season 2: seasons-1-episodes-0-rating: Number must be between 0 and 10.',
+        'Track 2: tracks-1-rating: Number must be between 0 and 10.',
+    ]
@@ -0,0 +1,61 @@
+# tests/test_instrumentation.py
+
+import logging
+
+import pytest
+from sqlalchemy import event
+
+from project import db
+
+TOKEN = 'scrape-me'
+
+@pytest.fixture
+def metrics_client(app):
+    app.config['METRICS_TOKEN'] = TOKEN
+    return app.test_client()
+
+def scrape(client):
+    response = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    return dict(line.rsplit(' ', 1) for line in response.text.splitlines() if not line.startswith('#'))
+
+def test_query_count_header_counts_the_request_statements(app, load_library):
+    load_library(20)
+    app.config['RENDER_CACHE_ENABLED'] = False
+    with app.app_context():
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    response = app.test_client().get('/media/1')
+    assert int(response.headers['X-Query-Count']) == len(statements) > 0
+    app.config['SQL_QUERY_COUNT_HEADER'] = False
+    assert 'X-Query-Count' not in app.test_client().get('/media/1').headers
+
+def test_requests_are_recorded_per_endpoint(metrics_client, load_library):
+    load_library(20)
+    for _ in range(3):
+        # Requests are recorded when the server closes the response
+        with metrics_client.get('/stats') as response:
+            assert response.status_code == 200
+    metrics = scrape(metrics_client)
+
+    assert metrics['http_requests_total{endpoint="main.stats",method="GET",status="200"}'] == '3'
+    for histogram in ('http_request_duration_seconds', 'http_request_db_seconds', 'http_request_queries'):
+        assert metrics[f'{histogram}_count{{endpoint="main.stats"}}'] == '3'
+    # The other two were served from the render cache
+    assert metrics['http_request_render_seconds_count{endpoint="main.stats"}'] == '1'
+    assert float(metrics['http_request_queries_sum{endpoint="main.stats"}']) >= 3
+    assert int(metrics['sql_statement_duration_seconds_count']) > 0
+
+def test_metrics_need_the_token(app, metrics_client):
+    assert metrics_client.get('/metrics').status_code == 401
+    assert metrics_client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    app.config['METRICS_TOKEN'] = None
+    assert metrics_client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+def test_slow_statements_are_logged(app, metrics_client, caplog):
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        metrics_client.get('/stats').close()
+    assert any(record.getMessage().startswith('Slow query') for record in caplog.records)
+    assert int(scrape(metrics_client)['sql_slow_statements_total']) > 0
@@ -0,0 +1,38 @@
+# tests/test_leaderboards.py
+
+import random
+
+from sqlalchemy import func, select
+
+from project import db
+from project.leaderboards import rebuild_leaderboards, refresh_leaderboards
+from project.models import LeaderboardEntry, LeaderboardTier, Media, Track
+
+def boards():
+    """Every entry and tier count, as plain tuples."""
+    entries = db.session.execute(select(LeaderboardEntry.board, LeaderboardEntry.media_id,
+                                        LeaderboardEntry.track_id, LeaderboardEntry.score,
+                                        LeaderboardEntry.tier)).all()
+    tiers = db.session.execute(select(LeaderboardTier.board, LeaderboardTier.tier,
+                                      LeaderboardTier.count)).all()
+    return set(map(tuple, entries)), set(map(tuple, tiers))
+
+def test_incremental_refresh_matches_rebuild(app, ctx, load_library, random_edit):
+    load_library(300, seed=7)
+    rng = random.Random(7)
+
+    for _ in range(200):
+        refresh_leaderboards([random_edit(rng, ('rating', 'type', 'tags', 'tracks', 'tracks', 'add', 'delete'))])
+        db.session.commit()
+    incremental = boards()
+
+    rebuild_leaderboards()
+    db.session.commit()
+    assert boards() == incremental
+
+    # The album rollups the scores come from match their tracks too
+    actual = dict(db.session.execute(
+        select(Track.media_id, func.count(Track.rating)).group_by(Track.media_id)).all())
+    for media_id, media_type, count in db.session.execute(
+            select(Media.id, Media.media_type, Media.track_rating_count)):
+        assert count == (actual.get(media_id, 0) if media_type == 'album' else 0)
@@ -0,0 +1,35 @@
+# tests/test_listing.py
+
+import pytest
+from sqlalchemy import select
+
+from project import db
+from project.listing import paginate_songs, tag_filter_clause
+from project.models import Media, Tag, Track
+
+@pytest.fixture
+def tagged(app, ctx):
+    """Media carrying both, one or none of the Drama and Comedy tags."""
+    drama, comedy, horror = (db.session.scalars(select(Tag).where(Tag.name == name)).one()
+                             for name in ('Drama', 'Comedy', 'Horror'))
+    library = {
+        'both': Media(title='Both', media_type='album', tags=[drama, comedy], tracks=[Track(title='Both Track')]),
+        'subset': Media(title='Subset', media_type='album', tags=[drama], tracks=[Track(title='Subset Track')]),
+        'other': Media(title='Other', media_type='album', tags=[horror], tracks=[Track(title='Other Track')]),
+    }
+    db.session.add_all(library.values())
+    db.session.commit()
+    return {name: media.id for name, media in library.items()}, [drama.id, comedy.id]
+
+@pytest.mark.parametrize('mode, expected', [('any', {'both', 'subset'}), ('all', {'both'})])
+def test_all_needs_every_tag(client, tagged, mode, expected):
+    ids, tag_ids = tagged
+    matched = set(db.session.scalars(select(Media.id).where(tag_filter_clause(Media.id, tag_ids, mode))))
+    assert matched == {ids[name] for name in expected}
+    assert {row.title for row in paginate_songs('title_asc', tag_ids, mode)} == {f'{name.title()} Track'
+                                                                                  for name in expected}
+
+    query = '&'.join(f'tag={tag_id}' for tag_id in tag_ids) + f'&mode={mode}'
+    page = client.get(f'/?{query}').data
+    assert (b'Subset' in page) == ('subset' in expected)
+    assert b'Both' in page and b'Other' not in page
@@ -0,0 +1,50 @@
+# tests/test_queries.py
+
+import pytest
+from sqlalchemy import func, select
+
+from project import db
+from project.models import Media, Season
+
+def query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return int(response.headers['X-Query-Count'])
+
+@pytest.fixture
+def uncached(app):
+    app.config['RENDER_CACHE_ENABLED'] = False
+    return app
+
+def shows_by_season_count():
+    return db.session.scalars(select(Season.media_id).group_by(Season.media_id)
+                              .order_by(func.count(), Season.media_id)).all()
+
+@pytest.mark.parametrize('url', ['/', '/?sort=score_desc', '/?filter=movie&sort=year_asc', '/?filter=songs', '/?tag=1'])
+def test_index_query_budget(uncached, admin_client, load_library, url):
+    load_library(100)
+    # The tag list and the page; the logged-in user is one more
+    assert query_count(uncached.test_client(), url) == 2
+    assert query_count(admin_client, url) == 3
+    load_library(400, seed=1)
+    assert query_count(admin_client, url) == 3
+
+def test_media_page_query_budget(uncached, admin_client, load_library):
+    load_library(300)
+    with uncached.app_context():
+        shows = shows_by_season_count()
+        assert len(db.session.get(Media, shows[0]).seasons) < len(db.session.get(Media, shows[-1]).seasons)
+        movie_id = db.session.scalar(select(Media.id).where(Media.media_type == 'movie'))
+
+    anonymous = uncached.test_client()
+    assert query_count(anonymous, f'/media/{movie_id}') == 5
+    # Seasons and episodes cost one query each, however many there are
+    assert query_count(anonymous, f'/media/{shows[0]}') == query_count(anonymous, f'/media/{shows[-1]}') == 6
+    # Plus the logged-in user and their rating
+    assert query_count(admin_client, f'/media/{shows[-1]}') <= 8
+
+def test_cached_pages_only_read_their_versions(client, load_library):
+    load_library(20)
+    for url in ('/', '/media/1'):
+        client.get(url)
+        assert query_count(client, url) == 1
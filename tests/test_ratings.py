@@ -0,0 +1,87 @@
+# tests/test_ratings.py
+
+import random
+import re
+
+import pytest
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from project import db
+from project.models import Media, User, UserRating
+from project.ratings import rate, recompute_rollups
+from project.schema import ADMIN_PASSWORD, ADMIN_USERNAME
+
+def csrf_token(page):
+    return re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1).decode()
+
+def test_rating_requires_csrf_token(app, ctx, client, load_library):
+    load_library(5)
+    app.config['WTF_CSRF_ENABLED'] = True
+    token = csrf_token(client.get('/login').data)
+    client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD, 'csrf_token': token})
+
+    # A form posted from another site has no token
+    client.post('/media/1/rate', data={'rating': '3'})
+    assert db.session.get(Media, 1).user_rating_count == 0
+
+    page = client.get('/media/1')
+    assert 'ETag' not in page.headers  # rendered per request, not from the render cache
+    client.post('/media/1/rate', data={'rating': '3', 'csrf_token': csrf_token(page.data)})
+    db.session.expire_all()
+    assert db.session.get(Media, 1).user_rating_count == 1
+
+def test_rollups_match_recompute(app, ctx, load_library):
+    load_library(40)
+    users = [User(username=f'user{n}', password=generate_password_hash('secret')) for n in range(8)]
+    db.session.add_all(users)
+    db.session.commit()
+    media_ids = db.session.scalars(select(Media.id)).all()
+
+    # Set, change and clear ratings, including 0 and repeats of the same value
+    rng = random.Random(11)
+    for _ in range(400):
+        rate(rng.choice(users).id, rng.choice(media_ids),
+             rng.choice((None, None, 0.0, 10.0, round(rng.uniform(0, 10), 1))))
+        db.session.commit()
+    assert recompute_rollups() == 0
+
+    actual = {media_id: (count, total) for media_id, count, total in db.session.execute(
+        select(UserRating.media_id, func.count(), func.sum(UserRating.rating)).group_by(UserRating.media_id))}
+    for media in db.session.scalars(select(Media)):
+        count, total = actual.get(media.id, (0, 0.0))
+        assert media.user_rating_count == count
+        assert media.community_score == pytest.approx(total / count if count else 0.0)
+
+def test_songs_view_has_no_community_sort(client, load_library):
+    load_library(20)
+    page = client.get('/?filter=songs&sort=community_desc').data
+    assert b'value="community_desc"' not in page
+    assert b'value="title_asc" selected' in page
+    assert b'value="community_desc" selected' in client.get('/?filter=all&sort=community_desc').data
+
+def test_raters_cannot_change_the_library(app, ctx, client, load_library):
+    load_library(5)
+    db.session.add(User(username='rater', password=generate_password_hash('secret')))
+    db.session.commit()
+    client.post('/login', data={'username': 'rater', 'password': 'secret'})
+
+    assert client.post('/delete_media/1').status_code == 403
+    assert client.get('/edit_media/1').status_code == 403
+    assert client.post('/edit_media/1', data={'title': 'Renamed', 'media_type': 'movie'}).status_code == 403
+    assert client.get('/add_media').status_code == 403
+    assert client.get('/bulk').status_code == 403
+    assert client.get('/bulk/export.jsonl').status_code == 403
+    db.session.expire_all()
+    assert db.session.get(Media, 1).title != 'Renamed'
+    assert b'Import / Export' not in client.get('/').data
+
+    assert client.post('/media/1/rate', data={'rating': '7'}).status_code == 302
+    db.session.expire_all()
+    assert db.session.get(Media, 1).user_rating_count == 1
+
+def test_admin_can_delete(app, ctx, admin_client, load_library):
+    load_library(5)
+    assert b'Import / Export' in admin_client.get('/').data
+    assert admin_client.post('/delete_media/1').status_code == 302
+    assert db.session.get(Media, 1) is None
@@ -0,0 +1,64 @@
+# tests/test_search.py
+
+from sqlalchemy import text
+
+from project import db
+from project.models import Episode, Media, Season, Track
+from project.search import build_match_query, search
+
+def index_rows():
+    return {row.rowid: (row.kind, row.media_id, row.title, row.creator) for row in db.session.execute(
+        text("SELECT rowid, kind, media_id, title, creator FROM search_index"))}
+
+def test_triggers_keep_the_index_in_sync(app, ctx):
+    album = Media(title='Blue Harbor', creator='The Lanterns', media_type='album',
+                  tracks=[Track(title='Tidewater', track_number=1)])
+    show = Media(title='Night Shift', creator='Ana Ruiz', media_type='tv_show',
+                 seasons=[Season(season_number=1, episodes=[Episode(title='Pilot Light', episode_number=1)])])
+    db.session.add_all([album, show])
+    db.session.commit()
+    track, episode = album.tracks[0], show.seasons[0].episodes[0]
+
+    # Each row's rowid says what it is: media id * 4, track id * 4 + 1, episode id * 4 + 2
+    rows = index_rows()
+    assert rows[album.id * 4] == ('media', album.id, 'Blue Harbor', 'The Lanterns')
+    assert rows[track.id * 4 + 1] == ('track', album.id, 'Tidewater', None)
+    assert rows[episode.id * 4 + 2] == ('episode', show.id, 'Pilot Light', None)
+
+    album.title, track.title, episode.title = 'Red Harbor', 'Undertow', 'Pilot Fire'
+    db.session.commit()
+    rows = index_rows()
+    assert rows[album.id * 4][2:] == ('Red Harbor', 'The Lanterns')
+    assert rows[track.id * 4 + 1][2] == 'Undertow'
+    assert rows[episode.id * 4 + 2][2] == 'Pilot Fire'
+    assert [result['kind'] for result in search('undertow')] == ['track']
+    assert search('tidewater') == []
+
+    db.session.delete(album)
+    db.session.delete(show)
+    db.session.commit()
+    assert index_rows() == {}
+
+def test_match_query_takes_operators_literally(app, ctx):
+    assert build_match_query('star wa') == '"star"* "wa"*'
+    assert build_match_query('say "hi" -now *x', prefix=False) == '"say" "hi" "now" "x"'
+    assert build_match_query('a "NEAR" b*') == '"a" "NEAR"* "b"'
+    assert build_match_query('"*-') is None
+
+    db.session.add(Media(title='Say "Hi" - Now', creator='AC/DC', media_type='single'))
+    db.session.commit()
+    for query in ('say "hi -now', '-now', 'AC/DC*', '*hi*'):
+        assert [result['media_title'] for result in search(query)] == ['Say "Hi" - Now']
+    # NOT is a word to find, not an operator excluding 'say'
+    assert search('NOT say') == []
+
+def test_suggest_returns_prefix_matches_as_json(client, load_library):
+    load_library(60)
+    suggestions = client.get('/search/suggest?q=wi').get_json()
+    assert 0 < len(suggestions) <= 8
+    for suggestion in suggestions:
+        assert set(suggestion) == {'media_id', 'kind', 'title', 'match', 'url'}
+        assert suggestion['url'] == f"/media/{suggestion['media_id']}"
+        assert '<' not in suggestion['title']
+    assert client.get('/search/suggest?q=').get_json() == []
+    assert client.get('/search/suggest?q=%22*').get_json() == []
@@ -0,0 +1,51 @@
+# tests/test_similarity.py
+
+import random
+
+from sqlalchemy import select
+
+from project import db
+from project.models import MediaNeighbor
+from project.similarity import (NEIGHBOR_COUNT, _IndexedSource, _LoadedSource, _load_profiles, _neighbors,
+                                rebuild_similarity, refresh_similarity, similarity)
+
+def brute_force(profiles):
+    """Every media's NEIGHBOR_COUNT best scores, comparing it with every other media."""
+    return {profile.media_id: sorted((similarity(profile, other) for other in profiles
+                                      if other.media_id != profile.media_id), reverse=True)[:NEIGHBOR_COUNT]
+            for profile in profiles}
+
+def scores(lists):
+    # Compared by score: media tying at the end of a list may be swapped
+    return {media_id: [score for _, score in neighbors] for media_id, neighbors in lists.items()}
+
+def stored_lists():
+    lists = {}
+    for media_id, neighbor_id, score in db.session.execute(
+            select(MediaNeighbor.media_id, MediaNeighbor.neighbor_id, MediaNeighbor.score)
+            .order_by(MediaNeighbor.media_id, MediaNeighbor.rank)):
+        lists.setdefault(media_id, []).append((neighbor_id, score))
+    return lists
+
+def test_neighbors_match_brute_force(app, ctx, load_library):
+    load_library(395, seed=3)
+    profiles = list(_load_profiles().values())
+    expected = brute_force(profiles)
+
+    indexed, loaded = _IndexedSource(), _LoadedSource(profiles)
+    assert scores({p.media_id: _neighbors(p, indexed) for p in profiles}) == expected
+    assert scores({p.media_id: _neighbors(p, loaded) for p in profiles}) == expected
+
+def test_incremental_refresh_matches_rebuild(app, ctx, load_library, random_edit):
+    load_library(395, seed=5)
+    rng = random.Random(5)
+
+    for _ in range(120):
+        refresh_similarity([random_edit(rng, ('rating', 'creator', 'type', 'tags', 'tags', 'add', 'delete'))])
+        db.session.commit()
+    incremental = scores(stored_lists())
+
+    rebuild_similarity()
+    db.session.commit()
+    assert incremental == scores(stored_lists())
+    assert incremental == brute_force(list(_load_profiles().values()))
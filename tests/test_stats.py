@@ -0,0 +1,30 @@
+# tests/test_stats.py
+
+from project import db
+from project.leaderboards import refresh_leaderboards
+from project.models import Media, Track
+from project.stats import compute_library_stats
+
+def add(media_type, official_rating, creator='Someone', tracks=()):
+    media = Media(title='Title', creator=creator, years='1995', media_type=media_type,
+                  official_rating=official_rating, tracks=[Track(title='Track', track_number=n, rating=rating)
+                                                           for n, rating in enumerate(tracks, start=1)])
+    db.session.add(media)
+    db.session.flush()
+    media.refresh_derived_fields()
+    refresh_leaderboards([media.id])
+
+def test_zero_ratings_count_and_unrated_media_do_not(app, ctx):
+    add('movie', 0.0)
+    add('movie', 8.0)
+    add('movie', None)
+    add('album', None, tracks=(0.0, 0.0))
+    add('album', None, tracks=(None,))
+    db.session.commit()
+
+    stats = compute_library_stats()
+    assert stats['media_type']['movie']['count'] == 2
+    assert stats['media_type']['movie']['min'] == 0.0
+    assert stats['media_type']['album']['count'] == 1
+    assert stats['decade']['1990s']['count'] == 3
+    assert stats['creator']['Someone']['count'] == 3
@@ -0,0 +1,88 @@
+# tests/test_uploads.py
+
+import hashlib
+import io
+import os
+
+from PIL import Image
+from sqlalchemy import event
+from werkzeug.datastructures import FileStorage
+
+from project import db, uploads
+from project.models import Media, UploadDerivative
+from project.uploads import HASHED_NAME_RE, derivative_name, get_storage, save_file, upload_url
+
+class InlineExecutor:
+    """Runs the derivative jobs in the test's thread."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+def image_upload(filename, color='red', image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 60), color).save(buffer, image_format)
+    buffer.seek(0)
+    return FileStorage(buffer, filename=filename)
+
+def test_pages_link_recorded_derivatives_without_probing_storage(app, monkeypatch):
+    monkeypatch.setattr(uploads, '_get_executor', InlineExecutor)
+    with app.test_request_context():
+        stored = save_file(image_upload('poster.png'))
+        broken = save_file(FileStorage(io.BytesIO(b'not an image'), filename='poster.png'))
+        assert get_storage().exists(derivative_name(stored, 'thumb'))
+
+    with app.test_request_context():
+        def probe(name):
+            raise AssertionError(f'storage probed for {name}')
+        monkeypatch.setattr(get_storage(), 'exists', probe)
+        assert upload_url(stored, 'thumb') == f"/uploads/{derivative_name(stored, 'thumb')}"
+        assert upload_url(broken, 'thumb') == f'/uploads/{broken}'
+        assert upload_url('legacy.jpg', 'thumb') == '/uploads/legacy.jpg'
+
+def test_stored_name_comes_from_the_content(app, monkeypatch):
+    monkeypatch.setattr(uploads, '_get_executor', InlineExecutor)
+    with app.test_request_context():
+        png = save_file(image_upload('poster.jpg'))
+        assert png.endswith('.png')
+        assert save_file(image_upload('copy.jpeg')) == png
+        assert save_file(image_upload('poster.png', image_format='JPEG')).endswith('.jpg')
+        assert save_file(FileStorage(io.BytesIO(b'not an image'), filename='poster.png')).endswith('.bin')
+    assert app.test_client().get(f'/uploads/{png}').mimetype == 'image/png'
+
+def test_pages_look_up_the_uploads_they_show_in_one_query(app, load_library):
+    app.config['RENDER_CACHE_ENABLED'] = False
+    load_library(100)
+    with app.app_context():
+        media = Media.query.order_by(Media.id).all()
+        for item in media:
+            content_hash = hashlib.sha256(str(item.id).encode()).hexdigest()
+            item.poster_img = f'{content_hash[:2]}/{content_hash}.png'
+        db.session.add_all(UploadDerivative(filename=item.poster_img) for item in media[::2])
+        db.session.commit()
+        movie = next(item for item in media if item.media_type == 'movie')
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    client = app.test_client()
+    for url in ('/', '/?filter=songs', f'/media/{movie.id}', '/leaderboard'):
+        statements.clear()
+        body = client.get(url).data
+        assert b'.thumb.webp' in body
+        assert len([statement for statement in statements if 'upload_derivative' in statement]) == 1
+
+def test_rehash_moves_legacy_uploads_to_content_addressed_names(app, monkeypatch):
+    with app.app_context():
+        image_upload('poster.png').save(os.path.join(app.config['UPLOAD_FOLDER'], 'legacy.png'))
+        db.session.add(Media(title='Legacy', media_type='movie', official_rating=7.0,
+                             poster_img='legacy.png', banner_img='gone.jpg'))
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['uploads', 'rehash'])
+    assert result.exit_code == 0, result.output
+    assert 'gone.jpg' in result.output
+
+    with app.test_request_context():
+        media = Media.query.filter_by(title='Legacy').one()
+        assert HASHED_NAME_RE.match(media.poster_img) and media.banner_img == 'gone.jpg'
+        assert upload_url(media.poster_img, 'thumb') == f"/uploads/{derivative_name(media.poster_img, 'thumb')}"
+    assert app.test_cli_runner().invoke(args=['uploads', 'rehash']).output.startswith('Rehashed 0 uploads')